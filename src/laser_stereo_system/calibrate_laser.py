@@ -1,5 +1,7 @@
 import numpy as np
-from laser_detection import cupy, color_reward, gval, pxpatch, subpx
+from laser_detection import color_reward, gval, pxpatch, subpx
+from laser_detection import fused as laser_fused
+from laser_detection.lineassoc import associate_patches, line_groups
 import os
 from PIL import Image
 from debug.fancylogging import *
@@ -16,6 +18,9 @@ from debug.debugshow import debugshow
 import matplotlib.pyplot as plt
 from numba import jit, njit
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from util import sharedimages, chessboard, diskcache, planefit
 
 DEFAULT_ROI = LaserDetection.DEFAULT_ROI
 NUM_LASER_LINES = LaserDetection.NUM_LASER_LINES
@@ -44,9 +49,10 @@ def throw_out_outlier_clusters(img, gvals):
     pot_pts = np.float32(gvals[:,:2])
     # 3 clusters, no given labels, 10 attempts
     compactness, labels, centers = cv.kmeans(pot_pts, 3, None, criteria, 10, flags)
-    A = pot_pts[labels.ravel()==0]
-    B = pot_pts[labels.ravel()==1]
-    C = pot_pts[labels.ravel()==2]
+    # keep whole rows so any per-window data (G value, subpixel offset) survives the filter
+    A = gvals[labels.ravel()==0]
+    B = gvals[labels.ravel()==1]
+    C = gvals[labels.ravel()==2]
     clustering_img = img.copy()
     print("cluster centers")
     print(centers)
@@ -77,7 +83,7 @@ def throw_out_outlier_clusters(img, gvals):
     print("ROI(minX,maxX,minY,maxY) = (%d, %d, %d, %d)" % (minx, maxx, miny, maxy))
     for idx, cluster in enumerate(clusters):
         for clusterptidx, val in enumerate(cluster):
-            x, y = val
+            x, y = val[:2]
             x, y = int(x), int(y)
             cv.circle(clustering_img, (x, y), 2, DISP_COLORS[idx], cv.FILLED)
         center = centers[idx]
@@ -88,7 +94,7 @@ def throw_out_outlier_clusters(img, gvals):
     goodclustering_img = img.copy()
     for idx, cluster in enumerate(goodclusters):
         for clusterptidx, val in enumerate(cluster):
-            x, y = val
+            x, y = val[:2]
             x, y = int(x), int(y)
             cv.circle(goodclustering_img, (x, y), 2, DISP_COLORS[idx], cv.FILLED)
     cv.rectangle(goodclustering_img, (minx, miny), (maxx, maxy), (255, 0, 0), 3)
@@ -135,204 +141,235 @@ def segmentation(img, orig):
     mergedlines = mergedlines[mergedlines[:, 0].argsort()] 
     return mergedlines
 
-@jit(forceobj=True)
 def imagept_laserplane_assoc(patches, polarlines):
-    '''Associate each laser patch with a line.'''
-    # associate each laser patch with a line
-    # for more accuracy could calculate each patch's centroid or calculate an average distance from line of all points of a patch
-    # for speed could just pick one point from patch, will likely be enough given circumstances
-    # we throw out patches too far from any lines
-    maxdistfromline = 50 # px
-    patchgroups = [[0, []] for _ in range(NUM_LASER_LINES)]
-    for patch in patches:
-        y, x, subpixel_offset_x = patch[0] # get point in patch
-        x += subpixel_offset_x # add subpixel offset to x
-        r_p = math.sqrt(x**2 + y**2) # get radius from origin to pt
-        th_p = math.atan2(y, x) # get theta from +x axis to pt
-        bestline = 0 # idx of best line
-        minval = float('inf') # distance from point to best line
-        for idx, line in enumerate(polarlines):
-            r, th = polarlines[idx] # r, th for cur line
-            d = abs(r - r_p * math.cos(th - th_p)) # distance from pt to cur line
-            if d < minval: # if found shorter distance
-                minval = d
-                bestline = idx
-        if minval < maxdistfromline:
-            patchgroups[bestline][1].append(patch)
-            patchgroups[bestline][0] += len(patch)
-    return patchgroups
+    '''Associate each laser patch in a PatchSet with the line closest to its centroid. Returns the 
+    line index of each patch, or -1 for patches too far from every line.'''
+    return associate_patches(patches, polarlines)
+
+def detect_calibration_image_points(imgidx, filename, img, square_size_m: float, chessboard_dims: tuple[int,int], min_gval, gpu=False, fused=False):
+    '''Finds the chessboard plane and the laser points on it in one calibration image. Returns a dict 
+    of arrays grouped by line in increasing line order: imgpts (N,2) float32 image (row, col), pts3d 
+    (N,3) float32 3D points and lines (N,) uint8 line indexes, or None if the image is discarded.'''
+    log_header(f"Processing image {imgidx}: {filename}")#logheader
+    ####### Finding Chessboard #######
+
+    board = chessboard.locate_chessboard(img, square_size_m, chessboard_dims, mtx)
+    if board is None:
+        print(f"Couldn't find chessboard, discarding image {imgidx}...") # logwarn
+        return None
+    log_info("Chessboard -> Cam Transformation Mat:")
+    for row in board["world2cam"]: log_info(row)
+    chessboard_plane = tuple(board["plane"])
+    log_info(f"Chessboard plane:\n{chessboard_plane}")
+
+    ####### Done Finding Chessboard #######
+
+
+    if gpu: 
+        rowmin = int(DEFAULT_ROI[0][0] * img.shape[0])
+        rowmax = int(DEFAULT_ROI[1][0] * img.shape[0])+1
+        colmin = int(DEFAULT_ROI[0][1] * img.shape[1])
+        colmax = int(DEFAULT_ROI[1][1] * img.shape[1])+1
+        roi_img = img[rowmin:rowmax,colmin:colmax]
+        reward = color_reward.get_reward_gpu(roi_img)
+        debugshow(reward / np.max(reward), "Reward")
+        gvals = gval.calculate_gaussian_integral_windows_gpu(reward, min_gval).copy_to_host()
+        debugshow(gvals, "Gvals")
+        subpxs = subpx.find_gval_subpixels_gpu(gvals, reward, min_gval)
+        debugshow(subpx, "Subpxs")
+        filtered, patches = pxpatch.throw_out_small_patches_gpu(subpxs)
+    elif fused:
+        candidates = laser_fused.find_gval_subpixels_fused(img, min_gval)
+        candidates = throw_out_outlier_clusters(img, candidates)
+        if candidates is None: return None
+        subpxs = laser_fused.subpixel_image(candidates, img.shape[:2])
+        dispsubpxs = np.zeros(subpxs.shape, dtype=np.float)
+        dispsubpxs[subpxs != 0] = 1.
+        debugshow(dispsubpxs, "Subpxs")
+        filtered, patches = pxpatch.throw_out_small_patches(subpxs)
+        rowmin = 0
+        colmin = 0
+    else: 
+        reward = color_reward.get_reward(img)
+        debugshow(reward / np.max(reward), "Reward")
+
+        gvals = gval.calculate_gaussian_integral_windows_vec(reward, min_gval)
+        gvals = throw_out_outlier_clusters(img, gvals)
+
+        gvalimg = np.zeros(reward.shape, dtype=np.float)
+        for g in gvals:
+            col, row = int(g[0]), int(g[1]) 
+            gvalimg[row, col] = 1.
+        debugshow(gvalimg, "Gvals")
+
+        if gvals is None: return None
+        subpxs = subpx.find_gval_subpixels(gvals, reward)
+        dispsubpxs = np.zeros(subpxs.shape, dtype=np.float)
+        dispsubpxs[subpxs != 0] = 1.
+        debugshow(dispsubpxs, "Subpxs")
+        filtered, patches = pxpatch.throw_out_small_patches(subpxs)
+        rowmin = 0
+        colmin = 0
+
+
+    laserpxbinary = np.zeros(filtered.shape, dtype=np.uint8)
+    laserpxbinary[filtered != 0] = 255
+    debugshow(laserpxbinary, "Laser Pixels")
+    lines = segmentation(laserpxbinary, img)
+    if lines is None: return None
+
+    if DEBUG:
+        mergedlinesimg = img.copy() if not gpu else roi_img.copy()
+        draw_polar_lines(mergedlinesimg, lines)
+        debugshow(mergedlinesimg, "Merged Lines")
+    
+    patchlines = imagept_laserplane_assoc(patches, lines)
+    
+
+    ####### Extract 3D Points #######
+
+    ptsimg = img.copy()
+    ptidxs = np.concatenate(line_groups(patches.point_lines(patchlines), NUM_LASER_LINES))
+    lines = patches.point_lines(patchlines)[ptidxs]
+    rows = patches.rows[ptidxs] + rowmin
+    cols = patches.cols[ptidxs] + colmin + patches.offsets[ptidxs]
+    pts3d = mathutil.px_2_3d_many(rows, cols, chessboard_plane, mtx).astype(np.float32)
+    for idx in range(NUM_LASER_LINES): 
+        print("line %d has %d patches" % (idx, np.count_nonzero(patchlines == idx)))
+        online = lines == idx
+        ptsimg[rows[online], cols[online].astype(int)] = DISP_COLORS[idx]
+    debugshow(ptsimg, "Grouped Points")
+    
+    ####### Done Extracting 3D Points #######
+
+
+    if DEBUG: cv.waitKey(0)
+    return {
+        "imgpts": np.stack((rows, cols), axis=1).astype(np.float32),
+        "pts3d": pts3d,
+        "lines": lines.astype(np.uint8),
+    }
+
+def calibration_points_key(img, square_size_m: float, chessboard_dims: tuple[int,int], min_gval, gpu=False, fused=False) -> str:
+    '''Cache key of the laser points of a calibration image: the image content plus every parameter 
+    the points depend on'''
+    return diskcache.content_key(
+        "calibpts", LaserCalibration.POINTS_CACHE_VERSION, np.asarray(img), float(square_size_m), tuple(chessboard_dims),
+        float(min_gval), bool(gpu), bool(fused), tuple(LaserDetection.DEFAULT_COLOR_WEIGHTS), LaserDetection.GVAL_WINLEN,
+        DEFAULT_ROI if gpu else None, LaserDetection.MAX_DIST_FROM_LINE, LaserDetection.MIN_PATCH_SIZE,
+        MERGE_HLP_LINES_ANG_THRESH, MERGE_HLP_LINE_DIST_THRESH, np.asarray(mtx, dtype=np.float64))
+
+def calibration_image_points(imgidx, filename, img, square_size_m: float, chessboard_dims: tuple[int,int], min_gval, gpu=False, fused=False, cache_dir=LaserCalibration.POINTS_CACHE_DIR):
+    '''Finds the chessboard plane and the 3D laser points on it in one calibration image. Returns 
+    a list of NUM_LASER_LINES (n,3) arrays of points per line, or None if the image is discarded.
+    Results are cached per image in cache_dir (None disables the cache), so recalibrating only 
+    processes images whose content or detection parameters changed.'''
+    key = None
+    entry = None
+    if cache_dir is not None:
+        key = calibration_points_key(img, square_size_m, chessboard_dims, min_gval, gpu, fused)
+        entry = diskcache.load(cache_dir, key)
+        if entry is not None:
+            log_info(f"Using cached points for image {imgidx}: {filename}")
+            if not entry["found"]: return None
+    if entry is None:
+        entry = detect_calibration_image_points(imgidx, filename, img, square_size_m, chessboard_dims, min_gval, gpu=gpu, fused=fused)
+        if key is not None:
+            if entry is None: diskcache.save(cache_dir, key, found=False)
+            else: diskcache.save(cache_dir, key, found=True, **entry)
+        if entry is None: return None
+    bounds = np.searchsorted(entry["lines"], np.arange(NUM_LASER_LINES + 1))
+    return [entry["pts3d"][bounds[idx]:bounds[idx+1]] for idx in range(NUM_LASER_LINES)]
+
+def _calibration_image_worker(args):
+    '''Process pool entry point running calibration_image_points on an image in shared memory'''
+    shmname, spec, imgidx, filename, square_size_m, chessboard_dims, min_gval, fused = args
+    img = sharedimages.shared_image(shmname, spec)
+    try:
+        return calibration_image_points(imgidx, filename, img, square_size_m, chessboard_dims, min_gval, fused=fused)
+    finally:
+        # other images of the set may go to other workers, don't keep the block mapped in between
+        del img
+        sharedimages.release(shmname)
+
+def submit_calibration_images(pool, imgs, square_size_m: float, chessboard_dims: tuple[int,int], min_gval, fused=False):
+    '''Queues calibration_image_points for every image on a process pool, passing the images through 
+    shared memory. Returns the SharedImages holding them, to be closed once the futures are done, 
+    and the futures in image order.'''
+    shared = sharedimages.SharedImages([img for _, img in imgs])
+    try:
+        futures = [
+            pool.submit(_calibration_image_worker, (shared.name, spec, imgidx, filename, square_size_m, chessboard_dims, min_gval, fused))
+            for imgidx, ((filename, _), spec) in enumerate(zip(imgs, shared.specs))
+        ]
+    except BaseException:
+        shared.close()
+        raise
+    return shared, futures
+
+def merge_image_points(imgpoints) -> list[list[np.ndarray]]:
+    '''Merges per-image results of calibration_image_points into per-line lists of point arrays, in 
+    image order so the result doesn't depend on which image finished first'''
+    Pts3d = [[] for _ in range(NUM_LASER_LINES)] # (n,3) arrays of 3D pts per image
+    for linepts in imgpoints:
+        if linepts is None: continue
+        for idx, pts in enumerate(linepts):
+            Pts3d[idx].append(pts)
+    return Pts3d
+
+def log_plane_progress(accumulators, linepts):
+    '''Adds an image's per-line points to running plane fits and logs the rms residual of each 
+    line's current plane, to watch calibration quality as images are processed'''
+    residuals = []
+    for accumulator, pts in zip(accumulators, linepts):
+        accumulator.add(pts)
+        fit = accumulator.plane()
+        residuals.append("-" if fit is None else f"{fit[2] * 1000:.2f}")
+    log_info(f"Running plane rms residuals (mm): {' '.join(residuals)}")
+
+def gather_image_points(futures) -> list:
+    '''Waits for the calibration_image_points futures of an image set in image order, logging the 
+    running plane fits like the serial path does as each image's points come in'''
+    imgpoints = []
+    accumulators = [planefit.PlaneAccumulator() for _ in range(NUM_LASER_LINES)]
+    for future in futures:
+        linepts = future.result()
+        imgpoints.append(linepts)
+        if linepts is not None: log_plane_progress(accumulators, linepts)
+    return imgpoints
 
 #@jit(forceobj=True)
-def calibrate(imgs: list[np.ndarray], square_size_m: float, chessboard_dims: tuple[int,int], min_gval, gpu=False):
+def calibrate(imgs: list[np.ndarray], square_size_m: float, chessboard_dims: tuple[int,int], min_gval, gpu=False, fused=False, pool=None, imgpoints=None):
     '''Extract laser projection planes from calibrated camera images of a parallel laser line pattern 
-    projected coplanar to a calibration chessboard pattern whose interior dimensions and square size are provided.'''
-    Pts3d = [[] for _ in range(NUM_LASER_LINES)] # 3D pts
-    for imgidx, (filename, img) in enumerate(imgs):
-        log_header(f"Processing image {imgidx}: {filename}")#logheader
-        ####### Finding Chessboard #######
-
-        dist = None
-        criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-
-        # init container for obj pts
-        objp = np.zeros((chessboard_dims[0]*chessboard_dims[1], 3), dtype=np.float32)
-
-        # makes a grid of points corresponding to each chessboard square from the chessboards 
-        # ref frame, meaning that each chessboard square has a defining dimension of 1 "unit"
-        # therefore must scale these according to your selected units (m) in order to get actual 
-        # object points
-        objp[:,:2] = np.mgrid[0:chessboard_dims[0],0:chessboard_dims[1]].T.reshape(-1,2) 
-        objp *= square_size_m 
-
-        gray = np.empty((img.shape[0], img.shape[1]), dtype=np.uint8)
-        cv.cvtColor(src=img, code=cv.COLOR_BGR2GRAY, dst=gray, dstCn=1)
-        ret, corners = cv.findChessboardCorners(gray, chessboard_dims)
-
-        if not ret:
-            print(f"Couldn't find chessboard, discarding image {imgidx}...") # logwarn
-            continue
-        corners2 = cv.cornerSubPix(gray, corners, (11,11), (-1,-1), criteria)
-
-        # find rotation and translation vectors
-        ret, rvec, tvec = cv.solvePnP(objp, corners2, mtx, dist)
-
-        rotmat, _ = cv.Rodrigues(rvec)
-        # world (chessboard) reference frame to camera reference frame transformation matrix
-        world2cam = np.identity(4)
-        world2cam[:3,:3] = rotmat
-        world2cam[:3, 3] = tvec.flatten()
-        log_info("Chessboard -> Cam Transformation Mat:")
-        for row in world2cam: log_info(row)
-
-        chessboard_plane_point = world2cam.dot([0,0,0,1])
-        chessboard_normal_vec_to_point = world2cam.dot([0,0,1,1])
-        chessboard_normal_vec = chessboard_normal_vec_to_point[:3] - chessboard_plane_point[:3]
-        chessboard_plane = (
-            # (u, v, w, -u*x -v*y -w*z) 
-            chessboard_normal_vec[0], chessboard_normal_vec[1], chessboard_normal_vec[2],
-            -chessboard_normal_vec[0] * chessboard_plane_point[0]
-            -chessboard_normal_vec[1] * chessboard_plane_point[1]
-            -chessboard_normal_vec[2] * chessboard_plane_point[2]
-        )
-        log_info(f"Chessboard plane:\n{chessboard_plane}")
-
-        ####### Done Finding Chessboard #######
-
-
-        if gpu: 
-            rowmin = int(DEFAULT_ROI[0][0] * img.shape[0])
-            rowmax = int(DEFAULT_ROI[1][0] * img.shape[0])+1
-            colmin = int(DEFAULT_ROI[0][1] * img.shape[1])
-            colmax = int(DEFAULT_ROI[1][1] * img.shape[1])+1
-            roi_img = img[rowmin:rowmax,colmin:colmax]
-            reward = color_reward.get_reward_gpu(roi_img)
-            debugshow(reward / np.max(reward), "Reward")
-            gvals = gval.calculate_gaussian_integral_windows_gpu(reward, min_gval).copy_to_host()
-            debugshow(gvals, "Gvals")
-            subpxs = subpx.find_gval_subpixels_gpu(gvals, reward, min_gval)
-            debugshow(subpx, "Subpxs")
-            filtered, patches = pxpatch.throw_out_small_patches_gpu(subpxs)
-        else: 
-            reward = color_reward.get_reward(img)
-            debugshow(reward / np.max(reward), "Reward")
-
-            gvals = gval.calculate_gaussian_integral_windows(reward, min_gval)
-            gvals = throw_out_outlier_clusters(img, gvals)
-
-            gvalimg = np.zeros(reward.shape, dtype=np.float)
-            for g in gvals:
-                col, row = int(g[0]), int(g[1]) 
-                gvalimg[row, col] = 1.
-            debugshow(gvalimg, "Gvals")
-
-            if gvals is None: continue
-            subpxs = subpx.find_gval_subpixels(gvals, reward)
-            dispsubpxs = np.zeros(subpxs.shape, dtype=np.float)
-            dispsubpxs[subpxs != 0] = 1.
-            debugshow(dispsubpxs, "Subpxs")
-            filtered, patches = pxpatch.throw_out_small_patches(subpxs)
-            rowmin = 0
-            colmin = 0
-
-
-        laserpxbinary = np.zeros(filtered.shape, dtype=np.uint8)
-        laserpxbinary[filtered != 0] = 255
-        debugshow(laserpxbinary, "Laser Pixels")
-        lines = segmentation(laserpxbinary, img)
-        if lines is None: continue
-
-        if DEBUG:
-            mergedlinesimg = img.copy() if not gpu else roi_img.copy()
-            draw_polar_lines(mergedlinesimg, lines)
-            debugshow(mergedlinesimg, "Merged Lines")
-        
-        patchgroups = imagept_laserplane_assoc(patches, lines)
-        
-
-        ####### Extract 3D Points #######
-
-        ptsimg = img.copy()
-        for idx, (numpts, group) in enumerate(patchgroups): 
-            print("line %d has %d patches" % (idx, len(group)))
-            for patch in group:
-                for pt in patch:
-                    row, col, x_offset = pt
-                    row += rowmin
-                    col += colmin + x_offset
-                    pt3d = mathutil.px_2_3d(
-                        row, 
-                        col, 
-                        chessboard_plane, 
-                        mtx)
-                    Pts3d[idx].append(pt3d)
-                    ptsimg[int(row), int(col)] = DISP_COLORS[idx]
-        debugshow(ptsimg, "Grouped Points")
-        
-        ####### Done Extracting 3D Points #######
-
-
-        if DEBUG: cv.waitKey(0)
+    projected coplanar to a calibration chessboard pattern whose interior dimensions and square size are provided.
+    When fused is set (and gpu is not), the CPU reward, G value and subpixel stages run as a single fused kernel.
+    When a process pool is given, images are processed in parallel on it (CPU paths only). Already 
+    computed per-image results of calibration_image_points can be passed as imgpoints instead.'''
+    if imgpoints is None and pool is not None and not gpu:
+        shared, futures = submit_calibration_images(pool, imgs, square_size_m, chessboard_dims, min_gval, fused)
+        with shared:
+            imgpoints = gather_image_points(futures)
+    elif imgpoints is None:
+        imgpoints = []
+        accumulators = [planefit.PlaneAccumulator() for _ in range(NUM_LASER_LINES)]
+        for imgidx, (filename, img) in enumerate(imgs):
+            linepts = calibration_image_points(imgidx, filename, img, square_size_m, chessboard_dims, min_gval, gpu=gpu, fused=fused)
+            imgpoints.append(linepts)
+            if linepts is not None: log_plane_progress(accumulators, linepts)
+    Pts3d = merge_image_points(imgpoints)
 
     ####### RANSAC Plane Extraction #######
 
-    # RANSAC: form M subjects of k points from P
+    # MSAC: batches of minimal samples scored against all points of a line, refined with SVD
+    lineptsets = [np.concatenate(lineP) if len(lineP) > 0 else np.empty((0,3)) for lineP in Pts3d]
     planes = []
-    for lineP in Pts3d:
-        print(len(lineP))
-        if len(lineP) == 0: 
+    for idx, (lineP, fit) in enumerate(zip(lineptsets, planefit.msac_planes(lineptsets))):
+        if fit is None:
+            log_warn(f"Not enough points to fit a plane to line {idx} ({lineP.shape[0]} points), skipping it")
             continue
-        potplanes = []
-
-        M = 3
-        npLineP = np.array(lineP) # type: np.ndarray
-
-        shuffled = npLineP.copy()
-        np.random.shuffle(shuffled)
-        subsets = np.array_split(shuffled, M)
-        for subset in subsets:
-            #1.calculate centroid of points and make points relative to it
-            centroid = subset.mean(axis = 0)
-
-            #points relative to centroid
-            subsetRelative = subset - centroid
-
-            #2. calculate the singular value decomposition of the xyzT matrix and get the normal as the last column of u matrix
-            u, s, v = np.linalg.svd(subsetRelative)
-            log_info(f"SVD shapes:\n\tu:{u.shape}\n\t{s.shape}\n\t{v.shape}")
-            normal = v[2]
-            normal = normal / np.linalg.norm(normal)
-
-            # compute distance sum d_j of all points P to the plane pi_j,L
-            # this distance is the dot product of the vector from the centroid to the point with the normal vector
-            distsum = subsetRelative.dot(normal).sum()
-            potplanes.append((centroid, normal, distsum))
-
-        bestplane = potplanes[0]
-        for plane in potplanes:
-            if plane[2] < bestplane[2]:
-                bestplane = plane
-        planes.append(plane[:2]) # we don't need the distance anymore
-        # return plane that fits most points/minimizes distance d_j
+        centroid, normal, inliers = fit
+        print("line %d: %d of %d points are inliers" % (idx, np.count_nonzero(inliers), lineP.shape[0]))
+        planes.append((centroid, normal))
 
     ####### Done RANSAC Plane Extraction #######
     
@@ -384,29 +421,46 @@ def calibrate(imgs: list[np.ndarray], square_size_m: float, chessboard_dims: tup
         plt.show()
 
 
+def load_calibration_imgs(img_folder) -> list[tuple[str, np.ndarray]]:
+    '''Loads the (filename, RGB image) pairs of a calibration image folder, in sorted filename order'''
+    imgs = []
+    for filename in sorted(os.listdir(img_folder)):
+        if(filename.lower().endswith((".png", ".jpg", ".jpeg"))):
+            print(f"Opening {filename}")
+            img = Image.open(os.path.join(img_folder, filename))
+            if img is not None:
+                imgs.append((filename, np.asarray(img))) # RGB format
+    return imgs
+
 def main(
         calibration_img_info: list[tuple[str, float, tuple[int,int], float]], 
-        *, gpu=False):
-    for img_folder, square_size_m, chessboard_dims, min_gval in calibration_img_info:
-        imgs = []
-        cpimgs = []
-        filenames = []
-        for filename in os.listdir(img_folder):
-            if(filename.lower().endswith((".png", ".jpg", ".jpeg"))):
-                print(f"Opening {filename}")
-                img = Image.open(os.path.join(img_folder, filename))
-                if img is not None:
-                    imgs.append((filename, np.asarray(img))) # RGB format
-                    cpimgs.append(cupy.asarray(img))
-                    filenames.append(filename)
-        calibrate(imgs, square_size_m, chessboard_dims, min_gval, gpu=gpu)
+        *, gpu=False, fused=False, workers=1):
+    '''Calibrates each image set. With workers > 1 (CPU paths only), the images of all sets are 
+    processed on a shared process pool and each set's planes are fit once its images are done.'''
+    if workers <= 1 or gpu:
+        for img_folder, square_size_m, chessboard_dims, min_gval in calibration_img_info:
+            calibrate(load_calibration_imgs(img_folder), square_size_m, chessboard_dims, min_gval, gpu=gpu, fused=fused)
+        return
+    # the stack unlinks the blocks of every set if anything raises, after the pool has shut down
+    with ExitStack() as blocks, ProcessPoolExecutor(max_workers=workers) as pool:
+        # queue every set before waiting on any so the pool stays busy across sets
+        submitted = []
+        for img_folder, square_size_m, chessboard_dims, min_gval in calibration_img_info:
+            imgs = load_calibration_imgs(img_folder)
+            shared, futures = submit_calibration_images(pool, imgs, square_size_m, chessboard_dims, min_gval, fused)
+            blocks.enter_context(shared)
+            submitted.append((imgs, square_size_m, chessboard_dims, min_gval, shared, futures))
+        for imgs, square_size_m, chessboard_dims, min_gval, shared, futures in submitted:
+            with shared:
+                imgpoints = gather_image_points(futures)
+            calibrate(imgs, square_size_m, chessboard_dims, min_gval, fused=fused, imgpoints=imgpoints)
 
 
 if __name__ == "__main__":
     numargs = len(sys.argv) - 1
     if numargs == 0:
         #main(DEFAULT_IMG_DATA, gpu=True)
-        main(DEFAULT_IMG_DATA, gpu=False)
+        main(DEFAULT_IMG_DATA, gpu=False, workers=LaserCalibration.WORKERS)
         if LaserCalibration.RECORD_DATA: PerfTracker.export_to_csv()
     elif numargs % 3 != 0:
         log_err(
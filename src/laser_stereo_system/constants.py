@@ -1,4 +1,5 @@
 import numpy as np
+import os
 from enum import Enum
 
 class ImageDisplay:
@@ -39,17 +40,43 @@ class ImageDisplay:
     ]
     SHOW_ALL_IMGS = True
     DEBUG = False
+    TRACE = False # record Tracer spans and export them as Chrome trace JSON
 
 class LaserCalibration:
     MERGE_HLP_LINE_DIST_THRESH = 20
     MERGE_HLP_LINES_ANG_THRESH = 3
     RECORD_DATA = True
+    WORKERS = os.cpu_count() or 1 # processes calibrating images in parallel, 1 to calibrate serially
+    CHESSBOARD_DETECT_SCALE = 0.5 # downscale factor of the image the chessboard is first searched for in
+    CHESSBOARD_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "laser_stereo_system", "chessboard") # None disables the cache
+    POINTS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "laser_stereo_system", "calibpts") # None disables the cache
+    POINTS_CACHE_VERSION = 1 # bump when laser point detection changes to invalidate cached points
+    PLANE_FIT_INLIER_THRESH = 0.002 # m, max distance of an inlier from its laser plane
+    PLANE_FIT_CONFIDENCE = 0.999 # probability of having drawn an all inlier sample before plane fitting stops
+    PLANE_FIT_MAX_ITERS = 2000 # max hypotheses drawn per plane
+    PLANE_FIT_BATCH = 32 # hypotheses scored at once
+    PLANE_FIT_SCORE_PTS = 4096 # points hypotheses are scored on, larger point sets are subsampled
+    PLANE_FIT_SEED = 0
 
 class LaserDetection:
     NUM_LASER_LINES = 15
     DEFAULT_GVAL_MIN_VAL = 1910.
     DEFAULT_COLOR_WEIGHTS = (0.12,0.85,.12)#(0.12, 0.85, 0.18) # RGB
     GVAL_WINLEN = 5 # px
+    FUSED_TILE_COLS = 64 # px, column tile width of the fused reward/gval/subpx kernel
+    MIN_PATCH_SIZE = 5 # px, patches of fewer contiguous laser points are thrown out
+    MAX_DIST_FROM_LINE = 50 # px, patches further than this from every line are thrown out
+    RAY_TABLE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "laser_stereo_system") # memory mapped per-pixel camera ray tables
+    UNDISTORT_ITERATIONS = 5 # fixed point iterations removing lens distortion from laser points
+    CENTER_DOT_MIN_GVAL = 2048. # G value the center dot and its horizontal neighbors reach
+    BACKEND_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "laser_stereo_system", "backends.json") # autotuned stage implementations per host and frame shape, None disables persisting
+    AUTOTUNE = True # autotune the stage implementations on the first frame of an untuned frame shape
+    AUTOTUNE_REPEATS = 3 # timed calls per implementation, the best counts
+    NUMBA_THREADING_LAYER = "threadsafe" # Numba threading layer LaserPipeline launches on the main thread, see laser_detection.start_numba_threads
+    WARMUP = True # precompile the kernels for the ROI shape before the first frame, see laser_detection/warmup.py
+    WARMUP_DTYPES = ("uint8", "float32", "float64") # input dtypes the kernels are precompiled for
+    WARMUP_WORKERS = os.cpu_count() or 1 # processes compiling kernels in parallel, 1 to compile in this process
+    WARMUP_STAMP_PATH = os.path.join(os.path.expanduser("~"), ".cache", "laser_stereo_system", "warmup.json") # keys of the kernels a warmup cached, None always compiles in the workers
     class LaserDetectorStep(Enum):
         ORIG = 1
         REWARD = 2
@@ -61,6 +88,58 @@ class LaserDetection:
         GET3D = 8
     DEFAULT_ROI = ((0.1, 0.25), (0.9, 0.75)) # region of interest defined as (tl, tr) where tl and tr as defined by (height%, width%)
 
+class Benchmark:
+    IMAGE_SETS = { # set name: glob relative to the repository root
+        "calib": "calib_imgs/set*/*.png",
+        "coral": "test_imgs/coral*.png",
+        "image": "test_imgs/image*.png",
+    }
+    WARMUP_RUNS = 1 # untimed runs per stage and image, the first also compiles jitted code
+    REPEAT_RUNS = 5 # timed runs per stage and image
+    SCALE = 1. # images are resized by this factor before benchmarking, the CUDA simulator needs small images
+    SUPERLINEAR_EXPONENT = 1.15 # stages whose latency grows faster than pixels^this are flagged
+
+class ImportBudget:
+    BUDGETS = { # module: s, wall time of a fresh interpreter importing it, numba alone takes ~0.6s
+        "constants": 0.5,
+        "util.mathutil": 0.5, # also imported as laser_stereo_system.util.mathutil, same module
+        "laser_detection": 0.2,
+        "laser_detection.backends": 0.5,
+        "debug.fancylogging": 0.2,
+        "debug.perftracker": 0.5,
+        "debug.tracer": 0.2,
+        "laser_detection.color_reward": 0.9,
+        "laser_detection.gval": 0.9,
+        "laser_detection.subpx": 0.9,
+        "laser_detection.pxpatch": 0.9,
+        "laser_detector": 0.9,
+    }
+    DEFERRED = ("cupy", "pandas", "matplotlib", "PIL") # no budgeted module may import these
+    NO_NUMBA = ("constants", "util.mathutil", "laser_detection", "laser_detection.backends",
+                "debug.fancylogging", "debug.perftracker", "debug.tracer")
+    REPEATS = 3 # fresh interpreters per module, the fastest counts
+    SCALE = 1. # multiplies every budget, raise it on slow machines
+
+class Synthetic:
+    RESOLUTIONS = { # name: (width, height) px
+        "720p": (1280, 720),
+        "1080p": (1920, 1080),
+        "2k": (2208, 1242),
+        "4k": (3840, 2160),
+        "8k": (7680, 4320),
+    }
+    LASER_BASELINE = 0.05 # m, offset of the laser from the camera along x
+    LASER_FAN_ANGLE = 24. # deg, angle between the outermost laser planes
+    SCENE_PLANE = (0., -0.1, 1., -1.) # (A,B,C,D) surface the lasers are projected on, a slightly tilted wall 1m away
+    STRIPE_SIGMA = 1.5 # px, standard deviation of the Gaussian stripe profile across a line
+    STRIPE_PEAK = 1.6 # stripe peak brightness, relative to a full scale pixel, the core saturates above 1
+    LASER_COLOR = (0.75, 1., 0.75) # RGB of the stripe relative to its peak
+    BACKGROUND = (12, 14, 18) # RGB
+    NOISE_STD = 2. # standard deviation of the Gaussian pixel noise
+    GAPS_PER_LINE = 2. # mean number of occlusion gaps per line
+    GAP_LENGTH = (0.02, 0.1) # min and max gap length as a fraction of the image height
+    CENTER_DOT_SIGMA = 3. # px, 0 for no center dot
+
 class Camera:
 
     D = np.array([])
@@ -116,12 +195,18 @@ class Camera:
     This holds for both images of a stereo pair.
     '''
 
-    def __init__(self, D, K, R, P):
-        # type:(np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> Camera
+    width = None
+    height = None
+    '''Resolution in px of the images the matrices above are calibrated for'''
+
+    def __init__(self, D, K, R, P, width=None, height=None):
+        # type:(np.ndarray, np.ndarray, np.ndarray, np.ndarray, int, int) -> Camera
         self.D = D
         self.K = K
         self.R = R
         self.P = P
+        self.width = width
+        self.height = height
 
 class ZedMini:
     LeftRectHD2K = Camera(
@@ -134,4 +219,5 @@ class ZedMini:
                     [0.0, 0.0, 1.0]]),
         P=np.array([[1407.8599853515625, 0.0, 1083.25, 0.0], 
                       [0.0, 1407.1199951171875, 623.6740112304688, 0.0], 
-                      [0.0, 0.0, 1.0, 0.0]]))
+                      [0.0, 0.0, 1.0, 0.0]]),
+        width=2208, height=1242)
@@ -0,0 +1,256 @@
+'''
+Benchmarks every laser detection stage on every available backend over the image sets in
+Benchmark.IMAGE_SETS and writes one tidy table with a row per timed run. Run from
+src/laser_stereo_system with
+
+    python -m debug.benchmark [--sets coral image] [--backends objmode njit] [--repeats 5] [--out bench.csv]
+
+Set NUMBA_ENABLE_CUDASIM=1 on machines without an nvidia GPU. The CUDA simulator runs every kernel
+thread in Python, so it is only benchmarked when asked for with --backends cudasim, best together
+with a small --scale.
+
+--synthetic 720p 4k 8k [--lines 15 31] benchmarks rendered frames of the given resolutions and
+line counts instead, and reports how the latency of every stage scales with the frame size.
+'''
+
+import argparse
+import gc
+import glob
+import os
+import platform
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import cv2 as cv
+from numba import cuda, get_num_threads
+from PIL import Image
+from constants import Benchmark, LaserDetection, Synthetic
+from debug.perftracker import PerfTracker
+from debug import perfstore
+from debug.fancylogging import log_warn
+from util import synthetic
+import laser_detection
+from laser_detection import color_reward, gval, subpx, pxpatch, fused
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+CUDA_BACKEND = "cudasim" if laser_detection.CUDASIM else "cuda"
+BACKENDS = ("objmode", "numpy", "njit", CUDA_BACKEND)
+DEFAULT_BACKENDS = ("objmode", "numpy", "njit") + (() if laser_detection.CUDASIM else (CUDA_BACKEND,))
+COLUMNS = [
+    "run_id", "started", "host", "threads", "image_set", "image", "height", "width",
+    "backend", "stage", "repeat", "latency_s", "peak_mem_bytes",
+]
+
+def image_paths(sets=None, root=REPO_ROOT, max_imgs=None) -> list:
+    '''(set name, path) of the images of the given sets (all by default) in sorted order'''
+    paths = []
+    for name, pattern in Benchmark.IMAGE_SETS.items():
+        if sets is not None and name not in sets:
+            continue
+        found = sorted(glob.glob(os.path.join(root, pattern)))
+        paths.extend((name, path) for path in found[:max_imgs])
+    return paths
+
+def load_image(path, scale=Benchmark.SCALE, roi=LaserDetection.DEFAULT_ROI) -> np.ndarray:
+    '''RGB uint8 image cropped to the roi (None for the whole frame) like LaserPipeline does, then resized by scale'''
+    img = np.asarray(Image.open(path).convert("RGB"))
+    if roi is not None:
+        rowmin, rowmax = int(roi[0][0] * img.shape[0]), int(roi[1][0] * img.shape[0]) + 1
+        colmin, colmax = int(roi[0][1] * img.shape[1]), int(roi[1][1] * img.shape[1]) + 1
+        img = img[rowmin:rowmax, colmin:colmax]
+    if scale != 1:
+        img = cv.resize(img, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    return np.ascontiguousarray(img)
+
+def synthetic_frames(resolutions, numlines=(LaserDetection.NUM_LASER_LINES,), seed=0):
+    '''(name, rendered frame) of every resolution and line count, see util.synthetic.render_frame'''
+    for resolution in resolutions:
+        for lines in numlines:
+            yield f"{resolution}_{lines}lines_seed{seed}", synthetic.render_resolution(resolution, lines, seed)
+
+def stage_inputs(img, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL, centerdot=(0, 0)) -> dict:
+    '''Reference intermediates of an image. Every stage of every backend is timed on these, so
+    stages are compared on the same input whatever backend would have produced it.'''
+    reward = np.sum(img * np.asarray(LaserDetection.DEFAULT_COLOR_WEIGHTS), axis=2)
+    gvals = gval.gval_image(reward)
+    subpxs = fused.subpixel_image(fused.find_gval_subpixels_fused(img, min_gval), reward.shape)
+    return {
+        "img": img,
+        "reward": reward,
+        "gvals": gvals,
+        "windows": gval.gval_windows(gvals, min_gval),
+        "subpxs": subpxs,
+        "patches": pxpatch.throw_out_small_patches(subpxs)[1],
+        "centerdot": centerdot,
+    }
+
+def _synced(func):
+    '''Waits for queued GPU work so its time is attributed to the stage that queued it'''
+    def synced_stage(inputs):
+        result = func(inputs)
+        cuda.synchronize()
+        return result
+    return synced_stage
+
+def backend_stages(backend, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL) -> dict:
+    '''{stage name: function of the stage_inputs dict} of a backend, backends only implement some stages'''
+    if backend == "objmode":
+        return {
+            "reward": lambda x: color_reward.get_reward(x["img"]),
+            "gval": lambda x: gval.calculate_gaussian_integral_windows(x["reward"], min_gval),
+            "subpx": lambda x: subpx.find_gval_subpixels(x["windows"], x["reward"]),
+        }
+    if backend == "numpy":
+        return {
+            "gval": lambda x: gval.calculate_gaussian_integral_windows_vec(x["reward"], min_gval),
+        }
+    if backend == "njit":
+        engine = color_reward.RewardEngine()
+        # gval is thresholded into windows like the objmode and numpy gval stages
+        stages = {
+            "reward": lambda x: color_reward.get_reward_into(engine, x["img"], engine.alloc(x["img"].shape)),
+            "gval": lambda x: gval.gval_windows(gval.calculate_gaussian_integral_windows_jit(x["reward"]), min_gval),
+            "subpx": lambda x: subpx.find_gval_subpixels_gpu(x["gvals"], x["reward"], min_gval),
+            "fused": lambda x: fused.find_gval_subpixels_fused(x["img"], min_gval),
+            "patch": lambda x: pxpatch.throw_out_small_patches(x["subpxs"]),
+        }
+        try:
+            # laser_detector needs the laser_stereo_system package and plotting libraries
+            from laser_detector import segment_laser_lines, SEGMENT_MAX_SPAN_TREE
+            stages["segment"] = lambda x: segment_laser_lines(None, SEGMENT_MAX_SPAN_TREE, patches=x["patches"], centerdot=x["centerdot"])
+        except ImportError as err:
+            log_warn(f"Not benchmarking segmentation, couldn't import laser_detector: {err}")
+        return stages
+    if backend == CUDA_BACKEND:
+        return {
+            "reward": _synced(lambda x: color_reward.get_reward_gpu(laser_detection.cupy.asarray(x["img"]))),
+            "gval": _synced(lambda x: gval.calculate_gaussian_integral_windows_gpu(x["reward"], min_gval).copy_to_host()),
+            "patch": _synced(lambda x: pxpatch.throw_out_small_patches_gpu(x["subpxs"])),
+        }
+    raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+def time_stage(func, inputs, warmup=Benchmark.WARMUP_RUNS, repeats=Benchmark.REPEAT_RUNS):
+    '''
+    Runs a stage warmup times untimed, then repeats times timed with the garbage collector off,
+    then once more under tracemalloc. The peak only covers Python and NumPy allocations, arrays
+    allocated inside nopython code and on the GPU aren't seen by tracemalloc.
+
+    :return: (latencies in s, peak traced memory in bytes)
+    '''
+    for _ in range(warmup):
+        func(inputs)
+    latencies = np.empty(repeats)
+    gcwasenabled = gc.isenabled()
+    gc.disable()
+    try:
+        for idx in range(repeats):
+            start = time.perf_counter_ns()
+            func(inputs)
+            latencies[idx] = (time.perf_counter_ns() - start) / 1e9
+    finally:
+        if gcwasenabled: gc.enable()
+    tracemalloc.start()
+    try:
+        func(inputs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return latencies, peak
+
+def run(sets=None, backends=DEFAULT_BACKENDS, warmup=Benchmark.WARMUP_RUNS, repeats=Benchmark.REPEAT_RUNS,
+        scale=Benchmark.SCALE, roi=LaserDetection.DEFAULT_ROI, max_imgs=None, root=REPO_ROOT, log=print,
+        synthetic_resolutions=None, synthetic_lines=(LaserDetection.NUM_LASER_LINES,)) -> pd.DataFrame:
+    '''
+    Benchmarks the stages of the given backends on every image of the given sets, or on synthetic
+    frames of the given resolutions and line counts (whole frames, not resized), returns the per
+    run table
+    '''
+    # keep the tracked functions quiet and out of the way of the timing and of tracemalloc
+    PerfTracker.configure(mode=PerfTracker.MODE_SAMPLING, mem_sample_every=1 << 62)
+    run_id = uuid.uuid4().hex[:12]
+    started = datetime.now().isoformat(timespec="seconds")
+    host = platform.node()
+    stages = {backend: backend_stages(backend) for backend in backends}
+    if synthetic_resolutions:
+        images = (("synthetic", name, frame["img"], frame["centerdot"] or (0, 0))
+                  for name, frame in synthetic_frames(synthetic_resolutions, synthetic_lines))
+    else:
+        images = ((image_set, os.path.relpath(path, root), load_image(path, scale, roi), (0, 0))
+                  for image_set, path in image_paths(sets, root, max_imgs))
+    rows = []
+    for image_set, image, img, centerdot in images:
+        inputs = stage_inputs(img, centerdot=centerdot)
+        for backend, funcs in stages.items():
+            for stage, func in funcs.items():
+                latencies, peak = time_stage(func, inputs, warmup, repeats)
+                if log is not None:
+                    log(f"{image} {img.shape[1]}x{img.shape[0]} {backend:>8} {stage:<7}"
+                        f" median {np.median(latencies) * 1e3:10.3f} ms, peak {peak} bytes")
+                for repeat, latency in enumerate(latencies):
+                    rows.append((
+                        run_id, started, host, get_num_threads(), image_set, image,
+                        img.shape[0], img.shape[1], backend, stage, repeat, latency, peak,
+                    ))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    '''Median and min latency in ms and max peak memory per image set, backend and stage'''
+    grouped = results.groupby(["image_set", "height", "width", "backend", "stage"])
+    return pd.DataFrame({
+        "median_ms": grouped["latency_s"].median() * 1e3,
+        "min_ms": grouped["latency_s"].min() * 1e3,
+        "peak_mem_bytes": grouped["peak_mem_bytes"].max(),
+        "runs": grouped["latency_s"].count(),
+    })
+
+def scaling(results: pd.DataFrame, superlinear=Benchmark.SUPERLINEAR_EXPONENT) -> pd.DataFrame:
+    '''
+    Exponent of the growth of the median latency of every backend and stage with the pixel count,
+    the slope of a least squares line through log latency over log pixels across frame sizes.
+    1 is linear, stages growing faster than pixels^superlinear are flagged.
+    '''
+    medians = results.assign(pixels=results["height"] * results["width"]).groupby(
+        ["backend", "stage", "pixels"])["latency_s"].median().reset_index()
+    rows = []
+    for (backend, stage), group in medians.groupby(["backend", "stage"]):
+        if group.shape[0] < 2:
+            continue
+        exponent = np.polyfit(np.log(group["pixels"]), np.log(group["latency_s"]), 1)[0]
+        rows.append((backend, stage, group.shape[0], exponent, exponent > superlinear))
+    return pd.DataFrame(rows, columns=["backend", "stage", "sizes", "exponent", "superlinear"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark laser detection stages on every backend")
+    parser.add_argument("--sets", nargs="+", choices=list(Benchmark.IMAGE_SETS), help="image sets, all by default")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(DEFAULT_BACKENDS))
+    parser.add_argument("--warmup", type=int, default=Benchmark.WARMUP_RUNS)
+    parser.add_argument("--repeats", type=int, default=Benchmark.REPEAT_RUNS)
+    parser.add_argument("--scale", type=float, default=Benchmark.SCALE)
+    parser.add_argument("--full-frame", action="store_true", help="benchmark whole frames instead of the detection roi")
+    parser.add_argument("--max-imgs", type=int, help="images per set")
+    parser.add_argument("--synthetic", nargs="+", choices=list(Synthetic.RESOLUTIONS), help="benchmark synthetic frames of these resolutions")
+    parser.add_argument("--lines", nargs="+", type=int, default=[LaserDetection.NUM_LASER_LINES], help="laser lines of the synthetic frames")
+    parser.add_argument("--out", help="csv the per run table is written to, benchmark_<run id>.csv by default")
+    parser.add_argument("--store", default=perfstore.DEFAULT_STORE, help="results store the runs are appended to")
+    parser.add_argument("--no-store", action="store_true", help="don't append the runs to the results store")
+    args = parser.parse_args()
+
+    results = run(args.sets, args.backends, args.warmup, args.repeats, args.scale,
+                  None if args.full_frame else LaserDetection.DEFAULT_ROI, args.max_imgs,
+                  synthetic_resolutions=args.synthetic, synthetic_lines=args.lines)
+    if results.empty:
+        print("No images found to benchmark")
+    else:
+        out = args.out or f"benchmark_{results['run_id'].iloc[0]}.csv"
+        results.to_csv(out, index=False)
+        print(summarize(results).to_string(float_format=lambda val: f"{val:.3f}"))
+        exponents = scaling(results)
+        if not exponents.empty:
+            print(exponents.to_string(index=False, float_format=lambda val: f"{val:.2f}"))
+        print(f"Wrote {len(results)} runs to {out}")
+        if not args.no_store:
+            perfstore.append(perfstore.records_from_benchmark(results, source=out), args.store)
+            print(f"Appended run {results['run_id'].iloc[0]} to {args.store}")
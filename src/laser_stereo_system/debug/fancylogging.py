@@ -1,5 +1,3 @@
-from numba import jit
-
 class Logging: # TODO move to constants
     '''Class for logging to console with various logging levels.'''
     class LogLevels:
@@ -25,35 +23,29 @@ codes = Logging.PrintCodes
 LOG_LEVEL = Logging.LOG_LEVEL
 LogLevels = Logging.LogLevels
 
-@jit
 def print_ansi(msg: str):
     '''Prints a message containig ANSI escape codes with append clear code at the end.'''
     print(f"{msg}{codes.ENDC}")
 
-@jit
 def log_header(msg: str):
     if LOG_LEVEL == LogLevels.INFO:
         print_ansi(f"\n{codes.BOLD}{codes.UNDERLINE}{codes.HEADER}{msg}")
 
-@jit
 def log_ok(msg: str):
     '''Prints a message indicating OK status from program'''
     if LOG_LEVEL == LogLevels.INFO:
         print_ansi(f"{codes.OKCYAN}{codes.UNDERLINE}OK{codes.NOUNDERLINE}: {msg}")
 
-@jit
 def log_info(msg: str):
     '''Prints an info message from program'''
     if LOG_LEVEL == LogLevels.INFO:
         print_ansi(f"{codes.INFOWHITE}{codes.UNDERLINE}INFO{codes.NOUNDERLINE}: {msg}")
 
-@jit
 def log_warn(msg: str):
     '''Prints a message indicating a warning from the program'''
     if LOG_LEVEL >= LogLevels.WARN:
         print_ansi(f"{codes.WARNING}{codes.UNDERLINE}WARN{codes.NOUNDERLINE}: {msg}")
 
-@jit
 def log_err(msg: str, throw=False, err=Exception()):
     '''Prints a message indicating an error in the program, optionally raising an error'''
     if LOG_LEVEL >= LogLevels.ERR:
@@ -0,0 +1,104 @@
+'''
+Import time budget check. Imports every module of ImportBudget.BUDGETS in fresh interpreters and
+fails if the fastest start takes longer than its budget, if it imports one of the heavy optional
+ImportBudget.DEFERRED modules (or numba for ImportBudget.NO_NUMBA), or if it prints anything, as
+importing must not initialize backends, query devices or log. tests/test_importbudget.py checks
+every budgeted module, to see the slowest imports of modules run from src/laser_stereo_system
+
+    python -m debug.importbudget [modules] [--scale 1.5] [--verbose]
+
+Exits 1 if a module is over budget. Python warnings are ignored, set NUMBA_ENABLE_CUDASIM=1 on
+machines without an nvidia GPU like for the other tools.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from constants import ImportBudget
+
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MARKER = "IMPORTBUDGET " # prefixes the probe's result line
+PROBE = (
+    "import sys, time, json; start = time.perf_counter(); import {module}; took = time.perf_counter() - start; "
+    f"print({MARKER!r} + json.dumps([took, sorted(sys.modules)]))"
+)
+
+def _env() -> dict:
+    # same module layout as running the nodes from src/laser_stereo_system
+    path = os.pathsep.join([PACKAGE_DIR, os.path.dirname(PACKAGE_DIR)] + [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p])
+    return dict(os.environ, PYTHONPATH=path, PYTHONWARNINGS="ignore")
+
+def probe(module: str, importtime=False) -> dict:
+    '''
+    Imports the module in a fresh interpreter.
+
+    :return: dict with wall (s, the whole interpreter run), import (s, the import statement alone),
+        modules (names in sys.modules afterwards), output (anything printed besides the result) and
+        importtime (stderr of python -X importtime if importtime)
+    '''
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE.format(module=module)]
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=PACKAGE_DIR, env=_env(), capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+    lines = proc.stdout.splitlines()
+    took, modules = json.loads(lines[-1][len(MARKER):])
+    output = "\n".join(lines[:-1])
+    if not importtime:
+        output += proc.stderr
+    return {"wall": wall, "import": took, "modules": modules, "output": output.strip(),
+            "importtime": proc.stderr if importtime else None}
+
+def slowest_imports(importtime: str, count=5) -> list:
+    '''(cumulative s, module) of the slowest top level imports in python -X importtime output'''
+    imports = []
+    for line in importtime.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        if name.startswith("   ") and not name.startswith("     "): # direct imports of the probed module
+            imports.append((int(fields[1]) * 1e-6, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def check(module: str, budget: float, repeats=ImportBudget.REPEATS) -> dict:
+    '''Fastest of repeats probes of the module, with the reasons it fails its budget in problems'''
+    result = min((probe(module) for _ in range(repeats)), key=lambda r: r["wall"])
+    problems = []
+    if result["wall"] > budget:
+        problems.append(f"took {result['wall']:.3f}s, budget {budget:.3f}s")
+    loaded = {name.split(".")[0] for name in result["modules"]}
+    heavy = [name for name in ImportBudget.DEFERRED if name in loaded]
+    if module in ImportBudget.NO_NUMBA and "numba" in loaded:
+        heavy.append("numba")
+    if heavy:
+        problems.append(f"imports {', '.join(heavy)}")
+    if result["output"]:
+        problems.append(f"printed {result['output']!r}")
+    result["problems"] = problems
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time of modules against their budgets")
+    parser.add_argument("modules", nargs="*", default=list(ImportBudget.BUDGETS))
+    parser.add_argument("--scale", type=float, default=ImportBudget.SCALE, help="multiplies every budget, for slow machines")
+    parser.add_argument("--repeats", type=int, default=ImportBudget.REPEATS)
+    parser.add_argument("--verbose", action="store_true", help="show the slowest imports of every module")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<36}{'wall':>9}{'import':>9}{'budget':>9}")
+    for module in args.modules:
+        budget = ImportBudget.BUDGETS.get(module, max(ImportBudget.BUDGETS.values())) * args.scale
+        result = check(module, budget, args.repeats)
+        print(f"{module:<36}{result['wall']:>9.3f}{result['import']:>9.3f}{budget:>9.3f}  {'; '.join(result['problems']) or 'ok'}")
+        if args.verbose or result["problems"]:
+            for took, name in slowest_imports(probe(module, importtime=True)["importtime"]):
+                print(f"    {took:>8.3f}s {name}")
+        failed |= bool(result["problems"])
+    if failed:
+        raise SystemExit(1)
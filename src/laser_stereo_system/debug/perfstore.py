@@ -0,0 +1,275 @@
+'''
+Store of performance results and comparison of runs. Every record holds the latency samples and
+peak memory of one stage on one backend for one run, with the frame size and host it ran on, and
+is appended as a line of JSON to the store. Run from src/laser_stereo_system with
+
+    python -m debug.perfstore append <benchmark csv or perfdataset folder>
+    python -m debug.perfstore compare <base run> <new run> [--threshold 0.1] [--html report.html]
+
+where a run is a run id (or unique prefix) in the store, "latest", a benchmark csv or a folder or
+csv written by PerfTracker.export_to_csv, like perfdataset1cpu.
+'''
+
+import argparse
+import html
+import json
+import os
+import platform
+import uuid
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+DEFAULT_STORE = os.path.join(REPO_ROOT, "perfresults.jsonl")
+DEFAULT_THRESHOLD = 0.1 # slowdown as a fraction of the base latency flagged as a regression
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+
+# (backend, stage) of the functions tracked with PerfTracker
+TRACKER_STAGES = {
+    "reward": ("objmode", "reward"),
+    "reward_gpu": ("cuda", "reward"),
+    "reward_engine": ("njit", "reward"),
+    "gval": ("objmode", "gval"),
+    "gval_gpu": ("cuda", "gval"),
+    "gval_jit": ("njit", "gval"),
+    "gval_vec": ("numpy", "gval"),
+    "subpx": ("objmode", "subpx"),
+    "subpx_gpu": ("cuda", "subpx"),
+    "patch": ("njit", "patch"),
+    "patch_gpu": ("cuda", "patch"),
+    "fused": ("njit", "fused"),
+    "assoc": ("numpy", "assoc"),
+}
+SAMPLE_COLUMNS = ["run_id", "host", "backend", "stage", "height", "width", "latency_s", "peak_mem_bytes"]
+
+def make_record(run_id, backend, stage, latencies, peak_mem_bytes=None, height=None, width=None,
+                host=None, started=None, image=None, source=None) -> dict:
+    return {
+        "run_id": run_id, "started": started, "host": host, "source": source,
+        "backend": backend, "stage": stage, "height": height, "width": width, "image": image,
+        "latencies_s": [float(latency) for latency in latencies],
+        "peak_mem_bytes": None if peak_mem_bytes is None else int(peak_mem_bytes),
+    }
+
+def append(records, store=DEFAULT_STORE):
+    '''Appends records to the store, creating it if needed'''
+    if os.path.dirname(store):
+        os.makedirs(os.path.dirname(store), exist_ok=True)
+    with open(store, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def load_store(store=DEFAULT_STORE) -> list:
+    if not os.path.exists(store):
+        return []
+    with open(store) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def records_from_benchmark(results: pd.DataFrame, source=None) -> list:
+    '''Records of a per run table written by debug.benchmark, one per run, image, backend and stage'''
+    records = []
+    keys = ["run_id", "started", "host", "image", "height", "width", "backend", "stage"]
+    for key, runs in results.groupby(keys, sort=False):
+        info = dict(zip(keys, key))
+        records.append(make_record(
+            info["run_id"], info["backend"], info["stage"], runs["latency_s"], runs["peak_mem_bytes"].max(),
+            int(info["height"]), int(info["width"]), info["host"], info["started"], info["image"], source,
+        ))
+    return records
+
+def records_from_tracker(tracking_data, run_id=None, height=None, width=None, sampled=True) -> list:
+    '''
+    Records of the functions in PerfTracker.tracking_data. Takes the ring buffers filled in
+    sampling mode, or the runtimes kept in verbose mode when sampled is False.
+    '''
+    run_id = run_id or uuid.uuid4().hex[:12]
+    started = datetime.now().isoformat(timespec="seconds")
+    records = []
+    for name, data in tracking_data.items():
+        if sampled:
+            latencies = data["ring"][:min(data["numcalls"], data["ring"].shape[0])] / 1e9
+            mems = data["memring"][:min(data["nummemsamples"], data["memring"].shape[0])]
+        else:
+            latencies, mems = np.array(data["runtimes"]), np.array(data["maxmems"])
+        if latencies.shape[0] == 0:
+            continue
+        backend, stage = TRACKER_STAGES.get(name, ("unknown", name))
+        records.append(make_record(
+            run_id, backend, stage, latencies, mems.max() if mems.shape[0] > 0 else None,
+            height, width, platform.node(), started))
+    return records
+
+def records_from_wide_csv(path, skip_first=True) -> list:
+    '''
+    Records of a perfdata_all.csv written by PerfTracker.export_to_csv, or of the folder holding
+    it. Those files don't say which host or frame size they came from. The first call of each
+    function includes jit compilation and is dropped unless skip_first is False.
+    '''
+    if os.path.isdir(path):
+        path = os.path.join(path, "perfdata_all.csv")
+    data = pd.read_csv(path, index_col=0)
+    run_id = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    records = []
+    for column in data.columns:
+        if not column.endswith("runtimes"):
+            continue
+        name = column[:-len("runtimes")]
+        latencies = data[column].dropna().to_numpy()[1 if skip_first else 0:]
+        if latencies.shape[0] == 0:
+            continue
+        mems = data[f"{name}maxmems"].dropna() if f"{name}maxmems" in data else pd.Series(dtype=float)
+        backend, stage = TRACKER_STAGES.get(name, ("unknown", name))
+        records.append(make_record(run_id, backend, stage, latencies, mems.max() if len(mems) > 0 else None, source=path))
+    return records
+
+def records_from_path(path) -> list:
+    '''Records of a benchmark csv or of a PerfTracker export (csv or folder)'''
+    if os.path.isfile(path) and "latency_s" in pd.read_csv(path, nrows=0).columns:
+        return records_from_benchmark(pd.read_csv(path), source=path)
+    return records_from_wide_csv(path)
+
+def load_run(spec, store=DEFAULT_STORE) -> list:
+    '''Records of a run given as a path (see records_from_path), a run id or unique run id prefix in the store, or "latest"'''
+    if os.path.exists(spec):
+        return records_from_path(spec)
+    records = load_store(store)
+    if spec == "latest":
+        if len(records) == 0:
+            raise ValueError(f"No runs in {store}")
+        spec = records[-1]["run_id"]
+    run_ids = {record["run_id"] for record in records if record["run_id"].startswith(spec)}
+    if len(run_ids) != 1:
+        raise ValueError(f"{spec} matches {len(run_ids)} runs in {store}, expected 1")
+    run_id = run_ids.pop()
+    return [record for record in records if record["run_id"] == run_id]
+
+def samples(records) -> pd.DataFrame:
+    '''Tidy table with one row per latency sample of the records'''
+    rows = [
+        (record["run_id"], record["host"], record["backend"], record["stage"], record["height"],
+         record["width"], latency, record["peak_mem_bytes"])
+        for record in records for latency in record["latencies_s"]
+    ]
+    return pd.DataFrame(rows, columns=SAMPLE_COLUMNS)
+
+def speedup_ci(base, new, confidence=CONFIDENCE, numsamples=BOOTSTRAP_SAMPLES, rng=None):
+    '''
+    Speedup of new over base as the ratio of median latencies, with a percentile bootstrap
+    confidence interval. The interval is NaN when either side has fewer than 2 samples.
+
+    :return: (speedup, ci low, ci high)
+    '''
+    base, new = np.asarray(base), np.asarray(new)
+    speedup = np.median(base) / np.median(new)
+    if base.shape[0] < 2 or new.shape[0] < 2:
+        return speedup, np.nan, np.nan
+    rng = np.random.default_rng(0) if rng is None else rng
+    basemedians = np.median(rng.choice(base, (numsamples, base.shape[0])), axis=1)
+    newmedians = np.median(rng.choice(new, (numsamples, new.shape[0])), axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(basemedians / newmedians, (alpha, 1 - alpha))
+    return speedup, low, high
+
+def compare(base_records, new_records, threshold=DEFAULT_THRESHOLD, confidence=CONFIDENCE) -> pd.DataFrame:
+    '''
+    Per stage comparison of two runs. Stages are matched by backend, stage and frame size, frame
+    size is left out when either run doesn't record it and backend is left out when the runs share
+    no backend, so a CPU run can be compared against a GPU run stage by stage. A stage is a
+    regression when it got slower by more than threshold (a fraction of the base latency) and the
+    whole confidence interval of its speedup is below 1, an improvement likewise.
+    '''
+    base, new = samples(base_records), samples(new_records)
+    by = ["backend", "stage", "height", "width"]
+    if base["height"].isna().any() or new["height"].isna().any():
+        by = ["backend", "stage"]
+    if not set(base["backend"]) & set(new["backend"]):
+        by.remove("backend")
+    basegroups = dict(list(base.groupby(by)))
+    rows = []
+    for key, newgroup in new.groupby(by):
+        if key not in basegroups:
+            continue
+        basegroup = basegroups[key]
+        speedup, low, high = speedup_ci(basegroup["latency_s"], newgroup["latency_s"], confidence)
+        status = ""
+        if speedup < 1 / (1 + threshold) and high < 1:
+            status = "regression"
+        elif speedup > 1 + threshold and low > 1:
+            status = "improvement"
+        rows.append(tuple(key if isinstance(key, tuple) else (key,)) + (
+            basegroup.shape[0], basegroup["latency_s"].median() * 1e3,
+            newgroup.shape[0], newgroup["latency_s"].median() * 1e3,
+            speedup, low, high, basegroup["peak_mem_bytes"].max(), newgroup["peak_mem_bytes"].max(), status,
+        ))
+    return pd.DataFrame(rows, columns=by + [
+        "base_n", "base_median_ms", "new_n", "new_median_ms",
+        "speedup", "ci_low", "ci_high", "base_peak_mem", "new_peak_mem", "status",
+    ])
+
+def _run_name(records) -> str:
+    run_ids = sorted({record["run_id"] for record in records})
+    hosts = sorted({record["host"] for record in records if record["host"]})
+    return ", ".join(run_ids) + (f" on {', '.join(hosts)}" if hosts else "")
+
+def render_text(comparison: pd.DataFrame, base_records, new_records, threshold=DEFAULT_THRESHOLD) -> str:
+    regressions = int((comparison["status"] == "regression").sum())
+    lines = [
+        f"base: {_run_name(base_records)}",
+        f"new:  {_run_name(new_records)}",
+        f"speedup = base median / new median, {CONFIDENCE:.0%} bootstrap interval, regression threshold {threshold:.0%}",
+        "",
+        comparison.to_string(index=False, float_format=lambda val: f"{val:.3f}") if not comparison.empty else "No common stages",
+        "",
+        f"{regressions} regression{'s' if regressions != 1 else ''}",
+    ]
+    return "\n".join(lines)
+
+def render_html(comparison: pd.DataFrame, base_records, new_records, threshold=DEFAULT_THRESHOLD) -> str:
+    '''Static html page with the comparison table, regressions in red and improvements in green'''
+    colors = {"regression": "#f8d0d0", "improvement": "#d0f0d0"}
+    header = "".join(f"<th>{html.escape(str(column))}</th>" for column in comparison.columns)
+    body = []
+    for row in comparison.itertuples(index=False):
+        cells = "".join(f"<td>{val:.3f}</td>" if isinstance(val, float) else f"<td>{html.escape(str(val))}</td>" for val in row)
+        style = f' style="background:{colors[row.status]}"' if row.status in colors else ""
+        body.append(f"<tr{style}>{cells}</tr>")
+    return "\n".join([
+        "<!DOCTYPE html>",
+        "<html><head><meta charset=\"utf-8\"><title>Performance comparison</title>",
+        "<style>body{font-family:sans-serif} table{border-collapse:collapse} td,th{border:1px solid #999;padding:2px 8px;text-align:right}</style>",
+        "</head><body>",
+        f"<p>base: {html.escape(_run_name(base_records))}<br>new: {html.escape(_run_name(new_records))}</p>",
+        f"<p>speedup = base median / new median, {CONFIDENCE:.0%} bootstrap interval, regression threshold {threshold:.0%}</p>",
+        f"<table><tr>{header}</tr>", *body, "</table>",
+        "</body></html>",
+    ])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store and compare performance runs")
+    parser.add_argument("--store", default=DEFAULT_STORE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    appendparser = commands.add_parser("append", help="append a benchmark csv or PerfTracker export to the store")
+    appendparser.add_argument("paths", nargs="+")
+    compareparser = commands.add_parser("compare", help="compare two runs stage by stage")
+    compareparser.add_argument("base")
+    compareparser.add_argument("new")
+    compareparser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compareparser.add_argument("--html", help="also write the report as html to this path")
+    args = parser.parse_args()
+
+    if args.command == "append":
+        for path in args.paths:
+            records = records_from_path(path)
+            append(records, args.store)
+            print(f"Appended {len(records)} records of {_run_name(records)} to {args.store}")
+    else:
+        base_records, new_records = load_run(args.base, args.store), load_run(args.new, args.store)
+        comparison = compare(base_records, new_records, args.threshold)
+        print(render_text(comparison, base_records, new_records, args.threshold))
+        if args.html:
+            with open(args.html, "w") as f:
+                f.write(render_html(comparison, base_records, new_records, args.threshold))
+        if (comparison["status"] == "regression").any():
+            raise SystemExit(1)
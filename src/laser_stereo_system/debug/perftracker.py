@@ -2,7 +2,6 @@ import time
 import tracemalloc
 from functools import wraps
 from typing import Callable
-import pandas as pd
 import numpy as np
 
 DEBUG_ENABLED = False
@@ -10,20 +9,52 @@ DEBUG_ENABLED = False
 class PerfTracker:
     '''Tracker for runtime performance statistics. Simply use the @PerfTracker.track decorator, 
     providing the name of the function you want to track. Currently, this tracks runtime and memory usage,
-    and can results for individual functions or all functions to csv files.'''
+    and can results for individual functions or all functions to csv files.
+
+    In MODE_VERBOSE (the default), every call is traced with tracemalloc and printed. In MODE_SAMPLING, 
+    calls only record perf_counter_ns into a preallocated ring buffer per function, memory is traced 
+    on one call out of mem_sample_every, and nothing is printed, so tracking can stay on in production. 
+    Use PerfTracker.configure to switch modes and PerfTracker.percentiles for p50/p90/p99/max.'''
+
+    MODE_VERBOSE = 0
+    MODE_SAMPLING = 1
 
     tracking_data = {}
+    mode = MODE_VERBOSE
+    buffer_size = 4096 # runtimes kept per function in sampling mode
+    mem_sample_every = 100 # calls per memory sample in sampling mode
+
+    def configure(mode=None, buffer_size=None, mem_sample_every=None):
+        '''Sets the tracking mode and sampling parameters. Changing the buffer size clears the ring 
+        buffers of all functions.'''
+        if mode is not None:
+            PerfTracker.mode = mode
+        if mem_sample_every is not None:
+            PerfTracker.mem_sample_every = max(1, int(mem_sample_every))
+        if buffer_size is not None:
+            PerfTracker.buffer_size = max(1, int(buffer_size))
+            for data in PerfTracker.tracking_data.values():
+                data["ring"] = np.zeros(PerfTracker.buffer_size, dtype=np.int64)
+                data["memring"] = np.zeros(PerfTracker.buffer_size, dtype=np.int64)
+                data["numcalls"] = 0
+                data["nummemsamples"] = 0
 
     def track(name: str):
         if name in PerfTracker.tracking_data:
             raise ValueError(f"Already tracking a function called {name}")
-        PerfTracker.tracking_data[f"{name}"] = {
+        PerfTracker.tracking_data[f"{name}"] = data = {
             "runtimes": [],
-            "maxmems": []
+            "maxmems": [],
+            "ring": np.zeros(PerfTracker.buffer_size, dtype=np.int64), # ns, sampling mode
+            "memring": np.zeros(PerfTracker.buffer_size, dtype=np.int64), # peak bytes, sampling mode
+            "numcalls": 0, # calls recorded into the ring
+            "nummemsamples": 0, # memory samples recorded into the memring
         }
         def track_decorator(func: Callable):
             @wraps(func)
             def perftrack_wrapper(*args, **kwargs):
+                if PerfTracker.mode == PerfTracker.MODE_SAMPLING:
+                    return PerfTracker._sample(data, func, args, kwargs)
                 tracemalloc.start()
                 start_time = time.perf_counter()
                 result = func(*args, **kwargs)
@@ -44,16 +75,73 @@ class PerfTracker:
                 return result
             return perftrack_wrapper
         return track_decorator
+
+    def _sample(data, func, args, kwargs):
+        numcalls = data["numcalls"]
+        # only sample memory if nobody else is tracing, starting/stopping would clobber their trace
+        samplemem = numcalls % PerfTracker.mem_sample_every == 0 and not tracemalloc.is_tracing()
+        if samplemem:
+            tracemalloc.start()
+        try:
+            start_time = time.perf_counter_ns()
+            result = func(*args, **kwargs)
+            end_time = time.perf_counter_ns()
+            if samplemem:
+                memring = data["memring"]
+                memring[data["nummemsamples"] % memring.shape[0]] = tracemalloc.get_traced_memory()[1]
+                data["nummemsamples"] += 1
+        finally:
+            # a raising call must not leave tracing on for every later call
+            if samplemem:
+                tracemalloc.stop()
+        ring = data["ring"]
+        ring[numcalls % ring.shape[0]] = end_time - start_time
+        data["numcalls"] = numcalls + 1
+        return result
+
+    def sampled_runtimes(name) -> np.ndarray:
+        '''Runtimes in seconds of the most recent calls of a function recorded in sampling mode'''
+        data = PerfTracker.tracking_data[name]
+        return data["ring"][:min(data["numcalls"], data["ring"].shape[0])] / 1e9
+
+    def percentiles(name=None) -> dict:
+        '''
+        Runtime percentiles in seconds of functions tracked in sampling mode (over the last 
+        buffer_size calls) as {name: {"calls", "p50", "p90", "p99", "max", "maxmem"}}, for one 
+        function or all functions with recorded calls. maxmem is the largest sampled peak in bytes.
+        '''
+        names = [name] if name is not None else list(PerfTracker.tracking_data.keys())
+        stats = {}
+        for key in names:
+            runtimes = PerfTracker.sampled_runtimes(key)
+            if runtimes.shape[0] == 0:
+                continue
+            p50, p90, p99 = np.percentile(runtimes, (50, 90, 99))
+            data = PerfTracker.tracking_data[key]
+            mems = data["memring"][:min(data["nummemsamples"], data["memring"].shape[0])]
+            stats[key] = {
+                "calls": data["numcalls"], "p50": p50, "p90": p90, "p99": p99, "max": runtimes.max(), 
+                "maxmem": int(mems.max()) if mems.shape[0] > 0 else 0,
+            }
+        return stats
+
+    def report(name=None) -> str:
+        '''Table of percentiles() in ms'''
+        lines = [f"{'name':<16}{'calls':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'maxmem':>12}"]
+        for key, stat in PerfTracker.percentiles(name).items():
+            lines.append(f"{key:<16}{stat['calls']:>8}" + "".join(f"{stat[p] * 1e3:>10.3f}" for p in ("p50", "p90", "p99", "max")) + f"{stat['maxmem']:>12}")
+        return "\n".join(lines)
     
     def export_to_csv(name=None, export_individual=False):
+        import pandas as pd
         if name is not None:
-            value = PerfTracker.tracking_data[value]
+            value = PerfTracker.tracking_data[name]
             funcdata = np.array(value["runtimes"])
             funcdata = np.append(funcdata, np.array(value["maxmems"]))
             if funcdata.shape[0] == 0:
                 print(f"No data in perf tracker for {name}")
                 return
-            pd.DataFrame(funcdata).to_csv(f"perfdata_{key}.csv")
+            pd.DataFrame(funcdata).to_csv(f"perfdata_{name}.csv")
             return
         
         flatteneddata = {}
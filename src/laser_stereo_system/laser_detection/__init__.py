@@ -1,14 +1,56 @@
-from numba import cuda
-from debug import fancylogging
+'''
+Laser detection stages. The GPU settings CUDASIM, cupy, gpu and maxthreadsperblock2d are module
+attributes resolved on first access, so importing the package or its stage modules doesn't import
+cupy, query the CUDA device or log anything. Access them as laser_detection.<name> at call time.
+
+Call start_numba_threads() on the main thread before running parallel kernels from other threads.
+'''
 import math
-try:
-    import cupy
-    CUDASIM = False
-    gpu = cuda.get_current_device()
-    maxthreadsperblock2d = math.floor(math.sqrt(gpu.MAX_THREADS_PER_BLOCK))
-except:
-    import numpy as cupy
-    CUDASIM = True
-    gpu = cuda.current_context().device
-    maxthreadsperblock2d = math.floor(math.sqrt(1024))
-    fancylogging.log_warn("Couldn't import Cupy, assuming it is not supported and Numba CUDASIM is on.")
\ No newline at end of file
+
+GPU_ATTRIBUTES = ("CUDASIM", "cupy", "gpu", "maxthreadsperblock2d")
+_gpu_settings = None
+
+def gpu_settings() -> dict:
+    '''Imports cupy and queries the CUDA device on the first call, returns {name: value} of GPU_ATTRIBUTES'''
+    global _gpu_settings
+    if _gpu_settings is None:
+        from numba import cuda
+        try:
+            import cupy
+            gpu = cuda.get_current_device()
+            settings = {"CUDASIM": False, "cupy": cupy, "gpu": gpu,
+                        "maxthreadsperblock2d": math.floor(math.sqrt(gpu.MAX_THREADS_PER_BLOCK))}
+        except Exception:
+            # if cupy not available (i.e. system w/out nvidia GPU), use numpy
+            import numpy as cupy
+            from debug import fancylogging
+            settings = {"CUDASIM": True, "cupy": cupy, "gpu": cuda.current_context().device,
+                        "maxthreadsperblock2d": math.floor(math.sqrt(1024))}
+            fancylogging.log_warn("Couldn't import Cupy, assuming it is not supported and Numba CUDASIM is on.")
+        _gpu_settings = settings
+    return _gpu_settings
+
+def __getattr__(name):
+    if name in GPU_ATTRIBUTES:
+        return gpu_settings()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def start_numba_threads() -> str:
+    '''
+    Launches Numba's thread pool on the calling thread if it isn't running yet, with the thread safe
+    threading layer of LaserDetection.NUMBA_THREADING_LAYER if it is available. Numba launches the pool
+    on the first parallel kernel call, and if that happens on a worker thread with the tbb layer, the
+    interpreter hangs at exit. Returns the threading layer in use.
+    '''
+    import numba
+    from numba.np.ufunc import parallel
+    from constants import LaserDetection
+    if not parallel._is_initialized:
+        numba.config.THREADING_LAYER = LaserDetection.NUMBA_THREADING_LAYER
+        try:
+            numba.get_num_threads()
+        except ValueError:
+            # no thread safe layer (tbb or omp) installed, the default layer can still run the kernels
+            numba.config.THREADING_LAYER = "default"
+            numba.get_num_threads()
+    return numba.threading_layer()
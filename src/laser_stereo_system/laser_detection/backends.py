@@ -0,0 +1,161 @@
+import json
+import os
+import platform
+import time
+from typing import Callable
+import numpy as np
+from constants import LaserDetection
+
+# stage: signature every implementation of the stage has
+STAGES = {
+    "reward": "(img) -> reward image",
+    "gval": "(reward) -> G value image, positive on laser pixels",
+    "subpx": "(gvals, reward, min_gval) -> (subpixel offset image, center pixel)",
+    "patch": "(subpxs) -> (kept pixel image, PatchSet)",
+    "segment": "(laserpxbinary, patches, centerpx) -> line index of every patch",
+    "assoc": "(patches, polarlines) -> line index of every patch",
+    "3d": "(LaserPlanes, rows, cols, pointlines, out) -> (N, 3) points written to out",
+}
+
+def to_host(arr):
+    '''Host copy of a Numba CUDA device array or CuPy array, anything else as it is'''
+    if not hasattr(arr, "__cuda_array_interface__"):
+        return arr
+    return arr.copy_to_host() if hasattr(arr, "copy_to_host") else arr.get()
+
+class Backends:
+    '''
+    Registry of the implementations of every pipeline stage. Modules register implementations with
+    @Backends.register(stage, name), and the pipeline calls Backends.get(stage, shape) per frame.
+    Implementations of a stage take the same arguments (see STAGES) and return the same results up
+    to float rounding, since autotune swaps them on speed alone, device arrays handed between GPU
+    implementations are copied to the host for the others. tests/test_backends.py checks every
+    implementation against a reference.
+    The implementation used is the one autotune found fastest for this host and frame shape,
+    persisted in LaserDetection.BACKEND_CACHE_PATH, or otherwise the available implementation with
+    the highest priority. Implementations are only registered, never called, until first use, and
+    whether one is available (e.g. has a GPU) is asked the first time too.
+    '''
+
+    implementations = {stage: {} for stage in STAGES} # stage: {name: (func, priority, available)}
+    choices = None # "host/rowsxcols": {stage: name}, loaded on first use
+    cache_path = LaserDetection.BACKEND_CACHE_PATH
+    _available = {}
+
+    def register(stage: str, name: str, priority=0, available: Callable[[], bool] = None, device=False):
+        '''
+        Decorator registering a function as an implementation of a stage.
+
+        :param priority: implementations with higher priority are preferred without autotuning
+        :param available: called once on first use, the implementation is skipped if it returns False
+        :param device: the function takes CUDA device arrays, otherwise they are copied to the host first
+        '''
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage}, expected one of {list(STAGES)}")
+        def register_decorator(func: Callable):
+            if name in Backends.implementations[stage]:
+                raise ValueError(f"Already registered a {stage} implementation called {name}")
+            impl = func
+            if not device:
+                impl = lambda *args: func(*[to_host(arg) for arg in args])
+            Backends.implementations[stage][name] = (impl, priority, available)
+            return func
+        return register_decorator
+
+    def available(stage: str) -> list:
+        '''Names of the available implementations of a stage, highest priority first'''
+        names = []
+        for name, (_, priority, available) in Backends.implementations[stage].items():
+            if (stage, name) not in Backends._available:
+                Backends._available[(stage, name)] = available is None or bool(available())
+            if Backends._available[(stage, name)]:
+                names.append((priority, name))
+        return [name for _, name in sorted(names, key=lambda entry: -entry[0])]
+
+    def shape_key(shape) -> str:
+        return f"{platform.node()}/{shape[0]}x{shape[1]}"
+
+    def load(path=None) -> dict:
+        '''Loads the persisted choices, returns them as {host/shape: {stage: name}}'''
+        path = path or Backends.cache_path
+        Backends.choices = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                Backends.choices = json.load(f).get("choices", {})
+        return Backends.choices
+
+    def tuned(shape) -> bool:
+        '''Whether implementations were chosen for frames of the given shape on this host'''
+        if Backends.choices is None:
+            Backends.load()
+        return Backends.shape_key(shape) in Backends.choices
+
+    def choose(stage: str, shape=None) -> str:
+        '''Name of the implementation of a stage to use for frames of the given (rows, cols) shape,
+        without a shape the highest priority one'''
+        if Backends.choices is None:
+            Backends.load()
+        names = Backends.available(stage)
+        if len(names) == 0:
+            raise RuntimeError(f"No {stage} implementation available")
+        chosen = None if shape is None else Backends.choices.get(Backends.shape_key(shape), {}).get(stage)
+        return chosen if chosen in names else names[0]
+
+    def get(stage: str, shape=None) -> Callable:
+        '''Implementation of a stage to use for frames of the given (rows, cols) shape'''
+        return Backends.implementations[stage][Backends.choose(stage, shape)][0]
+
+    def autotune(stage_args: dict, shape, repeats=LaserDetection.AUTOTUNE_REPEATS, save=True, log=None) -> dict:
+        '''
+        Times every available implementation of every stage in stage_args on the given arguments
+        (one warmup call, which also compiles, then the best of repeats calls) and chooses the
+        fastest for frames of the given shape. Implementations that raise are skipped. The choices
+        are persisted unless save is False.
+
+        :param stage_args: {stage: argument tuple of a representative call}
+        :return: {stage: {name: best time in s}}
+        '''
+        if Backends.choices is None:
+            Backends.load()
+        key = Backends.shape_key(shape)
+        timings = {}
+        for stage, args in stage_args.items():
+            timings[stage] = {}
+            for name in Backends.available(stage):
+                func = Backends.implementations[stage][name][0]
+                try:
+                    func(*args)
+                    best = np.inf
+                    for _ in range(repeats):
+                        start = time.perf_counter()
+                        func(*args)
+                        best = min(best, time.perf_counter() - start)
+                except Exception as e:
+                    if log is not None: log(f"{stage} {name} failed: {e!r}")
+                    continue
+                timings[stage][name] = best
+                if log is not None: log(f"{stage} {name}: {best * 1e3:.3f} ms")
+            if timings[stage]:
+                Backends.choices.setdefault(key, {})[stage] = min(timings[stage], key=timings[stage].get)
+        if save:
+            Backends.save()
+        return timings
+
+    def save(path=None):
+        '''Writes the choices to the cache file, merged with choices other processes saved since they were loaded'''
+        path = path or Backends.cache_path
+        if path is None:
+            return
+        choices = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                choices = json.load(f).get("choices", {})
+        for key, stages in Backends.choices.items():
+            choices.setdefault(key, {}).update(stages)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmppath = f"{path}.{os.getpid()}.tmp"
+        with open(tmppath, "w") as f:
+            json.dump({"choices": choices}, f, indent=2, sort_keys=True)
+        os.replace(tmppath, path)
+        Backends.choices = choices
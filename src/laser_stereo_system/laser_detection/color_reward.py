@@ -1,19 +1,127 @@
 from constants import LaserDetection
-from laser_detection import cupy
+import laser_detection
+from laser_detection.backends import Backends
 import numpy as np
 from debug.perftracker import PerfTracker
-from numba import jit
+from numba import jit, njit, prange
 
+@Backends.register("reward", "objmode")
 @PerfTracker.track("reward")
-@jit(forceobj=True)
+@jit(forceobj=True, cache=True)
 def get_reward(img, weights=LaserDetection.DEFAULT_COLOR_WEIGHTS):
     '''Converts an RGB image to a single channel image by computing a 
     linear combination of the channels scaled by the given weights.'''
     return np.sum(img * weights, axis=2)
 
+@Backends.register("reward", "cuda", priority=2, available=lambda: not laser_detection.CUDASIM, device=True)
 @PerfTracker.track("reward_gpu")
 def get_reward_gpu(img, weights=LaserDetection.DEFAULT_COLOR_WEIGHTS):
     '''Converts an RGB image to a single channel image by computing a 
     linear combination of the channels scaled by the given weights.
     Uses CuPy for GPU acceleration.'''
-    return cupy.sum(img * weights, axis=2)
+    return laser_detection.cupy.sum(img * weights, axis=2)
+
+REWARD_MODE_FLOAT32 = 0
+REWARD_MODE_UINT16 = 1
+
+@njit(parallel=True, cache=True)
+def lut_reward(img, lut0, lut1, lut2, out):
+    '''Kernel summing per-channel lookup tables into a fixed-point reward image'''
+    for row in prange(img.shape[0]):
+        for col in range(img.shape[1]):
+            out[row, col] = lut0[img[row,col,0]] + lut1[img[row,col,1]] + lut2[img[row,col,2]]
+
+@njit(parallel=True, cache=True)
+def lut_reward_channel(img, channel, lut, out):
+    '''Kernel looking up a single channel of a fixed-point reward image'''
+    for row in prange(img.shape[0]):
+        for col in range(img.shape[1]):
+            out[row, col] = lut[img[row,col,channel]]
+
+@njit(parallel=True, cache=True)
+def float32_reward(img, w0, w1, w2, out):
+    '''Kernel computing a float32 reward image'''
+    for row in prange(img.shape[0]):
+        for col in range(img.shape[1]):
+            out[row, col] = np.float32(img[row,col,0]) * w0 + np.float32(img[row,col,1]) * w1 + np.float32(img[row,col,2]) * w2
+
+@njit(parallel=True, cache=True)
+def float32_reward_channel(img, channel, w, out):
+    '''Kernel computing a float32 reward image from a single channel'''
+    for row in prange(img.shape[0]):
+        for col in range(img.shape[1]):
+            out[row, col] = np.float32(img[row,col,channel]) * w
+
+class RewardEngine:
+    '''Computes reward images into a caller supplied buffer so no memory is allocated per frame. 
+    REWARD_MODE_UINT16 uses per-channel 256-entry lookup tables holding the weights in fixed point, 
+    producing a uint16 image equal to the reward multiplied by scale (thresholds on it must be scaled 
+    the same way). REWARD_MODE_FLOAT32 computes the weighted sum in float32, with scale 1. If only one 
+    channel contributes to the reward, only that channel is read.'''
+
+    def __init__(self, weights=LaserDetection.DEFAULT_COLOR_WEIGHTS, mode=REWARD_MODE_UINT16):
+        if mode not in (REWARD_MODE_FLOAT32, REWARD_MODE_UINT16):
+            raise ValueError(f"Unknown reward mode {mode}")
+        if len(weights) != 3 or min(weights) < 0:
+            raise ValueError("Reward weights should be 3 non-negative channel weights")
+        self.weights = tuple(float(w) for w in weights)
+        self.mode = mode
+        if mode == REWARD_MODE_UINT16:
+            self.dtype = np.dtype(np.uint16)
+            # largest scale keeping the sum of the three tables within uint16
+            self.scale = np.iinfo(np.uint16).max / max(255 * sum(self.weights), 1e-12)
+            values = np.arange(256, dtype=np.float64)
+            while True:
+                self.luts = [np.round(values * w * self.scale).astype(np.uint16) for w in self.weights]
+                if sum(int(lut[-1]) for lut in self.luts) <= np.iinfo(np.uint16).max:
+                    break
+                self.scale *= 0.999
+            contributing = [c for c, lut in enumerate(self.luts) if lut[-1] > 0]
+        else:
+            self.dtype = np.dtype(np.float32)
+            self.scale = 1.
+            self.float_weights = tuple(np.float32(w) for w in self.weights)
+            contributing = [c for c, w in enumerate(self.weights) if w > 0]
+        # channel to read if it is the only one with any effect, otherwise -1
+        self.dominant_channel = contributing[0] if len(contributing) == 1 else -1
+
+    def alloc(self, shape) -> np.ndarray:
+        '''Allocates an output buffer for images of the given (rows, cols[, channels]) shape'''
+        return np.empty(shape[:2], dtype=self.dtype)
+
+    def compute(self, img: np.ndarray, out: np.ndarray) -> np.ndarray:
+        '''Writes the reward of an RGB uint8 image into out and returns out'''
+        if img.ndim != 3 or img.shape[2] < 3 or img.dtype != np.uint8:
+            raise ValueError("Reward engine expects an RGB uint8 image")
+        if out.shape != img.shape[:2] or out.dtype != self.dtype:
+            raise ValueError(f"Output buffer should be {self.dtype} with shape {img.shape[:2]} (got {out.dtype} {out.shape})")
+        c = self.dominant_channel
+        if self.mode == REWARD_MODE_UINT16:
+            if c >= 0: lut_reward_channel(img, c, self.luts[c], out)
+            else: lut_reward(img, self.luts[0], self.luts[1], self.luts[2], out)
+        else:
+            if c >= 0: float32_reward_channel(img, c, self.float_weights[c], out)
+            else: float32_reward(img, *self.float_weights, out)
+        return out
+
+@PerfTracker.track("reward_engine")
+def get_reward_into(engine: RewardEngine, img, out):
+    '''Computes the reward of img into the preallocated out buffer using the given RewardEngine.'''
+    return engine.compute(img, out)
+
+_engines = {} # weights: float32 RewardEngine of get_reward_njit
+_buffers = {} # (weights, rows, cols): output buffer of get_reward_njit
+
+@Backends.register("reward", "njit", priority=1)
+def get_reward_njit(img, weights=LaserDetection.DEFAULT_COLOR_WEIGHTS):
+    '''get_reward with the parallel float32 RewardEngine kernels, same scale as get_reward. One engine
+    per weights and one output buffer per image shape are kept, so no memory is allocated per frame
+    and the returned image is overwritten by the next call for images of the same shape.'''
+    weights = tuple(float(w) for w in weights)
+    engine = _engines.get(weights)
+    if engine is None:
+        engine = _engines.setdefault(weights, RewardEngine(weights, REWARD_MODE_FLOAT32))
+    out = _buffers.get(weights + img.shape[:2])
+    if out is None:
+        out = _buffers.setdefault(weights + img.shape[:2], engine.alloc(img.shape))
+    return get_reward_into(engine, img, out)
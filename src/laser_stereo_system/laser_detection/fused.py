@@ -0,0 +1,119 @@
+from numba import njit, prange
+import numpy as np
+import math
+from constants import LaserDetection
+from debug.perftracker import PerfTracker
+
+WINLEN = LaserDetection.GVAL_WINLEN
+TILE_COLS = LaserDetection.FUSED_TILE_COLS
+# window weights of the discretized Gaussian integral, same as gval.py
+GVAL_WEIGHTS = np.array([1 - 2*abs(-k + (WINLEN - 1) / 2) for k in range(WINLEN)])
+
+@njit(parallel=True, cache=True)
+def fused_tiles(img, weights, min_gval, tilecols, cap, out_cols, out_rows, out_offsets, counts):
+    '''Kernel computing reward, G value and subpixel offset in one pass over the RGB image. Each
+    column tile keeps a ring buffer of the last WINLEN reward rows (plus a 2px halo for the
+    subpixel neighborhood) and writes its surviving candidates to its own slice of the output
+    buffers. If a tile finds more than cap candidates, only the count keeps increasing. Matches
+    find_gval_subpixels except for the three edge cases commented below, where it fails or
+    writes out of bounds.'''
+    rows = img.shape[0]
+    cols = img.shape[1]
+    for t in prange(counts.shape[0]):
+        c0 = t * tilecols
+        c1 = min(c0 + tilecols, cols)
+        h0 = max(c0 - 2, 0)
+        h1 = min(c1 + 2, cols)
+        ring = np.empty((WINLEN, h1 - h0))
+        n = 0
+        # the last row is never part of a window (see calculate_gaussian_integral_windows)
+        for r in range(rows - 1):
+            ringrow = r % WINLEN
+            for c in range(h0, h1):
+                ring[ringrow, c - h0] = img[r,c,0] * weights[0] + img[r,c,1] * weights[1] + img[r,c,2] * weights[2]
+            winstart = r - WINLEN + 1
+            if winstart < 0:
+                continue
+            y = winstart + WINLEN // 2
+            if y < 2 or y > rows - 3:
+                continue
+            center = y % WINLEN
+            for x in range(max(c0, 2), min(c1, cols - 2)):
+                xi = x - h0
+                G = 0.
+                for k in range(WINLEN):
+                    G += GVAL_WEIGHTS[k] * ring[(winstart + k) % WINLEN, xi]
+                if -G < min_gval:
+                    continue
+                # f(x), f(x-1), f(x+1)
+                fx = ring[center, xi]
+                fxm = ring[center, xi-1]
+                fxp = ring[center, xi+1]
+                denom = math.log(fxm) - 2 * math.log(fx) + math.log(fxp)
+                # differs from find_gval_subpixels, which only falls back to CoM5 on 0: a zero
+                # reward in the neighborhood makes a log -inf, where it fails with a math domain error
+                if denom == 0 or not math.isfinite(denom):
+                    # 5px Center of Mass (CoM5) detector
+                    fxp2 = ring[center, xi+2] # f(x+2)
+                    fxm2 = ring[center, xi-2] # f(x-2)
+                    num = 2*fxp2 + fxp - fxm - 2*fxm2
+                    denom = fxm2 + fxm + fx + fxp + fxp2
+                    if denom == 0:
+                        # all five rewards are 0, find_gval_subpixels would divide by zero
+                        continue
+                    subpixel_offset = num / denom
+                else:
+                    numer = math.log(fxm) - math.log(fxp)
+                    subpixel_offset = 0.5 * numer / denom
+                # find_gval_subpixels only skips offsets past cols, landing exactly on cols it
+                # would write outside the image
+                if x + subpixel_offset < 0 or x + subpixel_offset >= cols:
+                    continue
+                if n < cap:
+                    out_cols[t * cap + n] = x
+                    out_rows[t * cap + n] = y
+                    out_offsets[t * cap + n] = subpixel_offset
+                n += 1
+        counts[t] = n
+
+@njit(cache=True)
+def subpixel_image(candidates, shape):
+    '''Scatters (col, row, subpixel offset) candidates into a subpixel offset image
+    the same way find_gval_subpixels does. Candidates are written in order, so a later
+    candidate landing on the same pixel replaces an earlier one.'''
+    laser_subpixels = np.zeros(shape)
+    for i in range(candidates.shape[0]):
+        x, y, subpixel_offset = int(candidates[i,0]), int(candidates[i,1]), candidates[i,2]
+        laser_subpixels[y, int(x + subpixel_offset)] = (subpixel_offset % 1) + 1e-5
+    return laser_subpixels
+
+@PerfTracker.track("fused")
+def find_gval_subpixels_fused(img: np.ndarray, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL, weights=LaserDetection.DEFAULT_COLOR_WEIGHTS) -> np.ndarray:
+    '''Runs the reward, G value and subpixel stages in a single pass over an RGB image without
+    materializing any of the intermediate images. Returns the surviving candidates as an
+    (N, 3) array of (col, row, subpixel offset), ordered like the windows returned by
+    calculate_gaussian_integral_windows. Use subpixel_image to get the same output as
+    find_gval_subpixels.'''
+    rows, cols = img.shape[0], img.shape[1]
+    numtiles = int(math.ceil(cols / TILE_COLS))
+    weights = np.asarray(weights, dtype=np.float64)
+    counts = np.zeros(numtiles, dtype=np.int64)
+    cap = max(rows * TILE_COLS // 8, 1) # laser lines cover a small fraction of each column
+    while True:
+        out_cols = np.empty(numtiles * cap, dtype=np.int32)
+        out_rows = np.empty(numtiles * cap, dtype=np.int32)
+        out_offsets = np.empty(numtiles * cap, dtype=np.float64)
+        fused_tiles(img, weights, float(min_gval), TILE_COLS, cap, out_cols, out_rows, out_offsets, counts)
+        if counts.max(initial=0) <= cap:
+            break
+        cap = int(counts.max())
+
+    valid = np.arange(cap)[None, :] < counts[:, None]
+    valid = valid.ravel()
+    candidates = np.empty((int(counts.sum()), 3))
+    candidates[:,0] = out_cols[valid]
+    candidates[:,1] = out_rows[valid]
+    candidates[:,2] = out_offsets[valid]
+    # column major order, matching calculate_gaussian_integral_windows
+    order = np.lexsort((candidates[:,1], candidates[:,0]))
+    return candidates[order]
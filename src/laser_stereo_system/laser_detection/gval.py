@@ -1,9 +1,10 @@
 from numba import cuda, njit, prange, jit
-from laser_detection import maxthreadsperblock2d
+import laser_detection
 import math
 from constants import LaserDetection
 import numpy as np
 from debug.perftracker import PerfTracker
+from laser_detection.backends import Backends
 
 WINLEN = LaserDetection.GVAL_WINLEN
 MIN_GVAL = LaserDetection.DEFAULT_GVAL_MIN_VAL
@@ -30,7 +31,7 @@ def calculate_gaussian_integral_windows_gpu(reward_img, min_gval) -> cuda.device
     ''' 
     #memoization?
         
-    threadsperblock = (maxthreadsperblock2d, maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
+    threadsperblock = (laser_detection.maxthreadsperblock2d, laser_detection.maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
     blockspergrid_x = int(math.ceil(reward_img.shape[0] / threadsperblock[0]))
     blockspergrid_y = int(math.ceil(reward_img.shape[1] / threadsperblock[1]))
     blockspergrid = (blockspergrid_x, blockspergrid_y)
@@ -41,7 +42,7 @@ def calculate_gaussian_integral_windows_gpu(reward_img, min_gval) -> cuda.device
 
     return output_global_mem
 
-@njit
+@njit(cache=True)
 def jit_gvals(img, winstartrow, col, outimg):
     '''Helper function to calculate G values in parallel for all pixels in an image using Numba parallelization.'''
     # if(winstartrow % 64 == 0 and winstartcol % 64 == 0): print(winstartrow, winstartcol)
@@ -53,8 +54,9 @@ def jit_gvals(img, winstartrow, col, outimg):
         outimg[winstartrow, col] = G
         return G
 
+@Backends.register("gval", "njit", priority=1)
 @PerfTracker.track("gval_jit")
-@njit(parallel=True)
+@njit(parallel=True, cache=True)
 def calculate_gaussian_integral_windows_jit(reward_img) -> np.ndarray:
     '''Calculates discretized Gaussian integral over window 
     of size WINLEN. Takes in a mono laser intensity image. 
@@ -74,7 +76,7 @@ def calculate_gaussian_integral_windows_jit(reward_img) -> np.ndarray:
     return gvalimg
 
 @PerfTracker.track("gval")
-@jit(forceobj=True)
+@jit(forceobj=True) # not cached, numba can't cache the loops it lifts out of object mode functions
 def calculate_gaussian_integral_windows(reward_img, min_gval) -> np.ndarray:
     '''Calculates discretized Gaussian integral over window 
     of size WINLEN. Takes in a mono laser intensity image. 
@@ -96,4 +98,60 @@ def calculate_gaussian_integral_windows(reward_img, min_gval) -> np.ndarray:
     # num_lines = 15
     # expectedgoodgvals = int(rows * num_lines * 1.6)#1.4) # room for plenty of outliers
     # gvals = gvals[:expectedgoodgvals]
-    return np.array(gvals)
\ No newline at end of file
+    return np.array(gvals)
+
+# windows up to this length are summed directly (in the same order as the loops above,
+# so results are bit-identical), longer ones use running sums so cost stays O(1) per pixel
+DIRECT_MAX_WINLEN = 16
+
+@Backends.register("gval", "numpy")
+def gval_image(reward_img, winlen=WINLEN) -> np.ndarray:
+    '''Vectorized G value image. Entry [winstart, col] holds -G of the window starting at 
+    winstart (like calculate_gaussian_integral_windows_jit); the last winlen rows are zero. 
+    Computed as a 1-D convolution down each column for short windows, or with running 
+    sums for long ones.'''
+    rows = reward_img.shape[0]
+    numwins = max(rows - winlen, 0)
+    gvalimg = np.zeros(reward_img.shape)
+    if numwins == 0:
+        return gvalimg
+    G = gvalimg[:numwins]
+    if winlen <= DIRECT_MAX_WINLEN:
+        for k in range(winlen):
+            G += (1 - 2*abs(-k + (winlen - 1) / 2)) * reward_img[k:k+numwins]
+        np.negative(G, out=G)
+        return gvalimg
+
+    # -G = sum over the window of (2|i - c| - 1) * I(i), c being the window center.
+    # With prefix sums P0 = sum I(i) and P1 = sum i*I(i) each window is a handful of lookups.
+    P0 = np.zeros((rows + 1,) + reward_img.shape[1:])
+    P1 = np.zeros((rows + 1,) + reward_img.shape[1:])
+    np.cumsum(reward_img, axis=0, out=P0[1:])
+    np.cumsum(reward_img * np.arange(rows).reshape((rows,) + (1,) * (reward_img.ndim - 1)), axis=0, out=P1[1:])
+    m = (winlen - 1) / 2
+    winstarts = np.arange(numwins)
+    c = (winstarts + m).reshape((numwins,) + (1,) * (reward_img.ndim - 1))
+    s = winstarts + int(m) + 1 # first index right of the center
+    e = winstarts + winlen
+    left = c * (P0[s] - P0[:numwins]) - (P1[s] - P1[:numwins])
+    right = (P1[e] - P1[s]) - c * (P0[e] - P0[s])
+    G[:] = 2 * (left + right) - (P0[e] - P0[:numwins])
+    return gvalimg
+
+@PerfTracker.track("gval_vec")
+def calculate_gaussian_integral_windows_vec(reward_img, min_gval, winlen=WINLEN) -> np.ndarray:
+    '''Vectorized version of calculate_gaussian_integral_windows. Returns the same 
+    (col, center row, G) rows for windows whose G value is at least min_gval, in 
+    the same column major order. Windows may be longer than WINLEN here.'''
+    return gval_windows(gval_image(reward_img, winlen), min_gval, winlen)
+
+def gval_windows(gvalimg, min_gval, winlen=WINLEN) -> np.ndarray:
+    '''(col, center row, G) rows of the windows of a G value image of windows of length winlen 
+    whose G value is at least min_gval, in the column major order of calculate_gaussian_integral_windows'''
+    # transpose so nonzero walks the windows column by column like the loops do
+    cols, winstarts = np.nonzero(gvalimg[:max(gvalimg.shape[0] - winlen, 0)].T >= min_gval)
+    gvals = np.empty((cols.shape[0], 3))
+    gvals[:,0] = cols
+    gvals[:,1] = winstarts + winlen//2
+    gvals[:,2] = gvalimg[winstarts, cols]
+    return gvals
@@ -0,0 +1,97 @@
+import numpy as np
+from laser_detection.backends import Backends
+from util.mathutil import px_2_3d_many
+
+class LaserPlanes:
+    '''
+    Calibrated laser planes with everything needed to map image points to 3D precomputed once.
+
+    For a plane n.X + d = 0 and a pixel p = (col, row, 1), the camera ray is K^-1 p and the point
+    on the plane is X = K^-1 p / w with the inverse depth w = -(n^T K^-1 / d) p, so per plane
+    the whole mapping is the 4x3 matrix [K^-1; -(n^T K^-1) / d] followed by a divide.
+
+    Attributes (L planes):
+        planes - (L, 4) plane coefficients (A, B, C, D)
+        inv_depth - (L, 3) coefficients of the inverse depth w = inv_depth[l] . p
+        ray_to_3d - (L, 4, 3) homogeneous pixel to homogeneous 3D point matrices
+        origins, bases - (L, 3) point on each plane closest to the camera and (L, 2, 3)
+            orthonormal in-plane axes spanning the plane coordinates
+        homographies - (L, 3, 3) image to plane coordinate homographies
+    '''
+
+    def __init__(self, planes, K):
+        self.planes = np.asarray(planes, dtype=np.float64).reshape((-1, 4))
+        self.K = np.asarray(K, dtype=np.float64)[:3,:3]
+        Kinv = np.linalg.inv(self.K)
+        normals, d = self.planes[:,:3], self.planes[:,3]
+        if np.any(d == 0):
+            raise ValueError("LaserPlanes can't map image points to planes through the camera center")
+        self.inv_depth = -(normals @ Kinv) / d[:, None]
+        self.ray_to_3d = np.empty((len(self), 4, 3))
+        self.ray_to_3d[:,:3,:] = Kinv
+        self.ray_to_3d[:,3,:] = self.inv_depth
+
+        # plane coordinates: origin at the plane point closest to the camera and two in-plane axes
+        unitnormals = normals / np.linalg.norm(normals, axis=1)[:, None]
+        self.origins = -d[:, None] * normals / (normals * normals).sum(axis=1)[:, None]
+        helper = np.where(np.abs(unitnormals[:,[0]]) < 0.9, [[1., 0., 0.]], [[0., 1., 0.]])
+        e1 = np.cross(unitnormals, helper)
+        e1 /= np.linalg.norm(e1, axis=1)[:, None]
+        e2 = np.cross(unitnormals, e1)
+        self.bases = np.stack((e1, e2), axis=1)
+        # the image of plane point (s, t) is K [e1 e2 origin] (s, t, 1)
+        self.homographies = np.linalg.inv(self.K @ np.stack((e1, e2, self.origins), axis=2))
+
+    @classmethod
+    def load(cls, path, K) -> 'LaserPlanes':
+        '''Loads planes saved by calibrate_laser as (centroid, normal) rows <X,Y,Z,U,V,W>'''
+        laserplanes = np.load(path, allow_pickle=True)
+        return cls([
+            (u, v, w, -u*x -v*y -w*z)
+            for x,y,z,u,v,w in laserplanes
+        ], K)
+
+    def __len__(self):
+        return self.planes.shape[0]
+
+    def to_plane_coords(self, rows, cols, line):
+        '''(N, 2) plane coordinates of image points on a single plane'''
+        uvw = np.stack((cols, rows, np.ones(len(rows))), axis=1) @ self.homographies[line].T
+        return uvw[:,:2] / uvw[:,2:]
+
+    def to_3d(self, rows, cols, pointlines, out=None):
+        '''
+        Maps image points to 3D on their planes with one matrix multiply and divide per line group.
+
+        rows, cols - image coordinates of the points, cols may be subpixel
+        pointlines - plane index of each point, points must be grouped by line in increasing line
+            order as returned by extract_laser_points
+        out - optional (N, 3) buffer to write the points into
+        '''
+        pointlines = np.asarray(pointlines)
+        if np.any(pointlines[1:] < pointlines[:-1]):
+            raise ValueError("LaserPlanes.to_3d needs points grouped by line in increasing line order")
+        if out is None:
+            out = np.empty((pointlines.shape[0], 3))
+        pix = np.empty((pointlines.shape[0], 3))
+        pix[:,0] = cols
+        pix[:,1] = rows
+        pix[:,2] = 1
+        bounds = np.searchsorted(pointlines, np.arange(len(self) + 1))
+        for line in range(len(self)):
+            start, end = bounds[line], bounds[line+1]
+            if start == end:
+                continue
+            pts = pix[start:end] @ self.ray_to_3d[line].T
+            with np.errstate(divide="ignore", invalid="ignore"):
+                np.divide(pts[:,:3], pts[:,3:], out=out[start:end], casting="unsafe")
+        return out
+
+@Backends.register("3d", "laserplanes", priority=1)
+def laserplanes_to_3d(planes: LaserPlanes, rows, cols, pointlines, out=None):
+    return planes.to_3d(rows, cols, pointlines, out=out)
+
+@Backends.register("3d", "per_point")
+def per_point_to_3d(planes: LaserPlanes, rows, cols, pointlines, out=None):
+    '''Intersects every point's ray with its own plane row, without the per-plane precomputation'''
+    return px_2_3d_many(rows, cols, planes.planes[pointlines], planes.K, out=out)
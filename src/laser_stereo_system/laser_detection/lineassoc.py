@@ -0,0 +1,40 @@
+import numpy as np
+from constants import LaserDetection
+from debug.perftracker import PerfTracker
+from util.mathutil import polar_line_distances
+from laser_detection.backends import Backends
+
+@Backends.register("assoc", "centroid")
+@PerfTracker.track("assoc")
+def associate_patches(patches, polarlines, maxdistfromline=LaserDetection.MAX_DIST_FROM_LINE, use_all_points=False) -> np.ndarray:
+    '''
+    Associates every patch of a PatchSet with its closest line in one broadcast over a
+    patches x lines distance matrix.
+
+    :param patches: (PatchSet) laser patches
+    :param polarlines: lines as (r, theta), ordered like the laser planes they belong to
+    :param maxdistfromline: patches further than this from every line are thrown out
+    :param use_all_points: score each patch by the mean distance of all its points instead of
+        the distance of its centroid
+
+    :return: (np.ndarray) line index of each patch, or -1 for patches too far from every line
+    '''
+    numlines = len(polarlines)
+    if len(patches) == 0 or numlines == 0:
+        return np.full(len(patches), -1, dtype=int)
+    if use_all_points:
+        dists = polar_line_distances(patches.rows, patches.cols + patches.offsets, polarlines)
+        dists = np.add.reduceat(dists, patches.patch_ptr[:-1], axis=0) / patches.sizes[:, None]
+    else:
+        dists = polar_line_distances(patches.centroids[:,0], patches.centroids[:,1], polarlines)
+    bestlines = np.argmin(dists, axis=1)
+    mindists = dists[np.arange(bestlines.shape[0]), bestlines]
+    return np.where(mindists < maxdistfromline, bestlines, -1)
+
+def line_groups(patchlines, numlines) -> list[np.ndarray]:
+    '''Indices of the patches (or points) assigned to each line, from a per-patch (or per-point)
+    line index array'''
+    patchlines = np.asarray(patchlines)
+    order = np.argsort(patchlines, kind="stable")
+    bounds = np.searchsorted(patchlines[order], np.arange(numlines + 1))
+    return [order[bounds[idx]:bounds[idx+1]] for idx in range(numlines)]
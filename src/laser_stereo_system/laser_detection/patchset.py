@@ -0,0 +1,96 @@
+import numpy as np
+
+class PatchSet:
+    '''
+    Columnar (CSR) container of laser patches. The points of patch i are
+    rows[patch_ptr[i]:patch_ptr[i+1]], cols[...] and offsets[...] where offsets
+    are the subpixel column offsets of each point. Per-patch summaries (sizes,
+    mincols, maxcols, centroids) are computed once on construction.
+
+    Stages that assign patches to laser lines do so with an int array holding
+    the line index of each patch, or -1 for patches not on any line.
+    '''
+
+    def __init__(self, rows, cols, offsets, patch_ptr):
+        self.rows = np.ascontiguousarray(rows, dtype=np.int32)
+        self.cols = np.ascontiguousarray(cols, dtype=np.int32)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.float64)
+        self.patch_ptr = np.ascontiguousarray(patch_ptr, dtype=np.int64)
+        if not (self.rows.shape == self.cols.shape == self.offsets.shape) or self.patch_ptr[-1] != self.rows.shape[0]:
+            raise ValueError("PatchSet point arrays and patch_ptr don't agree in size")
+        self.sizes = np.diff(self.patch_ptr)
+        if np.any(self.sizes <= 0):
+            raise ValueError("PatchSet patches must not be empty")
+        starts = self.patch_ptr[:-1]
+        if len(self) > 0:
+            self.mincols = np.minimum.reduceat(self.cols, starts)
+            self.maxcols = np.maximum.reduceat(self.cols, starts)
+            # centroids as (row, col + subpixel offset)
+            self.centroids = np.empty((len(self), 2))
+            self.centroids[:,0] = np.add.reduceat(self.rows, starts, dtype=np.float64) / self.sizes
+            self.centroids[:,1] = np.add.reduceat(self.cols + self.offsets, starts) / self.sizes
+        else:
+            self.mincols = np.empty(0, dtype=np.int32)
+            self.maxcols = np.empty(0, dtype=np.int32)
+            self.centroids = np.empty((0, 2))
+
+    @classmethod
+    def from_labels(cls, rows, cols, offsets, labels):
+        '''Builds a PatchSet from points and the patch label of each point. Patches are ordered by
+        increasing label and points keep their relative order within a patch.'''
+        order = np.argsort(labels, kind="stable")
+        labels = np.asarray(labels)[order]
+        starts = np.flatnonzero(np.diff(labels)) + 1
+        patch_ptr = np.concatenate(([0], starts, [labels.shape[0]])) if labels.shape[0] > 0 else np.zeros(1)
+        return cls(np.asarray(rows)[order], np.asarray(cols)[order], np.asarray(offsets)[order], patch_ptr)
+
+    @classmethod
+    def from_lists(cls, patches):
+        '''Builds a PatchSet from lists of (row, col, offset) tuples'''
+        patches = [patch for patch in patches if len(patch) > 0]
+        sizes = [len(patch) for patch in patches]
+        pts = np.array([px for patch in patches for px in patch], dtype=np.float64).reshape((-1, 3))
+        return cls(pts[:,0], pts[:,1], pts[:,2], np.concatenate(([0], np.cumsum(sizes, dtype=np.int64))))
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0), np.zeros(1))
+
+    def __len__(self):
+        return self.patch_ptr.shape[0] - 1
+
+    @property
+    def numpts(self) -> int:
+        return self.rows.shape[0]
+
+    def patch_ids(self) -> np.ndarray:
+        '''Index of the patch each point belongs to'''
+        return np.repeat(np.arange(len(self)), self.sizes)
+
+    def patch(self, i):
+        '''(rows, cols, offsets) of patch i'''
+        start, end = self.patch_ptr[i], self.patch_ptr[i+1]
+        return self.rows[start:end], self.cols[start:end], self.offsets[start:end]
+
+    def first_points(self):
+        '''(rows, cols, offsets) of the first point of every patch'''
+        starts = self.patch_ptr[:-1]
+        return self.rows[starts], self.cols[starts], self.offsets[starts]
+
+    def point_lines(self, patchlines) -> np.ndarray:
+        '''Expands a per-patch line index array to a per-point one'''
+        return np.repeat(np.asarray(patchlines), self.sizes)
+
+    def select(self, indices) -> 'PatchSet':
+        '''New PatchSet with the given patches, in the given order'''
+        indices = np.asarray(indices, dtype=np.int64)
+        sizes = self.sizes[indices]
+        ptidx = np.repeat(self.patch_ptr[indices] - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+        return PatchSet(self.rows[ptidx], self.cols[ptidx], self.offsets[ptidx], np.concatenate(([0], np.cumsum(sizes))))
+
+    def to_lists(self) -> list[list[tuple[int,int,float]]]:
+        '''Patches as lists of (row, col, offset) tuples'''
+        return [
+            list(zip(self.rows[start:end].tolist(), self.cols[start:end].tolist(), self.offsets[start:end].tolist()))
+            for start, end in zip(self.patch_ptr[:-1], self.patch_ptr[1:])
+        ]
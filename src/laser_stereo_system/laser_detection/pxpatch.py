@@ -1,77 +1,135 @@
 import numpy as np
-from numba import cuda, jit
-from laser_detection import maxthreadsperblock2d
+from numba import cuda, njit
+import laser_detection
+from laser_detection.backends import Backends
 import sys
 from debug.perftracker import PerfTracker
-
-@jit(forceobj=True)
-def recurse_patch(row: int, col: int, patch: list, img: np.ndarray, onlyCheckImmediateNeighbors=True):
-    '''Helper method to recurse through a patch of pixels to find contiguous pixels
-    WARNING: onlyCheckImmediateNeighbors should be left to True in general, and this method should be replaced
-    with an iterative method, as it is common to exceed max recursion depth when using non-strict 
-    contiguity (AKA onlyCheckImmediateNeighbors=False)'''
-    if onlyCheckImmediateNeighbors:
-      # check neighbors
-      up = row-1
-      if up >= 0 and img[up, col] > 1e-6: # up
-          patch.append((up, col, img[up,col]))
-          img[up,col] = 0.
-          recurse_patch(up, col, patch, img)
-
-      down = row+1
-      if down <= img.shape[0] and img[down, col] > 1e-6: # down
-          patch.append((down, col, img[down,col]))
-          img[down,col] = 0.
-          recurse_patch(down, col, patch, img)
-
-      left = col-1
-      if left >= 0 and img[row, left] > 1e-6: # left
-          patch.append((row, left, img[row,left]))
-          img[row,left] = 0.
-          recurse_patch(row, left, patch, img)
-
-      right = col+1
-      if right <= img.shape[1] and img[row, right] > 1e-6: # right
-          patch.append((row, right, img[row,right]))
-          img[row,right] = 0.
-          recurse_patch(row, right, patch, img)
-    else:
-      # we define contiguity by being within 3 pixels of the source pixel
-      # therefore there is a 7x7 box around the original pixel in which to search for pixels
-      for i in range(-3,4): # [-3, -2, -1, 0, 2, 3]
-          searchingrow = row + i
-          for j in range(-3,4):
-              searchingcol = col + j
-              if searchingrow > 0 and searchingrow <= img.shape[0] and searchingcol > 0 and searchingcol <= img.shape[1]:   
-                  if img[searchingrow, searchingcol] > 1e-6:
-                      patch.append((searchingrow,searchingcol))
-                      img[searchingrow, searchingcol] = 0
-                      recurse_patch(searchingrow, searchingcol, patch, img, False)
-
+from debug.tracer import Tracer
+from laser_detection.patchset import PatchSet
+from constants import LaserDetection
+
+MIN_PATCH_SIZE = LaserDetection.MIN_PATCH_SIZE
+
+@njit(cache=True)
+def find_root(parent, i):
+    '''Finds the root of a union-find tree, halving the path on the way'''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+@njit(cache=True)
+def union(parent, a, b):
+    '''Joins two union-find trees, keeping the smaller root so roots are the first pixel scanned'''
+    a = find_root(parent, a)
+    b = find_root(parent, b)
+    if a < b: parent[b] = a
+    elif b < a: parent[a] = b
+
+@njit(cache=True)
+def label_patches(img, minval=1e-6, onlyCheckImmediateNeighbors=True):
+    '''Two-pass union-find connected component labeling of the pixels of img greater than minval.
+    Contiguity is either 4-connectivity (onlyCheckImmediateNeighbors) or being within 3 pixels 
+    of another pixel of the patch (a 7x7 box around it). Patches are labeled 1..N in the order 
+    their first pixel appears in a row major scan.
+    
+    Returns (labels, sizes, bboxes) where labels is an int32 image with 0 for background, and 
+    sizes[k-1] and bboxes[k-1] = (minrow, mincol, maxrow, maxcol) describe patch k.'''
+    rows, cols = img.shape
+    reach = 1 if onlyCheckImmediateNeighbors else 3
+    labels = np.zeros((rows, cols), dtype=np.int32)
+    parent = np.empty(rows * cols + 1, dtype=np.int32) # labels are 1 based
+    # first pass: provisional label per pixel, joined with already scanned neighbors
+    n = 0
+    for row in range(rows):
+        for col in range(cols):
+            if not img[row, col] > minval:
+                continue
+            n += 1
+            parent[n] = n
+            labels[row, col] = n
+            for i in range(-reach, 1):
+                searchingrow = row + i
+                if searchingrow < 0:
+                    continue
+                for j in range(-reach, reach+1):
+                    if i == 0 and j >= 0:
+                        break
+                    if onlyCheckImmediateNeighbors and i != 0 and j != 0:
+                        continue
+                    searchingcol = col + j
+                    if 0 <= searchingcol < cols and labels[searchingrow, searchingcol] != 0:
+                        union(parent, n, labels[searchingrow, searchingcol])
+    # second pass: compact labels, sizes and bounding boxes
+    compact = np.zeros(n + 1, dtype=np.int32)
+    sizes = np.zeros(n, dtype=np.int64)
+    bboxes = np.empty((n, 4), dtype=np.int64)
+    numpatches = 0
+    for row in range(rows):
+        for col in range(cols):
+            if labels[row, col] == 0:
+                continue
+            root = find_root(parent, labels[row, col])
+            if compact[root] == 0:
+                numpatches += 1
+                compact[root] = numpatches
+                bboxes[numpatches-1] = (row, col, row, col)
+            k = compact[root]
+            labels[row, col] = k
+            sizes[k-1] += 1
+            bboxes[k-1, 1] = min(bboxes[k-1, 1], col)
+            bboxes[k-1, 2] = row
+            bboxes[k-1, 3] = max(bboxes[k-1, 3], col)
+    return labels, sizes[:numpatches], bboxes[:numpatches]
+
+@njit(cache=True)
+def merge_blocks(output):
+    '''Union-find merge of the 7x7 block outcodes computed by gpu_patch. Neighboring blocks are 
+    joined when the pixels closest to their shared border are within 3px of each other. Blocks on 
+    the outer border of the grid are ignored. Returns the block labels (0 for empty blocks) and the 
+    number of pixels in each merged patch.'''
+    brows, bcols = output.shape[0], output.shape[1]
+    parent = np.arange(brows * bcols).astype(np.int32)
+    for i in range(1, brows-1):
+        for j in range(1, bcols-1):
+            if output[i,j,0] == 0:
+                continue
+            # top neighbor: its bottom reach plus our top reach
+            if i > 1 and output[i-1,j,0] > 0 and output[i,j,1] + output[i-1,j,2] >= 3:
+                union(parent, i * bcols + j, (i-1) * bcols + j)
+            # left neighbor: its right reach plus our left reach
+            if j > 1 and output[i,j-1,0] > 0 and output[i,j,3] + output[i,j-1,4] >= 3:
+                union(parent, i * bcols + j, i * bcols + j - 1)
+    blocklabels = np.zeros((brows, bcols), dtype=np.int32)
+    compact = np.zeros(brows * bcols, dtype=np.int32)
+    patchpxs = np.zeros(brows * bcols)
+    numpatches = 0
+    for i in range(1, brows-1):
+        for j in range(1, bcols-1):
+            if output[i,j,0] == 0:
+                continue
+            root = find_root(parent, i * bcols + j)
+            if compact[root] == 0:
+                numpatches += 1
+                compact[root] = numpatches
+            blocklabels[i,j] = compact[root]
+            patchpxs[compact[root]-1] += output[i,j,0]
+    return blocklabels, patchpxs[:numpatches]
+
+@Backends.register("patch", "njit", priority=1)
 @PerfTracker.track("patch")
-@jit(forceobj=True)
-def throw_out_small_patches(subpixel_offsets):
-    '''Throws out small patches of laser points, defined as a group of less than 5 contiguous laser points.
-    Currently the loose definition of contiguity is not implemented for this function due to recursion depth issues.'''
-    patches = []
-    # find patches
-    for row in range(subpixel_offsets.shape[0]):
-        for col in range(subpixel_offsets.shape[1]):
-            val = subpixel_offsets[row,col]
-            if val > 1e-6: # found laser px, look for patch
-                patch = [(row,col,val)]
-                subpixel_offsets[row,col] = 0.
-                recurse_patch(row, col, patch, subpixel_offsets, True)
-                if len(patch) >= 5:
-                    patches.append(patch)
-
+def throw_out_small_patches(subpixel_offsets, min_size=MIN_PATCH_SIZE, onlyCheckImmediateNeighbors=True):
+    '''Throws out small patches of laser points, defined as a group of less than min_size contiguous laser points.
+    Contiguity is 4-connectivity by default, or being within 3 pixels of another patch pixel when 
+    onlyCheckImmediateNeighbors is False. Returns the kept pixel image and a PatchSet whose patch 
+    pixels are in row major order.'''
+    labels, sizes, _ = label_patches(subpixel_offsets, 1e-6, onlyCheckImmediateNeighbors)
+    keep = np.zeros(sizes.shape[0] + 1, dtype=bool)
+    keep[1:] = sizes >= min_size
+    rows, cols = np.nonzero(keep[labels])
     laser_patch_img = np.zeros(subpixel_offsets.shape)
-    numpts = 0
-    for patch in patches:
-        for val in patch:
-            row, col, _ = val
-            laser_patch_img[row, col] = 1.
-            numpts += 1
+    laser_patch_img[rows, cols] = 1.
+    patches = PatchSet.from_labels(rows, cols, subpixel_offsets[rows, cols], labels[rows, cols])
     return laser_patch_img, patches
 
 @cuda.jit
@@ -102,11 +160,12 @@ def gpu_patch(img, minval, out):
                 pxs += 1
     out[outrow, outcol, 0] = pxs
 
+# not a patch backend: merging 7x7 blocks only approximates the contiguity of throw_out_small_patches
 @PerfTracker.track("patch_gpu")
-def throw_out_small_patches_gpu(subpixel_offsets) -> tuple[np.ndarray, list[list[tuple[int,int,float]]]]:
-    '''Throws out small patches of laser points, defined as a group of less than 5 contiguous laser points.
+def throw_out_small_patches_gpu(subpixel_offsets) -> tuple[np.ndarray, PatchSet]:
+    '''Throws out small patches of laser points, defined as a group of less than MIN_PATCH_SIZE contiguous laser points.
     Contiguity is defined as being within 3 pixels of the source pixel, or within a 7x7 box.'''
-    threadsperblock = (maxthreadsperblock2d // 2, maxthreadsperblock2d // 2)# (16,16) # thread dims multiplied must not exceed max threads per block
+    threadsperblock = (laser_detection.maxthreadsperblock2d // 2, laser_detection.maxthreadsperblock2d // 2)# (16,16) # thread dims multiplied must not exceed max threads per block
     # we want each thread to have a 7x7 area to go over. we don't have 
     # to worry about going all the way to the edge since there won't be 
     # laser points there anyways and we are only throwing out max 6 rows and columns
@@ -114,88 +173,36 @@ def throw_out_small_patches_gpu(subpixel_offsets) -> tuple[np.ndarray, list[list
     blockspergrid_y = int(subpixel_offsets.shape[1] / 7 / threadsperblock[1])
     blockspergrid = (blockspergrid_x, blockspergrid_y)
 
-    d_arr = cuda.to_device(subpixel_offsets)
-    output_global_mem = cuda.device_array((blockspergrid[0] * threadsperblock[0], blockspergrid[1] * threadsperblock[1], 5), dtype=np.float64)
-    gpu_patch[blockspergrid, threadsperblock](d_arr, sys.float_info.min, output_global_mem)
+    with Tracer.span("patch_gpu.to_device"):
+        d_arr = cuda.to_device(subpixel_offsets)
+        output_global_mem = cuda.device_array((blockspergrid[0] * threadsperblock[0], blockspergrid[1] * threadsperblock[1], 5), dtype=np.float64)
+    with Tracer.span("patch_gpu.kernel"):
+        gpu_patch[blockspergrid, threadsperblock](d_arr, sys.float_info.min, output_global_mem)
     # return output_global_mem
-    output = output_global_mem.copy_to_host()
+    with Tracer.span("patch_gpu.copy_to_host"):
+        output = output_global_mem.copy_to_host()
 
     # TODO figure out why seemingly good patches are being thrown out
 
-    # merge
-    goodblockpatches = []
-    badblockpatches = []
-    for i in range(1,output.shape[0]-1):
-        for j in range(1,output.shape[1]-1):
-            # num pxs in this patch, range to connect to other patch px on top, bottom, left, and right
-            pxs, top, bottom, left, right = output[i, j]
-            # use similar algo to normal throw out small patches here
-            if pxs == 0: continue
-
-            patch = []
-            patchpxs = output[i,j,0]
-            output[i,j,0] = 0
-            toexplore = [(i,j)]
-
-            canexplore = lambda i_x, j_x : 0 <= i_x < output.shape[0] and 0 <= j_x < output.shape[1] and output[i_x,j_x,0] > 0
+    # merge blocks whose pixels come within 3px of each other across the shared border
+    with Tracer.span("patch_gpu.merge_blocks"):
+        blocklabels, patchpxs = merge_blocks(output)
+    good = np.zeros(patchpxs.shape[0] + 1, dtype=bool)
+    good[1:] = patchpxs >= MIN_PATCH_SIZE
+    bad = ~good
+    bad[0] = False
+
+    # block label of every pixel, block (i,j) covers the 7x7 box centered on (7i, 7j)
+    rowblocks = (np.arange(subpixel_offsets.shape[0]) + 3) // 7
+    colblocks = (np.arange(subpixel_offsets.shape[1]) + 3) // 7
+    validrows = rowblocks < blocklabels.shape[0]
+    validcols = colblocks < blocklabels.shape[1]
+    pxlabels = np.zeros(subpixel_offsets.shape, dtype=np.int32)
+    pxlabels[np.ix_(validrows, validcols)] = blocklabels[rowblocks[validrows]][:, colblocks[validcols]]
 
-            while toexplore:
-                block = toexplore.pop(0)
-                patch.append(block)
-                explorerow, explorecol = block
-                exploretop = output[explorerow, explorecol, 1]
-                explorebottom = output[explorerow, explorecol, 2]
-                exploreleft = output[explorerow, explorecol, 3]
-                exploreright = output[explorerow, explorecol, 4]
-                
-                # top
-                row_neighbor, col_neighbor = explorerow-1, explorecol
-                if canexplore(row_neighbor, col_neighbor) and exploretop + output[row_neighbor, col_neighbor, 2] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # bottom
-                row_neighbor, col_neighbor = explorerow+1, explorecol
-                if canexplore(row_neighbor, col_neighbor) and explorebottom + output[row_neighbor, col_neighbor, 1] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # left
-                row_neighbor, col_neighbor = explorerow, explorecol-1
-                if canexplore(row_neighbor, col_neighbor) and exploreleft + output[row_neighbor, col_neighbor, 4] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # right
-                row_neighbor, col_neighbor = explorerow, explorecol+1
-                if canexplore(row_neighbor, col_neighbor) and exploreright + output[row_neighbor, col_neighbor, 3] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-
-            if patchpxs < 5: badblockpatches.append(patch)
-            else: goodblockpatches.append(patch)
-    
     filteredoffsets = subpixel_offsets.copy()
-    for blockpatch in badblockpatches:
-        for block in blockpatch:
-            blockrow, blockcol = block[0] * 7, block[1] * 7
-            for i in range(-3,4):
-                for j in range(-3,4):
-                    row, col = blockrow + i, blockcol + j
-                    filteredoffsets[row,col] = 0
-    goodpatches = []
-    for blockpatch in goodblockpatches:
-        patch = []
-        for block in blockpatch:
-            blockrow, blockcol = block[0] * 7, block[1] * 7
-            for i in range(-3,4):
-                for j in range(-3,4):
-                    row, col = blockrow + i, blockcol + j
-                    if(subpixel_offsets[row,col] > 0): patch.append((row,col,subpixel_offsets[row,col]))
-        goodpatches.append(patch)
+    filteredoffsets[bad[pxlabels]] = 0
+    rows, cols = np.nonzero(good[pxlabels] & (subpixel_offsets > 0))
+    goodpatches = PatchSet.from_labels(rows, cols, subpixel_offsets[rows, cols], pxlabels[rows, cols])
 
     return filteredoffsets, goodpatches
\ No newline at end of file
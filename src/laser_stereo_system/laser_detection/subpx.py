@@ -1,7 +1,9 @@
 from numba import cuda, njit, prange, jit
 import numpy as np
 from constants import LaserDetection
-from laser_detection import maxthreadsperblock2d, cupy
+import laser_detection
+from laser_detection.backends import Backends
+from laser_detection.gval import gval_windows
 import math
 from debug.perftracker import PerfTracker
 
@@ -45,74 +47,55 @@ def find_subpixel_gpu(gvals, reward_img, minval, offset_from_winstart_to_center,
                 subpixel_offset = 0.5 * numer / denom
             output[center, col] = subpixel_offset
 
-@njit(parallel=True) # TODO: retest this
+@njit(parallel=True, cache=True)
 def find_subpixel(gvals, reward_img, minval, offset_from_winstart_to_center, output):
-    '''Helper method to find subpixel offset of all pixels using CPU parallelization'''
-    row, col = cuda.grid(2)
-    # if (row,col) not in gvalset: return
-    # center of window
-    center = row + offset_from_winstart_to_center
-    if gvals[row,col] < minval: 
-        return
-    #if not (0 < row < ln_reward.shape[0]-1 and 0 < col < ln_reward.shape[1]-1) or gvals[row,col] < minval: 
-    # TODO if abs(offset) >= 1, move the pixel the offset is relative to 
-    # correspondingly subtracting the offset until the abs(offset) < 1. If 
-    # new pixel comes along that lands in there that has to travel less from its offset, 
-    # use the new pixel instead
-
-    # ln(f(x)), ln(f(x-1)), ln(f(x+1))
-    lnfx = math.log(reward_img[center, col])
-    lnfxm = math.log(reward_img[center-1, col])
-    lnfxp = math.log(reward_img[center+1, col])
-    denom = lnfxm - 2 * lnfx + lnfxp
-    if denom == 0:
-        # # 5px Center of Mass (CoM5) detector
-        fx = reward_img[center, col] # f(x)
-        fxp = reward_img[center+1, col] # f(x+1)
-        fxm = reward_img[center-1, col] # f(x-1)
-        fxp2 = reward_img[center+2, col] # f(x+2)
-        fxm2 = reward_img[center-2, col] # f(x-2)
-        num = 2*fxp2 + fxp - fxm - 2*fxm2
-        denom = fxm2 + fxm + fx + fxp + fxp2
-        subpixel_offset = num / denom
-        subpixel_offset = -1
-    else:
-        numer = lnfxm - lnfxp
-        subpixel_offset = 0.5 * numer / denom
-    output[center, col] = subpixel_offset
+    '''Helper method to find the subpixels of all windows of a G value image reaching minval using
+    CPU parallelization, one image row per thread. Writes the subpixel image find_gval_subpixels
+    writes for the same windows, a row's windows in increasing column order so the last one
+    landing on a pixel wins like there. Offsets landing outside the image, or NaN, are skipped.'''
+    rows = reward_img.shape[0]
+    cols = reward_img.shape[1]
+    for y in prange(2, rows-2):
+        winstart = y - offset_from_winstart_to_center
+        if winstart < 0 or winstart >= gvals.shape[0] - WINLEN:
+            continue
+        for x in range(2, cols-2):
+            if gvals[winstart, x] < minval:
+                continue
+            # f(x), f(x-1), f(x+1)
+            fx = reward_img[y,x]
+            fxm = reward_img[y,x-1]
+            fxp = reward_img[y,x+1]
+            denom = math.log(fxm) - 2 * math.log(fx) + math.log(fxp)
+            if denom == 0:
+                # 5px Center of Mass (CoM5) detector
+                fxp2 = reward_img[y,x+2] # f(x+2)
+                fxm2 = reward_img[y,x-2] # f(x-2)
+                num = 2*fxp2 + fxp - fxm - 2*fxm2
+                denom = fxm2 + fxm + fx + fxp + fxp2
+                subpixel_offset = num / denom
+            else:
+                numer = math.log(fxm) - math.log(fxp)
+                subpixel_offset = 0.5 * numer / denom
+            if not (0 <= x + subpixel_offset < cols):
+                continue
+            output[y,int(x+subpixel_offset)] = (subpixel_offset % 1) + 1e-5
 
 @PerfTracker.track("subpx_gpu")
-def find_gval_subpixels_gpu(gvals: np.ndarray, reward_img: np.ndarray, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL, gpu=False):
+def find_gval_subpixels_gpu(gvals: np.ndarray, reward_img: np.ndarray, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL):
     '''Calculates subpixel offsets of candidate laser pixels based on the assumption of a 
     Gaussian distribution of laser intensity. When Gaussian approximation is not possible, 
-    a center of mass detector (CoM5) is used instead. Can use CPU or GPU parallelization.'''
+    a center of mass detector (CoM5) is used instead. Uses CPU parallelization.'''
     if gvals.shape != reward_img.shape: raise Exception("gval array should be same size as reward_img (gval.shape != reward_img.shape)")
     offset_from_winstart_to_center = WINLEN // 2
-
-    threadsperblock = (maxthreadsperblock2d, maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
-    blockspergrid_x = int(math.ceil(gvals.shape[0] / threadsperblock[0]))
-    blockspergrid_y = int(math.ceil(gvals.shape[1] / threadsperblock[1]))
-    blockspergrid = (blockspergrid_x, blockspergrid_y)
-
-    if gpu: # TODO: retest this
-        d_reward_img = cuda.to_device(reward_img)
-        with np.errstate(divide='ignore'):
-            d_reward_img = cupy.array(reward_img)
-            ln_reward = cupy.log(d_reward_img)
-            ln_reward[ln_reward == cupy.nan] = 0
-            ln_reward[abs(ln_reward) == cupy.inf] = 0
-        d_ln_reward = cuda.to_device(ln_reward)
-        output_global_mem = cuda.to_device(np.zeros(gvals.shape))#cuda.device_array(gvals.shape)
-        find_subpixel[blockspergrid, threadsperblock](cuda.to_device(gvals), d_reward_img, min_gval, offset_from_winstart_to_center, output_global_mem)
-        output = output_global_mem.copy_to_host()
-    else:
-        output = np.zeros(gvals.shape)
-        find_subpixel(gvals, reward_img, min_gval, offset_from_winstart_to_center, output)
+    output = np.zeros(gvals.shape)
+    # float so an int threshold doesn't compile another specialization
+    find_subpixel(gvals, reward_img, float(min_gval), offset_from_winstart_to_center, output)
     return output
 
 
 @PerfTracker.track("subpx")
-@jit(forceobj=True)
+@jit(forceobj=True) # not cached, numba can't cache the loops it lifts out of object mode functions
 def find_gval_subpixels(gvals: np.ndarray, reward_img: np.ndarray):
     '''Calculates subpixel offsets of candidate laser pixels based on the assumption of a 
     Gaussian distribution of laser intensity. When Gaussian approximation is not possible, 
@@ -151,4 +134,24 @@ def find_gval_subpixels(gvals: np.ndarray, reward_img: np.ndarray):
         # laser_img[y,int(x+subpixel_offset)] = 1.0
         laser_subpixels[y,int(x+subpixel_offset)] = (subpixel_offset % 1) + 1e-5
     # print("badoffsets: ", badoffsets, "count: ", count, "windows: ", windows, "comcount: ", comcount, "lncount: ", lncount, "oobcount: ", oobcount, "ooboffsetcount: ", ooboffsetcount)
-    return laser_subpixels
\ No newline at end of file
+    return laser_subpixels
+
+def center_pixel(gvals, min_gval=LaserDetection.CENTER_DOT_MIN_GVAL) -> np.ndarray:
+    '''(row, col) of the first window in row major order that reaches min_gval together with its 
+    horizontal neighbors, where the center dot is, or (0, 0) if there is none'''
+    bright = gvals >= min_gval
+    candidates = np.flatnonzero(bright[:, 1:-1] & bright[:, :-2] & bright[:, 2:])
+    if candidates.shape[0] == 0:
+        return np.zeros(2, dtype=int)
+    row, col = np.unravel_index(candidates[0], (gvals.shape[0], gvals.shape[1] - 2))
+    return np.array((row, col + 1))
+
+@Backends.register("subpx", "objmode")
+def find_gval_subpixels_image(gvals: np.ndarray, reward_img: np.ndarray, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL):
+    '''find_gval_subpixels on a G value image, returning the subpixel offsets and the center pixel'''
+    return find_gval_subpixels(gval_windows(gvals, min_gval), reward_img), center_pixel(gvals)
+
+@Backends.register("subpx", "njit", priority=1)
+def find_gval_subpixels_njit(gvals: np.ndarray, reward_img: np.ndarray, min_gval=LaserDetection.DEFAULT_GVAL_MIN_VAL):
+    '''find_gval_subpixels_image with the parallel find_subpixel kernel'''
+    return find_gval_subpixels_gpu(gvals, reward_img, min_gval), center_pixel(gvals)
@@ -0,0 +1,127 @@
+'''
+Explicit warmup of the Numba kernels of the detection stages, so the first frame runs as fast as
+the following ones. The nopython kernels are compiled with cache=True, the CUDA kernels aren't
+cached as the CUDA simulator can't cache them. With several workers, warmup first compiles the
+kernels in worker processes in parallel (Numba compiles one function at a time in a process),
+which writes them to the on-disk cache. This process then loads every kernel from the cache and
+runs it once on blank inputs of each shape. The workers are skipped if a previous warmup already
+filled the cache for the same kernel sources, dtypes and Numba version, see
+LaserDetection.WARMUP_STAMP_PATH.
+
+Numba specializes kernels on the dtype, dimensions and memory layout of their arguments, not on
+their shape, so the RGB input is warmed up as a read only ROI view of a larger frame, like
+LaserPipeline passes decoded frames, as a writable view and contiguous.
+'''
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numba
+import numpy as np
+import laser_detection
+from constants import LaserDetection
+from laser_detection import color_reward, fused, gval, pxpatch, subpx
+import laser_detector
+
+# kernels numba can't cache, compiling them in a worker doesn't help this process
+UNCACHED = ("subpx_objmode",)
+# kernels that need a GPU, only warmed up in this process
+DEVICE = ("gval_cuda", "subpx_cuda")
+
+def kernel_calls(shape, dtype) -> dict:
+    '''
+    {kernel name: [calls]} of zero argument functions making the calls the stages make to each
+    kernel for inputs of the given (rows, cols) shape and dtype. Kernels not taking inputs of the
+    dtype are left out.
+    '''
+    dtype = np.dtype(dtype)
+    img = np.zeros(shape, dtype=dtype)
+    frame = np.zeros((shape[0] + 1, shape[1] + 1, 3), dtype=dtype)
+    decoded = frame.copy()
+    decoded.flags.writeable = False
+    rgbs = (decoded[1:, 1:], frame[1:, 1:], np.ascontiguousarray(frame[1:, 1:]))
+    nowindows = np.zeros((0, 3))
+    noedges = np.zeros(0, dtype=np.int64)
+    calls = {
+        "reward_objmode": [lambda rgb=rgb: color_reward.get_reward.__wrapped__(rgb) for rgb in rgbs],
+        "gval_njit": [lambda: gval.calculate_gaussian_integral_windows_jit.__wrapped__(img)],
+        "subpx_objmode": [lambda: subpx.find_gval_subpixels.__wrapped__(nowindows, img)],
+        "subpx_njit": [lambda: subpx.find_gval_subpixels_gpu.__wrapped__(np.zeros(shape), img)],
+        "patch_njit": [lambda: pxpatch.throw_out_small_patches.__wrapped__(img)],
+        # host side merge of the CUDA patch stage, takes the block outcodes whatever the input dtype
+        "patch_merge": [lambda: pxpatch.merge_blocks(np.zeros((3, 3, 5)))],
+        "segment_mst": [lambda: laser_detector.maximum_spanning_forest(0, noedges, noedges)],
+        "fused": [lambda rgb=rgb: fused.subpixel_image(fused.find_gval_subpixels_fused.__wrapped__(rgb), shape) for rgb in rgbs],
+    }
+    if dtype == np.uint8:
+        # every mode, reading all channels or only the dominant one
+        engines = [color_reward.RewardEngine(weights, mode)
+                   for mode in (color_reward.REWARD_MODE_FLOAT32, color_reward.REWARD_MODE_UINT16)
+                   for weights in (LaserDetection.DEFAULT_COLOR_WEIGHTS, (0., 1., 0.))]
+        calls["reward_engine"] = [lambda rgb=rgb, engine=engine: engine.compute(rgb, engine.alloc(rgb.shape)) for rgb in rgbs for engine in engines]
+    if not laser_detection.CUDASIM:
+        calls["gval_cuda"] = [lambda: laser_detector.calculate_gaussian_integral_windows(img)]
+        calls["subpx_cuda"] = [lambda: laser_detector.find_gval_subpixels_gpu(np.zeros(shape), img)]
+    return calls
+
+def _compile(name, shapes, dtypes):
+    '''Worker compiling one kernel for every shape and dtype, which writes it to the cache'''
+    for shape in shapes:
+        for dtype in dtypes:
+            for call in kernel_calls(shape, dtype).get(name, []):
+                call()
+
+def cache_key(names, dtypes) -> str:
+    '''Key of the cached kernels, changes with anything making numba recompile them'''
+    parts = [numba.__version__, sys.version] + list(names) + [dtype.str for dtype in dtypes]
+    parts += [f"{module.__file__}:{os.path.getmtime(module.__file__)}" for module in (color_reward, fused, gval, pxpatch, subpx, laser_detector)]
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+def _stamped_keys(path) -> list:
+    if path is None or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f).get("keys", [])
+
+def _stamp(path, key):
+    keys = _stamped_keys(path)
+    if path is None or key in keys:
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmppath = f"{path}.{os.getpid()}.tmp"
+    with open(tmppath, "w") as f:
+        json.dump({"keys": keys + [key]}, f, indent=2)
+    os.replace(tmppath, path)
+
+def warmup(shapes, dtypes=LaserDetection.WARMUP_DTYPES, workers=LaserDetection.WARMUP_WORKERS,
+           stamp_path=LaserDetection.WARMUP_STAMP_PATH, log=None) -> dict:
+    '''
+    Precompiles and runs every kernel for inputs of each of the (rows, cols) ROI shapes and dtypes.
+
+    :param workers: processes compiling kernels in parallel first, 1 to only compile in this process
+    :param stamp_path: file recording which kernels are cached, None to always use the workers
+    :return: {kernel name: s spent compiling or loading and running it in this process}
+    '''
+    shapes = [tuple(int(n) for n in shape[:2]) for shape in shapes]
+    dtypes = [np.dtype(dtype) for dtype in dtypes]
+    names = list(dict.fromkeys(name for shape in shapes for dtype in dtypes for name in kernel_calls(shape, dtype)))
+    compiled = [name for name in names if name not in UNCACHED + DEVICE]
+    key = cache_key(compiled, dtypes)
+    if workers > 1 and len(compiled) > 1 and key not in _stamped_keys(stamp_path):
+        start = time.perf_counter()
+        # spawn, numba's thread pool isn't fork safe
+        with ProcessPoolExecutor(max_workers=min(workers, len(compiled)), mp_context=multiprocessing.get_context("spawn")) as pool:
+            list(pool.map(_compile, compiled, [shapes] * len(compiled), [dtypes] * len(compiled)))
+        if log is not None: log(f"Compiled {len(compiled)} kernels in {min(workers, len(compiled))} workers in {time.perf_counter() - start:.3f} s")
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        _compile(name, shapes, dtypes)
+        timings[name] = time.perf_counter() - start
+        if log is not None: log(f"warmup {name}: {timings[name] * 1e3:.3f} ms")
+    _stamp(stamp_path, key)
+    return timings
@@ -4,20 +4,33 @@
 
 from enum import Enum
 from functools import wraps
+from collections import deque
+import heapq
 import math
 import os
 import time
+import threading
+from queue import Queue
 import numpy as np
-from numba import cuda # if cuda is not available, should set variable NUMBA_CUDA_SIM = 1 in terminal
-from PIL import Image
-from laser_stereo_system.util.mathutil import px_2_3d, angle_wrap, merge_polar_lines
-from constants import ImageDisplay
+from numba import cuda, njit # if cuda is not available, should set variable NUMBA_CUDA_SIM = 1 in terminal
+from laser_stereo_system.util.mathutil import px_2_3d, px_2_3d_many, angle_wrap, merge_polar_lines
+from constants import ImageDisplay, LaserDetection
 DISP_COLORS = ImageDisplay.DISP_COLORS
 DISP_COLORSf = ImageDisplay.DISP_COLORSf
 import cv2 as cv
 import sys
-import matplotlib.pyplot as plt
 from constants import ZedMini
+from debug.perftimer import PerfTimer
+from debug.perftracker import PerfTracker
+from debug.tracer import Tracer
+from laser_detection.pxpatch import find_root, union
+from laser_detection.patchset import PatchSet
+from laser_detection.lineassoc import line_groups
+import laser_detection # GPU settings are resolved on first use, see laser_detection/__init__.py
+from laser_detection import color_reward, gval, subpx # registers their stage implementations
+from laser_detection.laserplanes import LaserPlanes
+from laser_detection.backends import Backends, to_host
+from util.raytable import get_camera_ray_table
 
 class LaserDetectorStep(Enum):
     ORIG = 1
@@ -45,18 +58,6 @@ TIMED_STEPS = []
 DEBUG_MODE = True
 MAX_TEST_IMGS = 1
 
-# if cupy not available (i.e. system w/out nvidia GPU), use numpy
-try:
-    import cupy
-    CUDASIM = False
-    gpu = cuda.get_current_device()
-    maxthreadsperblock2d = math.floor(math.sqrt(gpu.MAX_THREADS_PER_BLOCK))
-except:
-    import numpy as cupy
-    CUDASIM = True
-    gpu = cuda.current_context().device
-    maxthreadsperblock2d = math.floor(math.sqrt(1024))
-
 # Constants, should move these to param yaml file if gonna use with ROS
 DEFAULT_COLOR_WEIGHTS = (0.12,0.85,.12)#(0.12, 0.85, 0.18) # RGB
 DEFAULT_GVAL_MIN_VAL = 1910#2010.#1859.
@@ -65,6 +66,7 @@ WINLEN = 5 # works for 1080p and 2.2k for Zed mini
 NUM_LASER_LINES = 15
 MERGE_HLP_LINE_DIST_THRESH = 20
 MERGE_HLP_LINES_ANG_THRESH = 3
+CENTER_DOT_MIN_GVAL = LaserDetection.CENTER_DOT_MIN_GVAL
 
 def timeit(func):
     @wraps(func)
@@ -82,12 +84,10 @@ def timeit(func):
     return timeit_wrapper
 
 def timeitstep(step: LaserDetectorStep):
-    if step not in TIMED_STEPS: return lambda x : x
-    return timeit
-
-@timeitstep(LaserDetectorStep.REWARD)
-def reward_img(img, weights=DEFAULT_COLOR_WEIGHTS):
-    return cupy.sum(img * weights, axis=2)
+    '''Traces every step as a Tracer span and also times the steps in TIMED_STEPS'''
+    span = Tracer.trace(step.name.lower())
+    if step not in TIMED_STEPS: return span
+    return lambda func : span(timeit(func))
 
 @cuda.jit
 def gpu_gvals(img, out):
@@ -100,6 +100,7 @@ def gpu_gvals(img, out):
         G *= -1 # TODO figure out why have to do this
         out[winstartrow,winstartcol] = G
 
+@Backends.register("gval", "cuda", priority=2, available=lambda: not laser_detection.CUDASIM, device=True)
 @timeitstep(LaserDetectorStep.GVAL)
 def calculate_gaussian_integral_windows(img) -> cuda.devicearray:
     '''Calculates discretized Gaussian integral over window 
@@ -109,75 +110,64 @@ def calculate_gaussian_integral_windows(img) -> cuda.devicearray:
     ''' 
     #memoization?
         
-    threadsperblock = (maxthreadsperblock2d, maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
+    threadsperblock = (laser_detection.maxthreadsperblock2d, laser_detection.maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
     blockspergrid_x = int(math.ceil(img.shape[0] / threadsperblock[0]))
     blockspergrid_y = int(math.ceil(img.shape[1] / threadsperblock[1]))
     blockspergrid = (blockspergrid_x, blockspergrid_y)
 
     d_img = cuda.to_device(img)
-    output_global_mem = cuda.device_array(img.shape)
+    # zeroed, the last WINLEN rows hold no window like in the other gval implementations
+    output_global_mem = cuda.to_device(np.zeros(img.shape))
     gpu_gvals[blockspergrid, threadsperblock](d_img, output_global_mem)
 
     return output_global_mem
 
 @cuda.jit
-def find_subpixel(gvals, ln_reward, reward_img, minval, offset_from_winstart_to_center, output, centerpx):
-    row, col = cuda.grid(2)
-    # center of window
-    center = row + offset_from_winstart_to_center
-    if not (0 < row < ln_reward.shape[0]-1 and 0 < col < ln_reward.shape[1]-1) or gvals[row,col] < minval: 
+def find_subpixel(gvals, reward_img, minval, offset_from_winstart_to_center, output):
+    '''CUDA kernel finding the subpixels of the windows of one image row reaching minval, like
+    subpx.find_subpixel. A thread walks its row's windows in increasing column order, so the last
+    one landing on a pixel wins like in subpx.find_gval_subpixels.'''
+    y = cuda.grid(1)
+    rows, cols = reward_img.shape
+    winstart = y - offset_from_winstart_to_center
+    if y < 2 or y >= rows-2 or winstart < 0 or winstart >= gvals.shape[0] - WINLEN:
         return
-    else:    
-        if gvals[row, col] >= 2048 and gvals[row, col-1] >= 2048 and gvals[row, col+1] >= 2048 and centerpx[0] == 0:
-            centerpx[0] = row
-            centerpx[1] = col
-
-        # TODO if abs(offset) >= 1, move the pixel the offset is relative to 
-        # correspondingly subtracting the offset until the abs(offset) < 1. If 
-        # new pixel comes along that lands in there that has to travel less from its offset, 
-        # use the new pixel instead
-
-        # ln(f(x)), ln(f(x-1)), ln(f(x+1))
-        lnfx = ln_reward[center, col]
-        lnfxm = ln_reward[center-1, col]
-        lnfxp = ln_reward[center+1, col]
-        denom = lnfxm - 2 * lnfx + lnfxp
+    for x in range(2, cols-2):
+        if gvals[winstart, x] < minval:
+            continue
+        # f(x), f(x-1), f(x+1)
+        fx = reward_img[y,x]
+        fxm = reward_img[y,x-1]
+        fxp = reward_img[y,x+1]
+        denom = math.log(fxm) - 2 * math.log(fx) + math.log(fxp)
         if denom == 0:
-            # # 5px Center of Mass (CoM5) detector
-            fx = reward_img[center, col] # f(x)
-            fxp = reward_img[center+1, col] # f(x+1)
-            fxm = reward_img[center-1, col] # f(x-1)
-            fxp2 = reward_img[center+2, col] # f(x+2)
-            fxm2 = reward_img[center-2, col] # f(x-2)
+            # 5px Center of Mass (CoM5) detector
+            fxp2 = reward_img[y,x+2] # f(x+2)
+            fxm2 = reward_img[y,x-2] # f(x-2)
             num = 2*fxp2 + fxp - fxm - 2*fxm2
             denom = fxm2 + fxm + fx + fxp + fxp2
             subpixel_offset = num / denom
-            subpixel_offset = -1
         else:
-            numer = lnfxm - lnfxp
+            numer = math.log(fxm) - math.log(fxp)
             subpixel_offset = 0.5 * numer / denom
-        output[center, col] = subpixel_offset
+        if not (0 <= x + subpixel_offset < cols):
+            continue
+        output[y,int(x+subpixel_offset)] = (subpixel_offset % 1) + 1e-5
 
+@Backends.register("subpx", "cuda", priority=2, available=lambda: not laser_detection.CUDASIM, device=True)
 @timeitstep(LaserDetectorStep.SUBPX)
 def find_gval_subpixels_gpu(gvals: cuda.devicearray, reward_img: np.ndarray, min_gval=DEFAULT_GVAL_MIN_VAL):
+    '''subpx.find_gval_subpixels_image on the GPU, one thread per image row'''
     if gvals.shape != reward_img.shape: raise Exception("gval array should be same size as reward_img (gval.shape != reward_img.shape)")
     offset_from_winstart_to_center = WINLEN // 2
 
-    threadsperblock = (maxthreadsperblock2d, maxthreadsperblock2d)# (32,32) # thread dims multiplied must not exceed max threads per block
-    blockspergrid_x = int(math.ceil(gvals.shape[0] / threadsperblock[0]))
-    blockspergrid_y = int(math.ceil(gvals.shape[1] / threadsperblock[1]))
-    blockspergrid = (blockspergrid_x, blockspergrid_y)
+    threadsperblock = laser_detection.maxthreadsperblock2d
+    blockspergrid = int(math.ceil(gvals.shape[0] / threadsperblock))
 
-    with np.errstate(divide='ignore'):
-            d_reward_img = cupy.array(reward_img)
-            d_ln_reward = cupy.log(d_reward_img)
-            d_ln_reward[d_ln_reward == cupy.nan] = 0
-            d_ln_reward[abs(d_ln_reward) == cupy.inf] = 0
-    output_global_mem = cuda.to_device(np.zeros(gvals.shape))#cuda.device_array(gvals.shape)
-    centerpx_global_mem = cuda.to_device(np.zeros(2, dtype=int))
-    find_subpixel[blockspergrid, threadsperblock](gvals, d_ln_reward, d_reward_img, min_gval, offset_from_winstart_to_center, output_global_mem, centerpx_global_mem)
+    output_global_mem = cuda.to_device(np.zeros(gvals.shape))
+    find_subpixel[blockspergrid, threadsperblock](gvals, reward_img, float(min_gval), offset_from_winstart_to_center, output_global_mem)
     output = output_global_mem.copy_to_host()
-    centerpx = centerpx_global_mem.copy_to_host()
+    centerpx = subpx.center_pixel(to_host(gvals))
 
     return output, centerpx
 
@@ -216,168 +206,143 @@ def find_gval_subpixels(gvals, reward_img):
             subpixel_offsets[center, col] = subpixel_offset
     return subpixel_offsets
 
-@cuda.jit
-def gpu_patch(img, minval, out):
-    outrow, outcol = cuda.grid(2) 
-    row, col = outrow * 7, outcol * 7
-    pxs = 0
-    out[outrow, outcol, 0] = 0
-    out[outrow, outcol, 1] = 0 # top
-    out[outrow, outcol, 2] = 0 # bottom
-    out[outrow, outcol, 3] = 0 # left
-    out[outrow, outcol, 4] = 0 # right
-    for i in range(-3,4): # [-3, -2, -1, 0, 2, 3]
-        searchingrow = row + i
-        for j in range(-3,4):
-            searchingcol = col + j
-            if abs(img[searchingrow, searchingcol]) > minval:
-                if i < 0: # top
-                    out[outrow, outcol, 1] = max(abs(i), out[outrow, outcol, 1])
-                else: # bottom
-                    out[outrow, outcol, 2] = max(abs(i), out[outrow, outcol, 2])
-                if j < 0: # left
-                    out[outrow, outcol, 3] = max(abs(j), out[outrow, outcol, 3])
-                else: # right
-                    out[outrow, outcol, 4] = max(abs(j), out[outrow, outcol, 4])
-                pxs += 1
-    out[outrow, outcol, 0] = pxs                        
-
-@timeitstep(LaserDetectorStep.FILTER)
-def throw_out_small_patches_gpu(subpixel_offsets):
-    threadsperblock = (maxthreadsperblock2d // 2, maxthreadsperblock2d // 2)# (16,16) # thread dims multiplied must not exceed max threads per block
-    # we want each thread to have a 7x7 area to go over. we don't have 
-    # to worry about going all the way to the edge since there won't be 
-    # laser points there anyways and we are only throwing out max 6 rows and columns
-    blockspergrid_x = int(subpixel_offsets.shape[0] / 7 / threadsperblock[0])
-    blockspergrid_y = int(subpixel_offsets.shape[1] / 7 / threadsperblock[1])
-    blockspergrid = (blockspergrid_x, blockspergrid_y)
-
-    d_arr = cuda.to_device(subpixel_offsets)
-    output_global_mem = cuda.device_array((blockspergrid[0] * threadsperblock[0], blockspergrid[1] * threadsperblock[1], 5), dtype=np.float64)
-    gpu_patch[blockspergrid, threadsperblock](d_arr, sys.float_info.min, output_global_mem)
-    # return output_global_mem
-    output = output_global_mem.copy_to_host()
-
-    # TODO figure out why seemingly good patches are being thrown out
-
-    # merge
-    goodblockpatches = []
-    badblockpatches = []
-    for i in range(1,output.shape[0]-1):
-        for j in range(1,output.shape[1]-1):
-            # num pxs in this patch, range to connect to other patch px on top, bottom, left, and right
-            pxs, top, bottom, left, right = output[i, j]
-            # use similar algo to normal throw out small patches here
-            if pxs == 0: continue
-
-            patch = []
-            patchpxs = output[i,j,0]
-            output[i,j,0] = 0
-            toexplore = [(i,j)]
-
-            canexplore = lambda i_x, j_x : 0 <= i_x < output.shape[0] and 0 <= j_x < output.shape[1] and output[i_x,j_x,0] > 0
-
-            while toexplore:
-                block = toexplore.pop(0)
-                patch.append(block)
-                explorerow, explorecol = block
-                exploretop = output[explorerow, explorecol, 1]
-                explorebottom = output[explorerow, explorecol, 2]
-                exploreleft = output[explorerow, explorecol, 3]
-                exploreright = output[explorerow, explorecol, 4]
-                
-                # top
-                row_neighbor, col_neighbor = explorerow-1, explorecol
-                if canexplore(row_neighbor, col_neighbor) and exploretop + output[row_neighbor, col_neighbor, 2] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # bottom
-                row_neighbor, col_neighbor = explorerow+1, explorecol
-                if canexplore(row_neighbor, col_neighbor) and explorebottom + output[row_neighbor, col_neighbor, 1] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # left
-                row_neighbor, col_neighbor = explorerow, explorecol-1
-                if canexplore(row_neighbor, col_neighbor) and exploreleft + output[row_neighbor, col_neighbor, 4] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-                
-                # right
-                row_neighbor, col_neighbor = explorerow, explorecol+1
-                if canexplore(row_neighbor, col_neighbor) and exploreright + output[row_neighbor, col_neighbor, 3] >= 3:
-                    patchpxs += output[row_neighbor, col_neighbor, 0]
-                    output[row_neighbor, col_neighbor] = 0
-                    toexplore.append((row_neighbor, col_neighbor))
-
-            if patchpxs < 5: badblockpatches.append(patch)
-            else: goodblockpatches.append(patch)
-    
-    filteredoffsets = subpixel_offsets.copy()
-    for blockpatch in badblockpatches:
-        for block in blockpatch:
-            blockrow, blockcol = block[0] * 7, block[1] * 7
-            for i in range(-3,4):
-                for j in range(-3,4):
-                    row, col = blockrow + i, blockcol + j
-                    filteredoffsets[row,col] = 0
-    goodpatches = []
-    for blockpatch in goodblockpatches:
-        patch = []
-        for block in blockpatch:
-            blockrow, blockcol = block[0] * 7, block[1] * 7
-            for i in range(-3,4):
-                for j in range(-3,4):
-                    row, col = blockrow + i, blockcol + j
-                    if(subpixel_offsets[row,col] > 0): patch.append((row,col,subpixel_offsets[row,col]))
-        goodpatches.append(patch)
-
-    return filteredoffsets, goodpatches
-
-@timeitstep(LaserDetectorStep.FILTER)
-def throw_out_small_patches(gval_subpixels):
-    laser_patch_img = np.copy(gval_subpixels)
-    patches = []
-    if DEBUG_MODE:
-        patch_lengths = []
-        patches_explored = 0
-    # find patches
-    for row in range(gval_subpixels.shape[0]):
-        for col in range(gval_subpixels.shape[1]):
-            val = laser_patch_img[row,col]
-            if abs(val) > sys.float_info.min: # found laser px, look for patch
-                if DEBUG_MODE: patches_explored += 1
-
-                patch = []
-                toexplore = [(row,col)]
-
-                while toexplore:
-                    px = toexplore.pop(0)
-                    patch.append(px)
-                    explorerow, explorecol = px
-                    laser_patch_img[explorerow, explorecol] = 0
-                    for i in range(-3,4): # [-3, -2, -1, 0, 2, 3]
-                        searchingrow = row + i
-                        for j in range(-3,4):
-                            searchingcol = col + j
-                            if searchingrow > 0 and searchingrow <= laser_patch_img.shape[0] and searchingcol > 0 and searchingcol <= laser_patch_img.shape[1]:   
-                                if abs(laser_patch_img[searchingrow, searchingcol]) > 1e-6:
-                                    toexplore.append((searchingrow, searchingcol))
-                if len(patch) >= 5:
-                    patches.append(patch)
-
-    if DEBUG_MODE: print(f"{patches_explored} patches explored, {len(patches)} patches found, avg patch size {np.average(patch_lengths)}")
-    for patch in patches:
-        for val in patch:
-            row, col = val
-            laser_patch_img[row, col] = gval_subpixels[row, col]
-    return laser_patch_img            
+def patch_row_edges(patches, mingap=10, maxgap=100):
+    '''
+    Builds the sparse patch neighbor graph used by the maximum spanning tree segmentation. Patch b 
+    neighbors patch a on a row if the next laser point right of a point of a on that row belongs to 
+    b and is more than mingap but less than maxgap px away. All points are sorted once by row and 
+    column, so the neighbors on every row come out of a single sweep.
 
+    :return: (left, right, weights) arrays, one entry per edge going rightward from patch left to 
+        patch right, weighted by the number of rows the two patches neighbor each other on.
+    '''
+    order = np.lexsort((patches.cols, patches.rows))
+    rows, cols, ids = patches.rows[order], patches.cols[order], patches.patch_ids()[order]
+    gaps = cols[1:] - cols[:-1]
+    adjacent = (rows[1:] == rows[:-1]) & (gaps > mingap) & (gaps < maxgap)
+    left, right, sharedrows = ids[:-1][adjacent], ids[1:][adjacent], rows[1:][adjacent]
+    # edges go rightward, to the patch that starts further right
+    rightward = patches.mincols[right] > patches.mincols[left]
+    left, right, sharedrows = left[rightward], right[rightward], sharedrows[rightward]
+    # count each row once per patch pair
+    triples = np.unique(np.stack((left, right, sharedrows), axis=1), axis=0)
+    pairs, weights = np.unique(triples[:, :2], axis=0, return_counts=True)
+    return pairs[:,0], pairs[:,1], weights
+
+@njit(cache=True)
+def maximum_spanning_forest(numnodes, left, right):
+    '''Kruskal's algorithm over edges already sorted by decreasing weight. Returns a mask of the 
+    edges that are part of the maximum spanning forest.'''
+    parent = np.arange(numnodes).astype(np.int32)
+    intree = np.zeros(left.shape[0], dtype=np.bool_)
+    for e in range(left.shape[0]):
+        a = find_root(parent, left[e])
+        b = find_root(parent, right[e])
+        if a != b:
+            union(parent, a, b)
+            intree[e] = True
+    return intree
+
+def index_forest(numnodes, left, right, root):
+    '''
+    Walks each tree of a forest breadth first, starting with the tree of root, from its lowest
+    numbered node otherwise. The index of a node is that of its parent plus one if the edge goes
+    rightward from the parent and minus one if it goes leftward.
 
+    :return: (components, relidx) arrays, the tree number of every node in the order trees were
+        walked and the index of every node relative to the first node walked in its tree
+    '''
+    neighbors = [[] for _ in range(numnodes)]
+    for l, r in zip(left.tolist(), right.tolist()):
+        neighbors[l].append((r, 1))
+        neighbors[r].append((l, -1))
+    components = np.full(numnodes, -1, dtype=int)
+    relidx = np.zeros(numnodes, dtype=int)
+    numcomponents = 0
+    for start in [root] + list(range(numnodes)):
+        if components[start] != -1:
+            continue
+        components[start] = numcomponents
+        toexplore = deque([start])
+        while toexplore:
+            node = toexplore.popleft()
+            for child, step in neighbors[node]:
+                if components[child] == -1:
+                    components[child] = numcomponents
+                    relidx[child] = relidx[node] + step
+                    toexplore.append(child)
+        numcomponents += 1
+    return components, relidx
+
+def place_components(patches, components, relidx, rootline, mingap=10):
+    '''
+    Line index of every patch from the tree walks of index_forest. Tree 0 is placed with its first
+    patch on rootline. The other trees are placed, largest first among those next to a placed tree,
+    where most of their patches land one line right of the indexed patch before them on a row, or
+    one line left of the indexed patch after them. Points on a row are neighbors if no laser point
+    lies between them and they are more than mingap px apart, at any distance. Trees sharing no row
+    with indexed patches take the line whose indexed points have the nearest mean column. Indices
+    are clamped to the laser lines.
+    '''
+    numcomponents = components.max() + 1
+    offsets = np.zeros(numcomponents, dtype=int)
+    offsets[0] = rootline
+    placed = np.zeros(numcomponents, dtype=bool)
+    placed[0] = True
+
+    # neighboring points on a row between different trees, grouped by tree: a vote of tree c for
+    # its first patch's line is the other patch's line plus step minus the patch's relative index
+    order = np.lexsort((patches.cols, patches.rows))
+    rows, cols, ids = patches.rows[order], patches.cols[order], patches.patch_ids()[order]
+    adjacent = (rows[1:] == rows[:-1]) & (cols[1:] - cols[:-1] > mingap)
+    left, right = ids[:-1][adjacent], ids[1:][adjacent]
+    between = components[left] != components[right]
+    left, right = left[between], right[between]
+    voter = np.concatenate((right, left)) # patch of the tree being placed
+    other = np.concatenate((left, right)) # patch whose line it votes from
+    steps = np.concatenate((np.ones(left.shape[0], dtype=int), -np.ones(left.shape[0], dtype=int)))
+    byvoter = np.argsort(components[voter], kind="stable")
+    voter, other, steps = voter[byvoter], other[byvoter], steps[byvoter]
+    vote_ptr = np.concatenate(([0], np.cumsum(np.bincount(components[voter], minlength=numcomponents))))
+
+    sizes = np.bincount(components[patches.patch_ids()], minlength=numcomponents)
+    rank = np.empty(numcomponents, dtype=int)
+    rank[np.argsort(-sizes, kind="stable")] = np.arange(numcomponents)
+
+    def neighbors(component):
+        votes = slice(vote_ptr[component], vote_ptr[component + 1])
+        return np.unique(components[other[votes]])
+
+    # trees next to a placed tree, by decreasing size
+    worklist = [(rank[c], c) for c in neighbors(0).tolist()]
+    heapq.heapify(worklist)
+    while worklist:
+        _, component = heapq.heappop(worklist)
+        if placed[component]:
+            continue
+        votes = slice(vote_ptr[component], vote_ptr[component + 1])
+        fromplaced = placed[components[other[votes]]]
+        votepatches, voteothers = voter[votes][fromplaced], other[votes][fromplaced]
+        otherlines = np.clip(offsets[components[voteothers]] + relidx[voteothers], 0, NUM_LASER_LINES - 1)
+        candidates, counts = np.unique(otherlines + steps[votes][fromplaced] - relidx[votepatches], return_counts=True)
+        offsets[component] = candidates[np.argmax(counts)]
+        placed[component] = True
+        for neighbor in neighbors(component).tolist():
+            if not placed[neighbor]:
+                heapq.heappush(worklist, (rank[neighbor], neighbor))
+
+    patchlines = np.where(placed[components], np.clip(offsets[components] + relidx, 0, NUM_LASER_LINES - 1), -1)
+    if not placed.all():
+        pointlines = patches.point_lines(patchlines)
+        pointcomponents = components[patches.patch_ids()]
+        indexed = np.unique(pointlines[pointlines != -1])
+        linecols = np.array([patches.cols[pointlines == line].mean() for line in indexed])
+        meancols = np.bincount(pointcomponents, weights=patches.cols, minlength=numcomponents) / np.maximum(sizes, 1)
+        pending = np.flatnonzero(~placed)
+        # the tree's first patch lands on the nearest line
+        offsets[pending] = indexed[np.argmin(np.abs(linecols[None] - meancols[pending, None]), axis=1)]
+        patchlines = np.clip(offsets[components] + relidx, 0, NUM_LASER_LINES - 1)
+    return patchlines
 
 SEGMENT_HOUGH_LINES_P = 0
 SEGMENT_HOUGH_LINES = 1
@@ -385,7 +350,7 @@ SEGMENT_MAX_SPAN_TREE = 2
 @timeitstep(LaserDetectorStep.SEGMENT)
 def segment_laser_lines(img, segment_mode, patches=None, centerdot=None):
     if segment_mode == SEGMENT_HOUGH_LINES_P:
-        lines = cv.HoughLinesP(laserpxbinary, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=5)
+        lines = cv.HoughLinesP(img, 1, np.pi / 180, threshold=100, minLineLength=100, maxLineGap=5)
         print(lines)
         if lines is not None: lines = np.reshape(lines, (lines.shape[0], lines.shape[2]))
         return lines
@@ -428,248 +393,292 @@ def segment_laser_lines(img, segment_mode, patches=None, centerdot=None):
         # index 13). The node belonging to that dot is labelled as k = 13 and the indexing occurs
         # traversing the graph forwards and backwards.
 
-        # create pixel groups
         numpatches = len(patches)
-        graph = np.full((numpatches, numpatches), -sys.maxsize, dtype=int)
-        dirgraph = np.full((numpatches, numpatches), False, dtype=bool)
-        
-        leftwardgraph = {}
-        rightwardgraph = {}
-        origins = set()
-        edges: list = []
-        patchmembers = [{"rows": set(), "cols": set(), "mincol": 99999999} for _ in range(len(patches))]
-        centerpatch = -1
-        for i, patch in enumerate(patches):
-            for px in patch:
-                if px[0] == centerpx[0] and px[1] == centerpx[1]:
-                    centerpatch = i
-                patchmembers[i]["rows"].add(px[0])
-                patchmembers[i]["cols"].add(px[1])
-                patchmembers[i]["mincol"] = min(patchmembers[i]["mincol"], px[1])
-                leftwardgraph[i] = set()
-                rightwardgraph[i] = set()
-                origins.add(i)
-
-        for i, patch in enumerate(patches):
-            for j, otherpatch in enumerate(patches):
-                # print(patchmembers[j]["mincol"], patchmembers[i]["mincol"])
-                if patchmembers[j]["mincol"] > patchmembers[i]["mincol"]:
-                    # print("candidate")
-                    sharedrows = set()
-                    for px in patch:
-                        if px[0] not in patchmembers[j]["rows"] or px[0] in sharedrows: continue
-                        r, c, _ = px
-                        nextpatch = c + 1
-                        while c < img.shape[1] and nextpatch - c < 100: 
-                            if img[r,nextpatch] == 0:
-                                nextpatch += 1
-                            else:
-                                if nextpatch - c > 10 and nextpatch in patchmembers[j]["cols"]:
-                                    # print(nextpatch - c)
-                                    sharedrows.add(r)
-                                break
-                    num_rows_shared = len(sharedrows)             
-                    if num_rows_shared > 0:
-                        # add edge of weight num_rows_shared from i to j
-                        graph[i,j] = num_rows_shared
-                        dirgraph[i,j] = True # true indicates rightward path
-                        graph[j,i] = num_rows_shared
-                        dirgraph[j,i] = False # false indicates leftward path
-                        leftwardgraph[j].add(i) 
-                        rightwardgraph[i].add(j) 
-                        edges.append((i, j, num_rows_shared)) # left, right, weight
-                        if j in origins: origins.remove(j) # we found an edge that goes to this patch, so its not a source node
-
-        def findMaxVertex(visited, weights):
-   
-            # Stores the index of max-weight vertex
-            # from set of unvisited vertices
-            index = -1;
-        
-            # Stores the maximum weight from
-            # the set of unvisited vertices
-            maxW = -sys.maxsize;
-        
-            # Iterate over all possible
-            # Nodes of a graph
-            for i in range(numpatches):
-        
-                # If the current Node is unvisited
-                # and weight of current vertex is
-                # greater than maxW
-                if (visited[i] == False and weights[i] > maxW):
-                
-                    # Update maxW
-                    maxW = weights[i];
-        
-                    # Update index
-                    index = i;
-            return index;
-    
-        # Utility function to find the maximum
-        # spanning tree of graph
-        def printMaximumSpanningTree(graph, parent):
-        
-            # Stores total weight of
-            # maximum spanning tree
-            # of a graph
-            MST = 0;
-        
-            # Iterate over all possible Nodes
-            # of a graph
-            for i in range(1, numpatches):
-            
-                # Update MST
-                MST += graph[i][parent[i]] if graph[i][parent[i]] > 0 else 0;
-        
-            print("Weight of the maximum Spanning-tree ", MST);
-            print();
-            print("Edges    Weight");
-        
-            # Print Edges and weight of
-            # maximum spanning tree of a graph
-            for i in range(1, numpatches):
-                print(f"{parent[i]:02} - {i:02}    {graph[i][parent[i]]:02}");
-        
-        # Function to find the maximum spanning tree
-        def maximumSpanningTree(graph):
-            # visited[i]:Check if vertex i
-            # is visited or not
-            # initialize visited of a Node as False
-            visited = np.full(numpatches, False, dtype=bool)
-
-            # parent[i]: Stores the parent Node
-            # of vertex i
-            parent = np.full(numpatches, centerpatch, dtype=int)
-            
-            # weights[i]: Stores maximum weight of
-            # graph to connect an edge with i
-            # Initialize weights as -INFINITE,
-            weights = np.full(numpatches, -sys.maxsize, dtype=int)
-        
-            # Include 1st vertex in
-            # maximum spanning tree
-            weights[centerpatch] = sys.maxsize;
-            parent[centerpatch] = -1;
-        
-            # Search for other (V-1) vertices
-            # and build a tree
-            for i in range(numpatches - 1):
-        
-                # Stores index of max-weight vertex
-                # from a set of unvisited vertex
-                maxVertexIndex = findMaxVertex(visited, weights);
-        
-                # Mark that vertex as visited
-                visited[maxVertexIndex] = True;
-        
-                # Update adjacent vertices of
-                # the current visited vertex
-                for j in range(numpatches):
-        
-                    # If there is an edge between j
-                    # and current visited vertex and
-                    # also j is unvisited vertex
-                    if (graph[j][maxVertexIndex] != 0 and visited[j] == False):
-        
-                        # If graph[v][x] is
-                        # greater than weight[v]
-                        if (graph[j][maxVertexIndex] > weights[j]):
-                        
-                            # Update weights[j]
-                            weights[j] = graph[j][maxVertexIndex];
-        
-                            # Update parent[j]
-                            parent[j] = maxVertexIndex;
-        
-            # Print maximum spanning tree
-            printMaximumSpanningTree(graph, parent);
-            linegroups = [[0,[]] for _ in range(NUM_LASER_LINES)]
-
-            path = [[] for _ in range(numpatches)]
-            for i in range(numpatches):
-                if graph[i][parent[i]] > 0:
-                   path[parent[i]].append(i)
-
-            toexplore = [(centerpatch, NUM_LASER_LINES // 2)]
-            while toexplore:
-                patchidx, linegroupidx = toexplore.pop(0)
-                print(linegroupidx)
-                linegroupidx = min(max(0,linegroupidx), 14)
-                linegroups[linegroupidx][1].append(patches[patchidx])
-                linegroups[linegroupidx][0] += len(patches[patchidx])
-                for child in path[patchidx]:
-                    toexplore.append((child, linegroupidx + 1 if dirgraph[patchidx,child] else linegroupidx - 1))
-            return linegroups
-        
-        return maximumSpanningTree(graph)
-
+        patchlines = np.full(numpatches, -1, dtype=int)
+        if numpatches == 0:
+            return patchlines
+        # without a center dot, start from the largest patch
+        centerpatch = int(np.argmax(patches.sizes))
+        centerpts = np.flatnonzero((patches.rows == centerdot[0]) & (patches.cols == centerdot[1]))
+        if centerpts.shape[0] > 0:
+            centerpatch = patches.patch_ids()[centerpts[-1]]
+
+        # sparse graph of horizontally neighboring patches, reduced to a maximum spanning forest
+        with Tracer.span("segment.graph"):
+            left, right, weights = patch_row_edges(patches)
+        with Tracer.span("segment.mst"):
+            order = np.argsort(-weights, kind="stable")
+            intree = maximum_spanning_forest(numpatches, left[order], right[order])
+            left, right = left[order][intree], right[order][intree]
+
+        # walk every tree, the line index increasing on rightward edges, then place the trees not
+        # holding the center patch next to the lines already indexed
+        with Tracer.span("segment.index"):
+            components, relidx = index_forest(numpatches, left, right, centerpatch)
+            patchlines = place_components(patches, components, relidx, NUM_LASER_LINES // 2)
+        return patchlines
+
+@Backends.register("segment", "mst")
+def segment_max_span_tree(laserpxbinary, patches, centerpx):
+    return segment_laser_lines(laserpxbinary, SEGMENT_MAX_SPAN_TREE, patches=patches, centerdot=centerpx)
 
 @timeitstep(LaserDetectorStep.ASSOC)
 def imagept_laserplane_assoc(patches, polarlines):
     '''
     Associates each laser points in the image with one of the provided laser planes or throws it out.
 
-    :param img: MxN binary cv.Mat image or otherwise compatible arraylike
-    :param planes: (list[tuple(float,float,float)]) Planes of light projecting from a laser equiped with a diffractive optical element (DOE) described by their normal vectors in the camera reference frame.
+    :param patches: (PatchSet) laser patches found in the image
+    :param polarlines: (list[tuple(float,float)]) Lines as (r, theta), ordered like the laser planes they belong to.
+        Patches are scored by the distance of their centroid to each line.
 
-    :return: (list[list[tuple(float,float,float)]]) Image points organized plane, with the index of the plane in the planes array corresponding to the index of its member points in the returned array.
+    :return: (np.ndarray) Line index of each patch, or -1 for patches too far from every line.
     '''
-    # associate each laser patch with a line
-        # for more accuracy could calculate each patch's centroid or calculate an average distance from line of all points of a patch
-        # for speed could just pick one point from patch, will likely be enough given circumstances
-        # we throw out patches too far from any lines
-    maxdistfromline = 50 # px
-    patchgroups = [[0, []] for _ in range(NUM_LASER_LINES)]
-    for patch in patches:
-        y, x, subpixel_offset_x = patch[0] # get point in patch
-        x += subpixel_offset_x # add subpixel offset to x
-        r_p = math.sqrt(x**2 + y**2) # get radius from origin to pt
-        th_p = math.atan2(y, x) # get theta from +x axis to pt
-        bestline = 0 # idx of best line
-        minval = float('inf') # distance from point to best line
-        for idx, line in enumerate(polarlines):
-            r, th = polarlines[idx] # r, th for cur line
-            d = abs(r - r_p * math.cos(th - th_p)) # distance from pt to cur line
-            if d < minval: # if found shorter distance
-                minval = d
-                bestline = idx
-        if minval < maxdistfromline:
-            patchgroups[bestline][1].append(patch)
-            patchgroups[bestline][0] += len(patch)
-    return patchgroups
+    return Backends.get("assoc")(patches, polarlines)
 
 @timeitstep(LaserDetectorStep.PCL)
-def extract_laser_points(planes_normal_form, patchgroups, px_coord_offset=(0,0)) -> list[np.ndarray]:
+def extract_laser_points(planes_normal_form, patches, patchlines, px_coord_offset=(0,0), out=None, raytable=None, shape=None) -> tuple[np.ndarray, np.ndarray]:
     '''
-    Finds 3D coordinates of laser points in an image
-
-    img - OpenCV Mat or otherwise compatible arraylike
+    Finds 3D coordinates of laser points in an image. All points of all lines are triangulated at 
+    once with px_2_3d_many.
+
+    patches - PatchSet of laser patches in the image
+    patchlines - line index of each patch, -1 for patches not on a line
+    out - optional float32 buffer of at least (N, 3) to write the points into
+    raytable - optional RayTable of the full image to look camera rays up in instead of computing them from P
+    planes_normal_form may be a LaserPlanes, in which case it is mapped to 3D by the "3d" backend chosen 
+    for frames of the given shape unless a raytable is given
+
+    returns (points, pointlines): (N, 3) float32 points grouped by line in increasing line order 
+    and the line index of each point
+    '''
+    rows, cols, pointlines = laser_point_coords(patches, patchlines, len(planes_normal_form), px_coord_offset)
+    numpts = pointlines.shape[0]
+    if out is None or out.shape[0] < numpts:
+        out = np.empty((numpts, 3), dtype=np.float32)
+    pts = out[:numpts]
+    if isinstance(planes_normal_form, LaserPlanes):
+        if raytable is None:
+            Backends.get("3d", shape)(planes_normal_form, rows, cols, pointlines, pts)
+            return pts, pointlines
+        planes_normal_form = planes_normal_form.planes
+    planes = np.asarray(planes_normal_form)[pointlines]
+    if raytable is not None:
+        raytable.px_2_3d_many(rows, cols, planes, out=pts)
+    else:
+        px_2_3d_many(rows, cols, planes, ZedMini.LeftRectHD2K.P, out=pts)
+    return pts, pointlines
+
+def laser_point_coords(patches, patchlines, numlines, px_coord_offset=(0,0)):
+    '''Image rows, subpixel columns and line indices of the points of the patches on a line, grouped 
+    by line in increasing line order'''
+    pointlines = patches.point_lines(patchlines)
+    ptidxs = np.concatenate(line_groups(pointlines, numlines))
+    rows = patches.rows[ptidxs] + px_coord_offset[0]
+    cols = patches.cols[ptidxs] + px_coord_offset[1] + patches.offsets[ptidxs]
+    return rows, cols, pointlines[ptidxs]
+
+class LaserPipeline:
+    '''
+    Streaming laser detection pipeline. Frames flow through bounded queues between three workers:
+    decode (load image and crop ROI), detect (reward, G values, subpixels, patch filtering) and 
+    extract (segmentation and 3D point extraction), so frame N+1 is being detected while frame N 
+    is segmented and throughput approaches that of the slowest stage.
+
+    Each frame is a dict that every stage adds its results to. Frames are yielded by results() in 
+    submission order. If a stage raises, the exception is stored under "error" and later stages 
+    pass the frame through untouched.
     '''
-    
-    linepts = []
-    for idx, patchgroup in enumerate(patchgroups):
-        # c_x, c_y, f_x, f_y = ZedMini.LeftRectHD2K.P[0,2], ZedMini.LeftRectHD2K.P[1,2], ZedMini.LeftRectHD2K.P[0,0], ZedMini.LeftRectHD2K.P[1,1]
-        # a, b, c, d = planes_normal_form[idx] # the planes will be always be ordered by distance from origin
-        numpts, patches = patchgroup
-        ptarr = np.empty((numpts,3))
-        ptarridx = 0
-        for patch in patches:
-            for px in patch:
-                row, col, coloffset = px
-                ptarr[ptarridx, :] = px_2_3d(
-                    row + px_coord_offset[0],
-                    col + px_coord_offset[1] + coloffset, 
-                    planes_normal_form[idx], 
-                    ZedMini.LeftRectHD2K.P)
-                ptarridx += 1
-        linepts.append(ptarr)
-    return linepts
+
+    STAGES = ("decode", "detect", "extract")
+    _STOP = None # sentinel marking the end of the stream
+
+    def __init__(self, planes, roi=DEFAULT_ROI, queue_size=2, segment_mode=SEGMENT_MAX_SPAN_TREE, keep_intermediates=False, use_raytable=False, camera=ZedMini.LeftRectHD2K):
+        '''
+        :param planes: LaserPlanes or laser planes as (A,B,C,D), ordered like the segmented line groups
+        :param roi: region of interest as ((top%, left%), (bottom%, right%))
+        :param queue_size: max number of frames waiting in front of each stage
+        :param keep_intermediates: keep reward/gval/subpixel images in each frame for display
+        :param use_raytable: look camera rays up in a cached per-pixel RayTable during 3D extraction
+        :param camera: camera the frames come from. If it has distortion parameters D, frames are taken 
+            to be raw and laser points are undistorted through an undistorting RayTable.
+        '''
+        self.planes = planes
+        self.roi = roi
+        self.segment_mode = segment_mode
+        self.keep_intermediates = keep_intermediates
+        self.camera = camera
+        self.use_raytable = use_raytable or len(camera.D) > 0
+        # queues[stage] holds frames waiting for that stage, "output" holds finished frames
+        self.queues = {stage: Queue(maxsize=queue_size) for stage in self.STAGES}
+        self.queues["output"] = Queue(maxsize=queue_size)
+        self.timers = {stage: PerfTimer() for stage in self.STAGES}
+        self._stage_funcs = {"decode": self._decode, "detect": self._detect, "extract": self._extract}
+        self._workers = []
+        self._submitted = 0
+
+    def start(self):
+        '''Starts one worker thread per stage, after launching Numba's thread pool on the calling thread.'''
+        laser_detection.start_numba_threads()
+        outputs = self.STAGES[1:] + ("output",)
+        for stage, output in zip(self.STAGES, outputs):
+            worker = threading.Thread(target=self._work, args=(stage, output), name=f"LaserPipeline-{stage}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def submit(self, path):
+        '''Queues an image file for processing, blocking while the decode queue is full.'''
+        self.queues["decode"].put({"idx": self._submitted, "filename": os.path.basename(path), "path": path})
+        self._submitted += 1
+
+    def close(self):
+        '''Signals that no more frames will be submitted. Workers exit once the queues drain.'''
+        self.queues["decode"].put(self._STOP)
+
+    def results(self):
+        '''Yields finished frames until the pipeline is closed and drained.'''
+        while True:
+            frame = self.queues["output"].get()
+            if frame is self._STOP:
+                break
+            yield frame
+        for worker in self._workers:
+            worker.join()
+
+    def run(self, paths):
+        '''Starts the pipeline, feeds it the given image paths from a background thread, and yields finished frames.'''
+        self.start()
+        def feed():
+            for path in paths:
+                self.submit(path)
+            self.close()
+        threading.Thread(target=feed, name="LaserPipeline-feed", daemon=True).start()
+        yield from self.results()
+
+    def queue_depths(self) -> dict:
+        '''Number of frames currently waiting in front of each stage (and in the output queue). 
+        The stage with a full queue in front of it and an empty one behind it is the bottleneck.'''
+        return {name: q.qsize() for name, q in self.queues.items()}
+
+    def stage_times(self) -> dict:
+        '''Average time in seconds each stage spends per frame.'''
+        return {stage: timer.get_avg_runtime() for stage, timer in self.timers.items()}
+
+    def _work(self, stage, output):
+        inq, outq = self.queues[stage], self.queues[output]
+        func, timer = self._stage_funcs[stage], self.timers[stage]
+        while True:
+            frame = inq.get()
+            if frame is self._STOP:
+                outq.put(frame)
+                break
+            if "error" not in frame:
+                Tracer.set_frame(frame["idx"])
+                timer.start()
+                try:
+                    with Tracer.span(stage):
+                        func(frame)
+                except Exception as e:
+                    frame["error"] = e
+                timer.stop()
+            outq.put(frame)
+
+    def roi_bounds(self, shape) -> tuple:
+        '''(rowmin, rowmax, colmin, colmax) slice bounds of the ROI of images of the given shape'''
+        rowmin = int(self.roi[0][0] * shape[0])
+        rowmax = min(int(self.roi[1][0] * shape[0])+1, shape[0])
+        colmin = int(self.roi[0][1] * shape[1])
+        colmax = min(int(self.roi[1][1] * shape[1])+1, shape[1])
+        return rowmin, rowmax, colmin, colmax
+
+    def _decode(self, frame):
+        from PIL import Image
+        img = np.asarray(Image.open(frame["path"])) # RGB format
+        rowmin, rowmax, colmin, colmax = self.roi_bounds(img.shape)
+        frame["img"] = img
+        frame["roi_img"] = img[rowmin:rowmax,colmin:colmax]
+        frame["roi_offset"] = (rowmin, colmin)
+        if self.use_raytable:
+            frame["raytable"] = get_camera_ray_table(self.camera, img.shape)
+
+    def warmup(self, path, log=None) -> dict:
+        '''Precompiles the kernels for the ROI of images the size of the given one, see laser_detection.warmup'''
+        from PIL import Image
+        from laser_detection.warmup import warmup
+        width, height = Image.open(path).size # reads the header only
+        rowmin, rowmax, colmin, colmax = self.roi_bounds((height, width))
+        return warmup([(rowmax - rowmin, colmax - colmin)], log=log)
+
+    def autotune(self, path, force=False, log=None) -> dict:
+        '''
+        Times every available implementation of each stage on a representative frame and persists 
+        the fastest for its ROI shape on this host, see Backends.autotune. Does nothing if that shape 
+        was already tuned, unless force is set.
+
+        :return: {stage: {implementation: best time in s}}, empty if nothing was tuned
+        '''
+        frame = {"idx": -1, "filename": os.path.basename(path), "path": path}
+        self._decode(frame)
+        img = frame["roi_img"]
+        shape = img.shape
+        if Backends.tuned(shape) and not force:
+            return {}
+        # run the frame through the current choices to get representative inputs of every stage
+        reward = Backends.get("reward", shape)(img)
+        gvals = Backends.get("gval", shape)(reward)
+        subpxs, centerpx = Backends.get("subpx", shape)(gvals, reward, DEFAULT_GVAL_MIN_VAL)
+        subpxsfiltered, patches = Backends.get("patch", shape)(subpxs)
+        laserpxbinary = np.zeros(subpxsfiltered.shape, dtype=np.uint8)
+        laserpxbinary[subpxsfiltered != 0] = 255
+        stage_args = {
+            "reward": (img,),
+            "gval": (reward,),
+            "subpx": (gvals, reward, DEFAULT_GVAL_MIN_VAL),
+            "patch": (subpxs,),
+        }
+        if self.segment_mode == SEGMENT_MAX_SPAN_TREE:
+            stage_args["segment"] = (laserpxbinary, patches, centerpx)
+            patchlines = Backends.get("segment", shape)(*stage_args["segment"])
+            if isinstance(self.planes, LaserPlanes):
+                rows, cols, pointlines = laser_point_coords(patches, patchlines, len(self.planes), frame["roi_offset"])
+                stage_args["3d"] = (self.planes, rows, cols, pointlines, np.empty((pointlines.shape[0], 3), dtype=np.float32))
+        return Backends.autotune(stage_args, shape, log=log)
+
+    def _detect(self, frame):
+        shape = frame["roi_img"].shape
+        reward = Backends.get("reward", shape)(frame["roi_img"])
+        gvals = Backends.get("gval", shape)(reward)
+        subpxs, centerpx = Backends.get("subpx", shape)(gvals, reward, DEFAULT_GVAL_MIN_VAL)
+        subpxsfiltered, patches = Backends.get("patch", shape)(subpxs)
+        laserpxbinary = np.zeros(subpxsfiltered.shape, dtype=np.uint8)
+        laserpxbinary[subpxsfiltered != 0] = 255
+        frame["centerpx"] = centerpx
+        frame["patches"] = patches
+        frame["laserpxbinary"] = laserpxbinary
+        if self.keep_intermediates:
+            # the njit reward backend reuses its output buffer for the next frame
+            frame["reward"] = np.copy(to_host(reward))
+            frame["gvals"] = to_host(gvals)
+            frame["subpxs"] = subpxs
+            frame["subpxsfiltered"] = subpxsfiltered
+
+    def _extract(self, frame):
+        shape = frame["roi_img"].shape
+        if self.segment_mode == SEGMENT_MAX_SPAN_TREE:
+            patchlines = Backends.get("segment", shape)(frame["laserpxbinary"], frame["patches"], frame["centerpx"])
+        else:
+            patchlines = segment_laser_lines(frame["laserpxbinary"], self.segment_mode, patches=frame["patches"], centerdot=frame["centerpx"])
+        frame["patchlines"] = patchlines
+        frame["points"], frame["pointlines"] = extract_laser_points(self.planes, frame["patches"], patchlines, frame["roi_offset"], raytable=frame.get("raytable"), shape=shape)
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
+    PerfTracker.configure(mode=PerfTracker.MODE_SAMPLING)
+    Tracer.enable(ImageDisplay.TRACE)
 
-    if CUDASIM:
+    if laser_detection.CUDASIM:
         devices = cuda.list_devices()
         print(f"devices: {devices}")
         gpu = cuda.current_context().device
@@ -705,19 +714,13 @@ if __name__ == "__main__":
     else: 
         img_folder = "calib_imgs"
         calib_folder = "calib_imgs"
-    imgs = []
-    cpimgs = []
-    filenames = []
+    paths = []
     for filename in os.listdir(img_folder):
         if(filename.lower().endswith((".png", ".jpg", ".jpeg"))):
-            print(f"opening {filename}")
-            img = Image.open(os.path.join(img_folder, filename))
-            if img is not None:
-                imgs.append((filename, np.asarray(img))) # RGB format
-                cpimgs.append(cupy.asarray(img))
-                filenames.append(filename)
-    
+            paths.append(os.path.join(img_folder, filename))
+    paths = paths[:MAX_TEST_IMGS]
     
+
     laserplanes = np.load(os.path.join(curdir, calib_folder, "Camera_Relative_Laser_Planes.npy"), allow_pickle=True)
     planes = [
         (u, v, w, -u*x -v*y -w*z) 
@@ -760,44 +763,46 @@ if __name__ == "__main__":
     z = np.cos(v)
     ax.plot_surface(x * 0.25, y * 0.25, z * 0.25, cmap=plt.cm.YlGnBu_r)
 
-    imgproctimes = 0
-    count = 0
-    for filename, img in imgs:
-        if count >= MAX_TEST_IMGS: break
-        print(f"Processing image {count}: {filename}")
+    pipeline = LaserPipeline(LaserPlanes(planes, ZedMini.LeftRectHD2K.P), DEFAULT_ROI, keep_intermediates=len(IMG_DISPLAYS) > 0)
+    if LaserDetection.WARMUP and len(paths) > 0:
+        pipeline.warmup(paths[0], log=print)
+    if LaserDetection.AUTOTUNE and len(paths) > 0:
+        pipeline.autotune(paths[0], log=print)
+    start_time = time.perf_counter()
+    numframes = 0
+    for frame in pipeline.run(paths):
+        count = frame["idx"]
+        if DEBUG_MODE: print(f"Processed image {count}: {frame['filename']}, queue depths {pipeline.queue_depths()}")
+        if "error" in frame:
+            print(f"Image {count} failed: {frame['error']!r}")
+            continue
+        numframes += 1
+        roi_img = frame["roi_img"]
 
-        if DEBUG_MODE:
-            start_time = time.perf_counter()
-
-        rowmin = int(DEFAULT_ROI[0][0] * img.shape[0])
-        rowmax = int(DEFAULT_ROI[1][0] * img.shape[0])+1
-        colmin = int(DEFAULT_ROI[0][1] * img.shape[1])
-        colmax = int(DEFAULT_ROI[1][1] * img.shape[1])+1
-        roi_img = img[rowmin:rowmax,colmin:colmax]
         if LaserDetectorStep.ORIG in IMG_DISPLAYS:
-            print(f"Img shape: {img.shape} -> {roi_img.shape}")
+            print(f"Img shape: {frame['img'].shape} -> {roi_img.shape}")
             origwin = f"Img{count}"
             cv.namedWindow(origwin, cv.WINDOW_NORMAL)
             cv.imshow(origwin, roi_img)
             np.save(os.path.join(calib_folder, f"img{count}roi"), roi_img)
 
-        reward = reward_img(roi_img)
         if LaserDetectorStep.REWARD in IMG_DISPLAYS:
+            reward = frame["reward"]
             rewwin = f"rew{count}"
             cv.namedWindow(rewwin, cv.WINDOW_NORMAL)
             cv.imshow(rewwin, reward / np.max(reward))
             np.save(os.path.join(calib_folder, f"img{count}rew"), reward)
 
-        gvals = calculate_gaussian_integral_windows(reward)
         if LaserDetectorStep.GVAL in IMG_DISPLAYS:
+            hostgvals = frame["gvals"]
             gvalwin = f"gvals{count}"
             cv.namedWindow(gvalwin, cv.WINDOW_NORMAL)
-            hostgvals = gvals.copy_to_host()
             cv.imshow(gvalwin, hostgvals / np.max(hostgvals))
             np.save(os.path.join(calib_folder, f"img{count}gvals"), hostgvals)
 
-        subpxs, centerpx = find_gval_subpixels_gpu(gvals, reward)
+        centerpx = frame["centerpx"]
         if LaserDetectorStep.SUBPX in IMG_DISPLAYS:
+            subpxs = frame["subpxs"]
             a = np.zeros((subpxs.shape[0], subpxs.shape[1], 3))
             a[subpxs != 0] = 255, 255, 255
             print(f"{np.count_nonzero(a)} subpxs")
@@ -808,16 +813,16 @@ if __name__ == "__main__":
             cv.imshow(subpxwin, a)
             np.save(os.path.join(calib_folder, f"img{count}subpxs"), subpxs)
 
-        subpxsfiltered, patches = throw_out_small_patches_gpu(subpxs)
+        patches = frame["patches"]
         if LaserDetectorStep.FILTER in IMG_DISPLAYS:
+            subpxsfiltered = frame["subpxsfiltered"]
             print(f"Found {len(patches)} good patches")
             filtwin = f"subpxgfilt {count}"
             cv.namedWindow(filtwin, cv.WINDOW_NORMAL)
             cv.imshow(filtwin, subpxsfiltered)
             np.save(os.path.join(calib_folder, f"img{count}filt"), subpxsfiltered)
 
-        laserpxbinary = np.zeros(subpxsfiltered.shape, dtype=np.uint8)
-        laserpxbinary[subpxsfiltered != 0] = 255
+        laserpxbinary = frame["laserpxbinary"]
         if LaserDetectorStep.BIN in IMG_DISPLAYS:
             binwin = f"bin{count}"
             cv.namedWindow(binwin, cv.WINDOW_NORMAL)
@@ -825,70 +830,48 @@ if __name__ == "__main__":
             np.save(os.path.join(calib_folder, f"img{count}bin"), laserpxbinary)
             
             patchimg = np.zeros(laserpxbinary.shape)
-            for patch in patches:
-                for px in patch:
-                    patchimg[px[0], px[1]] = 1
+            patchimg[patches.rows, patches.cols] = 1
             patchwin = f"patch{count}"
             cv.namedWindow(patchwin, cv.WINDOW_NORMAL)
             cv.imshow(patchwin, patchimg)
 
-
-        # lines = ...
-        patchgroups = segment_laser_lines(laserpxbinary, SEGMENT_MAX_SPAN_TREE, patches=patches, centerdot=centerpx)
+        patchlines = frame["patchlines"]
         if LaserDetectorStep.SEGMENT in IMG_DISPLAYS:
-            # print(patchgroups)
-            # dispimg = np.copy(roi_img)
-            # print("\nLines: ")
-            # if lines is not None:
-                # lines = lines[lines[:, 0].argsort()] 
-                # draw_polar_lines(dispimg, lines)
-            
-            # lineswin = f"lines{count}"
-            # cv.namedWindow(lineswin, cv.WINDOW_NORMAL)
-            # cv.imshow(lineswin, dispimg)
-            # np.save(os.path.join(calib_folder, f"img{count}lines"), lines)
-        
-        # patchgroups = imagept_laserplane_assoc(patches, lines)
-        # if LaserDetectorStep.ASSOC in IMG_DISPLAYS:
             mergedlinespatchimg = roi_img.copy()
-            for idx, group in enumerate(patchgroups): 
-                numpts, patches = group
-                print(f"line {idx} has {len(patches)} patches and {numpts} points")
-                for patch in patches:
-                    for pt in patch:
-                        row, col, x_offset = pt
-                        mergedlinespatchimg[row, col] = DISP_COLORS[idx]
-                        # cv.circle(mergedlinespatchimgclear, (col, row), 2, DISP_COLORS[idx])
+            pointlines = patches.point_lines(patchlines)
+            for idx in range(NUM_LASER_LINES): 
+                online = pointlines == idx
+                print(f"line {idx} has {np.count_nonzero(patchlines == idx)} patches and {np.count_nonzero(online)} points")
+                mergedlinespatchimg[patches.rows[online], patches.cols[online]] = DISP_COLORS[idx]
             assocwin = f"assoc{count}"
             cv.namedWindow(assocwin, cv.WINDOW_NORMAL)
             cv.imshow(assocwin, mergedlinespatchimg)
-            np.save(os.path.join(calib_folder, f"img{count}patches"), np.array(patchgroups, dtype=object))
+            np.savez(os.path.join(calib_folder, f"img{count}patches"), 
+                     rows=patches.rows, cols=patches.cols, offsets=patches.offsets, patch_ptr=patches.patch_ptr, patchlines=patchlines)
 
-        linepts = extract_laser_points(planes, patchgroups, (rowmin, colmin))
+        points, pointlines = frame["points"], frame["pointlines"]
         if LaserDetectorStep.PCL in IMG_DISPLAYS:
             pclfig = plt.figure(f"points{count}")
             ax = pclfig.add_subplot(projection="3d")
             ax.set_title(f"points{count}")
-            for idx, line in enumerate(linepts): 
+            for idx in range(NUM_LASER_LINES): 
+                line = points[pointlines == idx]
                 print(f"line {idx} has {len(line)} points")
-                print(line.shape)
                 if line.shape[0] == 0: print(f"No points for line {idx+1}, not plotting")
                 else: ax.scatter(line[:,0], line[:,1], line[:,2], marker='o', color=DISP_COLORSf[idx])
             ax.set_xlabel("X")
             ax.set_ylabel("Y")
             ax.set_zlabel("Z")
-            np.save(os.path.join(calib_folder, f"img{count}points"), linepts)
-
-        if DEBUG_MODE:
-            end_time = time.perf_counter()
-            total_time = end_time - start_time
-            imgproctimes += total_time
-            printStr = f'Image pipeline took {total_time:.4f} seconds'
-
-        count += 1
-    
-    imgproctimes /= len(imgs)
-    print(f"Average image processing time of {imgproctimes:.4f} seconds or {1 / imgproctimes:.4f} images per second achieved. ")
+            np.savez(os.path.join(calib_folder, f"img{count}points"), points=points, pointlines=pointlines)
+
+    total_time = time.perf_counter() - start_time
+    if numframes > 0:
+        imgproctimes = total_time / numframes
+        print(f"Average image processing time of {imgproctimes:.4f} seconds or {1 / imgproctimes:.4f} images per second achieved. ")
+    print("Average stage times: " + ", ".join(f"{stage} {t:.4f}s" for stage, t in pipeline.stage_times().items()))
+    print(PerfTracker.report())
+    if ImageDisplay.TRACE:
+        Tracer.export_chrome_trace(os.path.join(calib_folder, "laser_detector_trace.json"))
 
     plt.show(block=False)
     while True:
@@ -7,7 +7,7 @@ directly in the code. The image should be a 3-channel image with the laser in vi
 
 
 # from laser_detector.gval import calculate_gaussian_integral_windows
-from laser_detection.gval import calculate_gaussian_integral_windows_jit
+from laser_detection.gval import gval_image
 import cv2 as cv
 import sys
 import os
@@ -27,7 +27,7 @@ def normalize(img):
 
 def calc(img):
     global gval_thresh
-    gvals = calculate_gaussian_integral_windows_jit(reward(img))#.copy_to_host()
+    gvals = gval_image(reward(img))
     print(f"Gvals:\n\tavg: {np.average(gvals)}\
           \n\tmin: {np.min(gvals)}\
           \n\tmax: {np.max(gvals)}\
@@ -0,0 +1,90 @@
+import numpy as np
+import cv2 as cv
+from constants import LaserCalibration
+from util import diskcache
+
+SUBPIX_CRITERIA = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+def find_chessboard_corners(gray, chessboard_dims, scale=LaserCalibration.CHESSBOARD_DETECT_SCALE):
+    '''
+    Coarse to fine chessboard detection. The board is searched for in a downscaled copy of the
+    grayscale image with the fast check on, so frames without a board are rejected quickly, and
+    the corners found are refined with cornerSubPix at full resolution.
+
+    :return: (N, 1, 2) float32 corners at full resolution or None if no board was found
+    '''
+    if scale < 1:
+        small = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    else:
+        small, scale = gray, 1.
+    flags = cv.CALIB_CB_ADAPTIVE_THRESH + cv.CALIB_CB_NORMALIZE_IMAGE + cv.CALIB_CB_FAST_CHECK
+    ret, corners = cv.findChessboardCorners(small, chessboard_dims, flags=flags)
+    if not ret:
+        return None
+    # pixel centers map as (x + 0.5) / scale - 0.5 between the two resolutions
+    corners = ((corners + 0.5) / scale - 0.5).astype(np.float32)
+    # the search window has to cover the error of the upscaled corners
+    win = max(11, int(round(2 / scale)))
+    return cv.cornerSubPix(gray, corners, (win, win), (-1, -1), SUBPIX_CRITERIA)
+
+def chessboard_object_points(square_size_m, chessboard_dims) -> np.ndarray:
+    '''Interior corners in the chessboard frame, in m'''
+    # makes a grid of points corresponding to each chessboard square from the chessboards
+    # ref frame, meaning that each chessboard square has a defining dimension of 1 "unit"
+    # therefore must scale these according to your selected units (m) in order to get actual
+    # object points
+    objp = np.zeros((chessboard_dims[0]*chessboard_dims[1], 3), dtype=np.float32)
+    objp[:,:2] = np.mgrid[0:chessboard_dims[0],0:chessboard_dims[1]].T.reshape(-1,2)
+    objp *= square_size_m
+    return objp
+
+def chessboard_plane(rvec, tvec):
+    '''Chessboard to camera transformation matrix and chessboard plane (A,B,C,D) in the camera frame'''
+    rotmat, _ = cv.Rodrigues(rvec)
+    # world (chessboard) reference frame to camera reference frame transformation matrix
+    world2cam = np.identity(4)
+    world2cam[:3,:3] = rotmat
+    world2cam[:3, 3] = np.ravel(tvec)
+
+    chessboard_plane_point = world2cam.dot([0,0,0,1])
+    chessboard_normal_vec_to_point = world2cam.dot([0,0,1,1])
+    chessboard_normal_vec = chessboard_normal_vec_to_point[:3] - chessboard_plane_point[:3]
+    plane = np.array((
+        # (u, v, w, -u*x -v*y -w*z)
+        chessboard_normal_vec[0], chessboard_normal_vec[1], chessboard_normal_vec[2],
+        -chessboard_normal_vec[0] * chessboard_plane_point[0]
+        -chessboard_normal_vec[1] * chessboard_plane_point[1]
+        -chessboard_normal_vec[2] * chessboard_plane_point[2]
+    ))
+    return world2cam, plane
+
+def locate_chessboard(img, square_size_m, chessboard_dims, K, dist=None, cache_dir=LaserCalibration.CHESSBOARD_CACHE_DIR):
+    '''
+    Finds the chessboard pose in an RGB image. Results, including not finding a board, are cached
+    on disk keyed by the image content and the board and camera parameters, so recalibrating the
+    same images skips chessboard detection. Pass cache_dir=None to disable the cache.
+
+    :return: dict with corners, rvec, tvec, world2cam and plane, or None if there is no board
+    '''
+    key = None
+    if cache_dir is not None:
+        key = diskcache.content_key(
+            "chessboard", np.asarray(img), float(square_size_m), tuple(chessboard_dims),
+            np.asarray(K, dtype=np.float64), None if dist is None else np.asarray(dist, dtype=np.float64),
+            LaserCalibration.CHESSBOARD_DETECT_SCALE)
+        entry = diskcache.load(cache_dir, key)
+        if entry is not None:
+            return None if not entry["found"] else {name: val for name, val in entry.items() if name != "found"}
+
+    gray = cv.cvtColor(np.asarray(img), cv.COLOR_RGB2GRAY)
+    corners = find_chessboard_corners(gray, chessboard_dims)
+    if corners is None:
+        if key is not None: diskcache.save(cache_dir, key, found=False)
+        return None
+    objp = chessboard_object_points(square_size_m, chessboard_dims)
+    # find rotation and translation vectors
+    ret, rvec, tvec = cv.solvePnP(objp, corners, K, dist)
+    world2cam, plane = chessboard_plane(rvec, tvec)
+    board = {"corners": corners, "rvec": rvec, "tvec": tvec, "world2cam": world2cam, "plane": plane}
+    if key is not None: diskcache.save(cache_dir, key, found=True, **board)
+    return board
@@ -0,0 +1,35 @@
+import numpy as np
+import hashlib
+import os
+
+def content_key(*parts) -> str:
+    '''Hash of arrays (by dtype, shape and content) and plain values (by repr) identifying a cache entry'''
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.dtype.str}{part.shape}".encode())
+            h.update(np.ascontiguousarray(part).data)
+        else:
+            h.update(repr(part).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+def cache_path(cache_dir, key) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.npz")
+
+def load(cache_dir, key):
+    '''Arrays stored under key as a dict, or None if there is no entry'''
+    path = cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as entry:
+        return {name: entry[name] for name in entry.files}
+
+def save(cache_dir, key, **arrays):
+    '''Stores arrays under key. Entries are written under a unique name and renamed into place, so
+    concurrent writers and readers never see a partial entry.'''
+    path = cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmppath = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmppath, **arrays)
+    os.replace(tmppath, path)
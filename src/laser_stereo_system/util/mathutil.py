@@ -166,4 +166,33 @@ def px_2_3d(row, col, plane, K):
     x *= t
     y *= t
     z = t
-    return x, y, z
\ No newline at end of file
+    return x, y, z
+
+def px_2_3d_many(rows, cols, plane, K, out=None):
+    '''Batched px_2_3d. Plane as (A,B,C,D) or one (A,B,C,D) per point as an (N,4) array. K as 
+    intrinsic camera matrix. Writes the (N,3) points into out if given. Points whose camera ray is 
+    parallel to their plane come out as inf/nan instead of printing a warning.'''
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    plane = np.asarray(plane, dtype=np.float64)
+    a, b, c, d = plane[...,0], plane[...,1], plane[...,2], plane[...,3]
+    c_x, c_y, f_x, f_y = K[0,2], K[1,2], K[0,0], K[1,1]
+    if out is None:
+        out = np.empty((rows.shape[0], 3))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (cols - c_x) / f_x
+        y = (rows - c_y) / f_y
+        t = -d / (a * x + b * y + c)
+    np.multiply(x, t, out=out[:,0], casting="unsafe")
+    np.multiply(y, t, out=out[:,1], casting="unsafe")
+    out[:,2] = t
+    return out
+
+def polar_line_distances(rows, cols, polarlines):
+    '''Distances from N image points to L lines given as (r, theta), as an (N, L) array.'''
+    polarlines = np.asarray(polarlines, dtype=np.float64).reshape((-1, 2))
+    r, th = polarlines[:,0], polarlines[:,1]
+    rows = np.asarray(rows, dtype=np.float64)[:, None]
+    cols = np.asarray(cols, dtype=np.float64)[:, None]
+    # |r - r_p * cos(th - th_p)| with the point expanded to cartesian coordinates
+    return np.abs(r[None, :] - (cols * np.cos(th)[None, :] + rows * np.sin(th)[None, :]))
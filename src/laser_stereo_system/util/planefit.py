@@ -0,0 +1,126 @@
+import numpy as np
+import math
+from concurrent.futures import ThreadPoolExecutor
+from constants import LaserCalibration
+
+MAX_SCORED_DISTS = 1 << 24 # max hypotheses x points distances scored at once
+
+def fit_plane_svd(pts):
+    '''Least squares plane through (N,3) points as (centroid, unit normal)'''
+    centroid = pts.mean(axis=0)
+    # the normal is the right singular vector of the centered points with the smallest singular value
+    _, _, vt = np.linalg.svd(pts - centroid, full_matrices=False)
+    return centroid, vt[2]
+
+def msac_plane(pts, threshold=LaserCalibration.PLANE_FIT_INLIER_THRESH, confidence=LaserCalibration.PLANE_FIT_CONFIDENCE,
+               max_iters=LaserCalibration.PLANE_FIT_MAX_ITERS, batch=LaserCalibration.PLANE_FIT_BATCH,
+               score_pts=LaserCalibration.PLANE_FIT_SCORE_PTS, rng=None):
+    '''
+    Robust plane fit with MSAC. Minimal 3 point samples are drawn in batches and every hypothesis of
+    a batch is scored against the points in one vectorized point to plane distance pass, with the
+    truncated squared distance as cost. Large point sets are scored on a random subset of
+    score_pts points, the final inliers are always found among all points. Sampling stops once
+    enough hypotheses were drawn to have drawn an all inlier sample with the given confidence at
+    the best inlier ratio so far, and the best hypothesis is refined with an SVD fit of its inliers.
+
+    :return: (centroid, unit normal, inlier mask) or None if there are fewer than 3 points
+    '''
+    numpts = pts.shape[0]
+    if numpts < 3:
+        return None
+    rng = np.random.default_rng() if rng is None else rng
+    scored = pts if numpts <= score_pts else pts[rng.choice(numpts, score_pts, replace=False)]
+    batch = max(1, min(batch, MAX_SCORED_DISTS // scored.shape[0]))
+    thresh2 = threshold * threshold
+    bestcost, bestplane = np.inf, None
+    required, iters = max_iters, 0
+    while iters < min(required, max_iters):
+        samples = pts[rng.integers(0, numpts, size=(batch, 3))] # (batch, 3 pts, xyz)
+        normals = np.cross(samples[:,1] - samples[:,0], samples[:,2] - samples[:,0])
+        norms = np.linalg.norm(normals, axis=1)
+        valid = norms > 0 # drop degenerate (collinear or repeated) samples
+        normals = normals[valid] / norms[valid, None]
+        offsets = -(normals * samples[valid, 0]).sum(axis=1)
+        iters += batch
+        if normals.shape[0] == 0:
+            continue
+        dists2 = np.square(scored @ normals.T + offsets) # (scored pts, hypotheses)
+        costs = np.minimum(dists2, thresh2).sum(axis=0)
+        best = int(np.argmin(costs))
+        if costs[best] < bestcost:
+            bestcost = costs[best]
+            bestplane = normals[best], offsets[best]
+            inlierratio = np.count_nonzero(dists2[:, best] < thresh2) / scored.shape[0]
+            if inlierratio >= 1:
+                break
+            if inlierratio > 0:
+                required = math.ceil(math.log(1 - confidence) / math.log(1 - inlierratio ** 3))
+    if bestplane is None:
+        return None
+    normal, offset = bestplane
+    inliers = np.square(pts @ normal + offset) < thresh2
+    if np.count_nonzero(inliers) < 3:
+        return None
+    centroid, normal = fit_plane_svd(pts[inliers])
+    # rescore with the refined plane
+    inliers = np.square((pts - centroid) @ normal) < thresh2
+    return centroid, normal, inliers
+
+def msac_planes(pointsets, seed=LaserCalibration.PLANE_FIT_SEED, **kwargs):
+    '''Fits one plane per point set with msac_plane, all point sets in parallel. Each point set gets
+    its own seeded generator so results don't depend on scheduling.'''
+    def fit(idx):
+        return msac_plane(np.asarray(pointsets[idx], dtype=np.float64), rng=np.random.default_rng((seed, idx)), **kwargs)
+    with ThreadPoolExecutor(max_workers=max(1, len(pointsets))) as pool:
+        return list(pool.map(fit, range(len(pointsets))))
+
+class PlaneAccumulator:
+    '''
+    Online least squares plane fit keeping only the running count, sum and 3x3 scatter matrix
+    (sum of x x^T) of the points added, so memory stays constant however many points are fed in.
+    add returns the statistics of the points it added, which remove takes to take them back out,
+    e.g. to drop an image from a calibration.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.sum = np.zeros(3)
+        self.scatter = np.zeros((3,3))
+
+    @staticmethod
+    def stats(pts):
+        '''(count, sum, scatter) of (N,3) points'''
+        pts = np.asarray(pts, dtype=np.float64).reshape((-1, 3))
+        return pts.shape[0], pts.sum(axis=0), pts.T @ pts
+
+    def add(self, pts):
+        contribution = self.stats(pts)
+        self.add_stats(contribution)
+        return contribution
+
+    def add_stats(self, contribution):
+        count, ptsum, scatter = contribution
+        self.count += count
+        self.sum += ptsum
+        self.scatter += scatter
+
+    def remove(self, contribution):
+        count, ptsum, scatter = contribution
+        if count > self.count:
+            raise ValueError("PlaneAccumulator can't remove more points than were added")
+        self.count -= count
+        self.sum -= ptsum
+        self.scatter -= scatter
+
+    def plane(self):
+        '''
+        Current best fit plane as (centroid, unit normal, rms distance of the points to the plane),
+        or None with fewer than 3 points. The normal is the eigenvector of the covariance with the
+        smallest eigenvalue, which is the mean squared distance to the plane.
+        '''
+        if self.count < 3:
+            return None
+        centroid = self.sum / self.count
+        cov = self.scatter / self.count - np.outer(centroid, centroid)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        return centroid, eigvecs[:,0], math.sqrt(max(eigvals[0], 0.))
@@ -0,0 +1,123 @@
+import numpy as np
+import hashlib
+import os
+import threading
+from constants import LaserDetection
+
+_tables = {} # (key, shape) -> RayTable, so each process maps a table file once
+_tables_lock = threading.Lock()
+
+def intrinsics_key(K, shape, D=None) -> str:
+    '''Hash of the intrinsic matrix, distortion parameters and image resolution identifying a ray table'''
+    h = hashlib.sha1(np.ascontiguousarray(np.asarray(K, dtype=np.float64)[:3,:3]).tobytes())
+    h.update(np.asarray(shape[:2], dtype=np.int64).tobytes())
+    if D is not None and len(D) > 0:
+        h.update(np.asarray(D, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+def undistort_normalized(x, y, D, iterations=LaserDetection.UNDISTORT_ITERATIONS):
+    '''
+    Removes plumb_bob lens distortion (k1, k2, t1, t2, k3) from normalized image coordinates by 
+    fixed point iteration, the same scheme cv.undistortPoints uses. Works on any number of points, 
+    so raw frames can be corrected at the laser points only.
+    '''
+    D = np.zeros(5) if D is None else np.concatenate((np.asarray(D, dtype=np.float64).ravel(), np.zeros(5)))[:5]
+    k1, k2, t1, t2, k3 = D
+    x0 = np.asarray(x, dtype=np.float64)
+    y0 = np.asarray(y, dtype=np.float64)
+    x, y = x0.copy(), y0.copy()
+    for _ in range(iterations):
+        r2 = x*x + y*y
+        icdist = 1 / (1 + ((k3*r2 + k2)*r2 + k1)*r2)
+        deltax = 2*t1*x*y + t2*(r2 + 2*x*x)
+        deltay = t1*(r2 + 2*y*y) + 2*t2*x*y
+        x = (x0 - deltax) * icdist
+        y = (y0 - deltay) * icdist
+    return x, y
+
+class RayTable:
+    '''
+    Per-pixel table of normalized camera ray directions (x, y) with z = 1 for an image resolution,
+    so the ray through pixel (row, col) is (table[row, col, 0], table[row, col, 1], 1). With the
+    rays looked up, intersecting them with a plane is one dot product and one scale per point.
+    If distortion parameters D are given, the rays are undistorted when the table is built, so 
+    points detected in raw frames are corrected at lookup without remapping whole frames.
+
+    Tables are float32 .npy files in LaserDetection.RAY_TABLE_CACHE_DIR named after a hash of K, D and
+    the resolution. They are memory mapped read only, so every process using the same camera
+    shares one copy.
+    '''
+
+    def __init__(self, K, shape, D=None, cache_dir=LaserDetection.RAY_TABLE_CACHE_DIR):
+        self.K = np.asarray(K, dtype=np.float64)
+        self.D = None if D is None or len(D) == 0 else np.asarray(D, dtype=np.float64)
+        self.shape = tuple(shape[:2])
+        self.key = intrinsics_key(self.K, self.shape, self.D)
+        self.path = os.path.join(cache_dir, f"rays_{self.key}_{self.shape[1]}x{self.shape[0]}.npy")
+        if not os.path.exists(self.path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # build under a unique name and rename, so concurrent builders never see a partial table
+            tmppath = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            table = np.lib.format.open_memmap(tmppath, mode="w+", dtype=np.float32, shape=self.shape + (2,))
+            self.build(self.K, table, self.D)
+            table.flush()
+            del table
+            os.replace(tmppath, self.path)
+        self.table = np.load(self.path, mmap_mode="r")
+
+    @staticmethod
+    def build(K, table, D=None):
+        '''Fills an (H, W, 2) table with the normalized (and undistorted if D is given) ray directions of each pixel'''
+        c_x, c_y, f_x, f_y = K[0,2], K[1,2], K[0,0], K[1,1]
+        x = ((np.arange(table.shape[1]) - c_x) / f_x)[None, :]
+        if D is None:
+            table[:,:,0] = x
+            table[:,:,1] = ((np.arange(table.shape[0]) - c_y) / f_y)[:, None]
+            return
+        for row in range(table.shape[0]):
+            y = np.full(x.shape, (row - c_y) / f_y)
+            table[row,:,0], table[row,:,1] = undistort_normalized(x, y, D)
+
+    def rays(self, rows, cols):
+        '''Normalized ray directions (x, y) at integer rows and subpixel cols, linearly interpolated
+        between the two pixels of the row the subpixel column falls between'''
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.float64)
+        # columns past the last pixel center extrapolate from the last two pixels
+        c0 = np.clip(np.floor(cols).astype(np.int64), 0, self.shape[1] - 2)
+        c1 = c0 + 1
+        frac = (cols - c0)[:, None]
+        left = self.table[rows, c0]
+        right = self.table[rows, c1]
+        xy = left + frac * (right - left)
+        return xy[:,0], xy[:,1]
+
+    def px_2_3d_many(self, rows, cols, plane, out=None):
+        '''px_2_3d_many using the table instead of K. Plane as (A,B,C,D) or an (N,4) array.'''
+        x, y = self.rays(rows, cols)
+        plane = np.asarray(plane, dtype=np.float64)
+        a, b, c, d = plane[...,0], plane[...,1], plane[...,2], plane[...,3]
+        if out is None:
+            out = np.empty((x.shape[0], 3))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = -d / (a * x + b * y + c)
+        np.multiply(x, t, out=out[:,0], casting="unsafe")
+        np.multiply(y, t, out=out[:,1], casting="unsafe")
+        out[:,2] = t
+        return out
+
+def get_ray_table(K, shape, D=None) -> RayTable:
+    '''Ray table for the given intrinsics, distortion and resolution, built and cached on disk the 
+    first time any process asks for it'''
+    key = (intrinsics_key(K, shape, D), tuple(shape[:2]))
+    with _tables_lock:
+        if key not in _tables:
+            _tables[key] = RayTable(K, shape, D)
+        return _tables[key]
+
+def get_camera_ray_table(camera, shape) -> RayTable:
+    '''Ray table of a constants.Camera. Cameras with distortion parameters get an undistorting 
+    table over the raw intrinsics K, others one over the rectified intrinsics P.'''
+    if len(camera.D) > 0:
+        return get_ray_table(camera.K, shape, camera.D)
+    return get_ray_table(camera.P, shape)
@@ -0,0 +1,79 @@
+import numpy as np
+from multiprocessing import shared_memory, util
+
+_attached = {} # name -> SharedMemory attached by this (worker) process
+_finalizer = None # closes the attached blocks when the process exits
+
+class SharedImages:
+    '''
+    Copies a list of images into one shared memory block once, so worker processes can view them
+    by (name, spec) instead of having every image pickled to them. Each spec is the
+    (byte offset, shape, dtype) of one image in the block. The creating process owns the block
+    and unlinks it on close(). Workers release() the blocks they attached once done with their
+    images, blocks still attached when a worker exits are closed then.
+    '''
+
+    def __init__(self, imgs: list[np.ndarray]):
+        self.specs = []
+        offset = 0
+        for img in imgs:
+            img = np.asarray(img)
+            self.specs.append((offset, img.shape, img.dtype.str))
+            offset += img.nbytes
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self._name = self.shm.name
+        for img, spec in zip(imgs, self.specs):
+            view(self.shm, spec)[...] = img
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def close(self):
+        '''Unlinks the block, does nothing if it already was'''
+        if self.shm is None:
+            return
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def view(shm, spec) -> np.ndarray:
+    '''Image described by spec in an attached shared memory block. The view holds on to the
+    block's buffer, so closing the block while views are alive raises instead of unmapping them.'''
+    offset, shape, dtype = spec
+    count = int(np.prod(shape))
+    return np.frombuffer(shm.buf, dtype=np.dtype(dtype), count=count, offset=offset).reshape(shape)
+
+def shared_image(name, spec) -> np.ndarray:
+    '''Image described by spec in the shared memory block called name, attaching to the block
+    the first time this process asks for it'''
+    global _finalizer
+    if name not in _attached:
+        if _finalizer is None:
+            # runs when a multiprocessing worker exits, unlike atexit handlers
+            _finalizer = util.Finalize(None, release_all, exitpriority=0)
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return view(_attached[name], spec)
+
+def release(name):
+    '''Closes this process's attachment to the block called name. Blocks that still have views
+    stay attached until the views are gone and release is called again, or the process exits.'''
+    shm = _attached.get(name)
+    if shm is None:
+        return
+    try:
+        shm.close()
+    except BufferError:
+        return
+    del _attached[name]
+
+def release_all():
+    '''Closes every block this process attached that has no views left'''
+    for name in list(_attached):
+        release(name)
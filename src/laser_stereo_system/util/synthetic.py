@@ -0,0 +1,142 @@
+import numpy as np
+import math
+from constants import LaserDetection, Synthetic, ZedMini
+
+ROW_BLOCK = 512 # rows composited at once, bounds the float buffers for large frames
+
+def scaled_intrinsics(camera, width, height) -> np.ndarray:
+    '''Rectified camera matrix (the 3x3 part of P) of a camera rescaled to width x height px'''
+    K = np.array(camera.P, dtype=np.float64)[:3,:3]
+    if camera.width is None or camera.height is None:
+        raise ValueError("Camera needs a width and height to be rescaled")
+    sx, sy = width / camera.width, height / camera.height
+    # pixel centers map as (x + 0.5) * s - 0.5 between resolutions
+    return np.array([
+        [K[0,0] * sx, 0., (K[0,2] + 0.5) * sx - 0.5],
+        [0., K[1,1] * sy, (K[1,2] + 0.5) * sy - 0.5],
+        [0., 0., 1.],
+    ])
+
+def fan_planes(numlines=LaserDetection.NUM_LASER_LINES, baseline=Synthetic.LASER_BASELINE, fan_angle=Synthetic.LASER_FAN_ANGLE) -> np.ndarray:
+    '''
+    (numlines, 4) planes (A,B,C,D) of a line laser at (baseline, 0, 0) fanning its planes about the
+    camera y axis, so lines run top to bottom in the image like with the real projector. Planes
+    are ordered left to right.
+    '''
+    angles = np.radians(np.linspace(-fan_angle / 2, fan_angle / 2, numlines))
+    # the plane holds the y axis and the direction (sin, 0, cos)
+    normals = np.stack((np.cos(angles), np.zeros(numlines), -np.sin(angles)), axis=1)
+    planes = np.empty((numlines, 4))
+    planes[:,:3] = normals
+    planes[:,3] = -normals @ np.array((baseline, 0., 0.))
+    return planes
+
+def line_columns(planes, scene, K, height) -> np.ndarray:
+    '''
+    (L, height) exact column of every laser line on every image row. The image of the intersection
+    of laser plane (n, d) and scene plane (m, e) is the image line (d m - e n)^T K^-1 (col, row, 1) = 0.
+    '''
+    planes, scene = np.asarray(planes, dtype=np.float64), np.asarray(scene, dtype=np.float64)
+    lines = (planes[:,3:] * scene[:3] - scene[3] * planes[:,:3]) @ np.linalg.inv(K) # (L, 3)
+    rows = np.arange(height)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -(lines[:,1:2] * rows + lines[:,2:]) / lines[:,:1]
+
+def backproject(rows, cols, scene, K) -> tuple:
+    '''(N, 3) points where the camera rays through the pixels hit the scene plane, and the ray parameter (positive in front)'''
+    scene = np.asarray(scene, dtype=np.float64)
+    rays = np.stack((cols, rows, np.ones(len(rows))), axis=1) @ np.linalg.inv(K).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = -scene[3] / (rays @ scene[:3])
+    return rays * t[:, None], t
+
+def occlusion_mask(numlines, height, rng, gaps=Synthetic.GAPS_PER_LINE, gap_length=Synthetic.GAP_LENGTH) -> np.ndarray:
+    '''(L, height) mask of the rows each line is visible on, with a Poisson number of gaps per line'''
+    visible = np.ones((numlines, height), dtype=bool)
+    for line, numgaps in enumerate(rng.poisson(gaps, numlines)):
+        lengths = rng.uniform(gap_length[0], gap_length[1], numgaps) * height
+        starts = rng.uniform(0, height, numgaps)
+        for start, length in zip(starts, lengths):
+            visible[line, int(start):int(start + length)] = False
+    return visible
+
+def render_frame(width, height, planes=None, numlines=LaserDetection.NUM_LASER_LINES, camera=ZedMini.LeftRectHD2K,
+                 scene=Synthetic.SCENE_PLANE, sigma=Synthetic.STRIPE_SIGMA, peak=Synthetic.STRIPE_PEAK,
+                 color=Synthetic.LASER_COLOR, background=Synthetic.BACKGROUND, noise=Synthetic.NOISE_STD,
+                 gaps=Synthetic.GAPS_PER_LINE, gap_length=Synthetic.GAP_LENGTH, dot_sigma=Synthetic.CENTER_DOT_SIGMA,
+                 seed=0) -> dict:
+    '''
+    Renders a synthetic RGB frame of laser lines projected on a scene plane, seen by the camera
+    rescaled to width x height. Every visible line row gets a Gaussian stripe profile across the
+    columns centered on the exact line column, clipped at full scale, over a flat background
+    with Gaussian noise. Lines have random occlusion gaps and the center line a center dot. The
+    same arguments and seed always give the same frame.
+
+    planes - (L, 4) laser planes (A,B,C,D) in the camera frame, fan_planes(numlines) by default
+
+    :return: dict with
+        img - (height, width, 3) uint8 RGB frame
+        K - camera matrix of the frame
+        planes - the laser planes
+        rows, cols - ground truth row and subpixel column of every visible line point
+        lines - plane index of every point, points are grouped by line in increasing line order
+        points - (N, 3) ground truth 3D points
+        centerdot - (row, col) pixel of the center dot, or None
+    '''
+    rng = np.random.default_rng(seed)
+    K = scaled_intrinsics(camera, width, height)
+    planes = fan_planes(numlines) if planes is None else np.asarray(planes, dtype=np.float64).reshape((-1, 4))
+    numlines = planes.shape[0]
+
+    linecols = line_columns(planes, scene, K, height)
+    _, depth = backproject(np.arange(height).repeat(numlines), linecols.T.ravel(), scene, K)
+    visible = np.isfinite(linecols) & (linecols >= 0) & (linecols <= width - 1) & (depth.reshape((height, numlines)).T > 0)
+    visible &= occlusion_mask(numlines, height, rng, gaps, gap_length)
+
+    lines, rows = np.nonzero(visible)
+    cols = linecols[lines, rows]
+    points, _ = backproject(rows, cols, scene, K)
+
+    # stripe profile, each visible line row spreads over the columns within 4 sigma of the line
+    profile = np.zeros((height, width), dtype=np.float32)
+    halfwidth = max(1, int(math.ceil(4 * sigma)))
+    offsets = np.arange(-halfwidth, halfwidth + 1)
+    stripecols = np.floor(cols).astype(np.int64)[:, None] + offsets # (N, window)
+    stripevals = np.exp(-np.square(stripecols - cols[:, None]) / (2 * sigma * sigma)).astype(np.float32)
+    inside = (stripecols >= 0) & (stripecols < width)
+    np.add.at(profile, (np.broadcast_to(rows[:, None], stripecols.shape)[inside], stripecols[inside]), stripevals[inside])
+
+    centerdot = None
+    centerline = numlines // 2
+    centerrows = rows[lines == centerline]
+    if dot_sigma > 0 and centerrows.shape[0] > 0:
+        # on the visible row of the center line closest to the principal point
+        dotidx = np.flatnonzero(lines == centerline)[np.argmin(np.abs(centerrows - K[1,2]))]
+        dotrow, dotcol = int(rows[dotidx]), int(round(cols[dotidx]))
+        radius = int(math.ceil(4 * dot_sigma))
+        r0, r1 = max(dotrow - radius, 0), min(dotrow + radius + 1, height)
+        c0, c1 = max(dotcol - radius, 0), min(dotcol + radius + 1, width)
+        rr, cc = np.mgrid[r0:r1, c0:c1]
+        profile[r0:r1, c0:c1] += 2 * np.exp(-(np.square(rr - dotrow) + np.square(cc - dotcol)) / (2 * dot_sigma * dot_sigma))
+        centerdot = (dotrow, dotcol)
+
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    scales = np.asarray(color, dtype=np.float32) * np.float32(255 * peak)
+    for start in range(0, height, ROW_BLOCK):
+        block = profile[start:start + ROW_BLOCK]
+        for channel in range(3):
+            val = block * scales[channel] + np.float32(background[channel])
+            if noise > 0:
+                val += rng.standard_normal(block.shape, dtype=np.float32) * np.float32(noise)
+            np.clip(val, 0, 255, out=val)
+            img[start:start + ROW_BLOCK, :, channel] = np.rint(val)
+
+    return {
+        "img": img, "K": K, "planes": planes, "rows": rows.astype(np.float64), "cols": cols,
+        "lines": lines.astype(np.int32), "points": points, "centerdot": centerdot,
+    }
+
+def render_resolution(name, numlines=LaserDetection.NUM_LASER_LINES, seed=0, **kwargs) -> dict:
+    '''render_frame at one of the Synthetic.RESOLUTIONS, e.g. "720p" or "8k"'''
+    width, height = Synthetic.RESOLUTIONS[name]
+    return render_frame(width, height, numlines=numlines, seed=seed, **kwargs)
@@ -0,0 +1,14 @@
+'''
+Test setup. The modules import each other like the nodes do when run from src/laser_stereo_system,
+and the CUDA kernels run in Numba's simulator unless NUMBA_ENABLE_CUDASIM is set otherwise.
+'''
+import os
+import sys
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PACKAGE_DIR = os.path.join(REPO_DIR, "src", "laser_stereo_system")
+
+os.environ.setdefault("NUMBA_ENABLE_CUDASIM", "1")
+for path in (os.path.dirname(PACKAGE_DIR), PACKAGE_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,128 @@
+import json
+import time
+import numpy as np
+import pytest
+from constants import ZedMini
+import laser_detector # registers its stage implementations
+from laser_detection import backends, color_reward, gval, subpx
+from laser_detection.backends import Backends, to_host
+from laser_detection.laserplanes import LaserPlanes
+from util import synthetic
+from util.mathutil import px_2_3d_many
+from test_pxpatch import bfs_labels
+
+SHAPE = (720, 1280)
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    '''Backends with only test implementations of the reward stage, persisted in a temporary file'''
+    monkeypatch.setattr(Backends, "implementations", {stage: {} for stage in backends.STAGES})
+    monkeypatch.setattr(Backends, "_available", {})
+    monkeypatch.setattr(Backends, "choices", None)
+    monkeypatch.setattr(Backends, "cache_path", str(tmp_path / "backends.json"))
+
+    @Backends.register("reward", "broken", priority=3)
+    def broken(img):
+        raise RuntimeError("no device")
+    @Backends.register("reward", "unavailable", priority=2, available=lambda: False)
+    def unavailable(img):
+        return img
+    @Backends.register("reward", "slow", priority=1)
+    def slow(img):
+        time.sleep(2e-3)
+        return img
+    @Backends.register("reward", "fast")
+    def fast(img):
+        return img
+    return Backends
+
+def test_priority_without_tuning(registry):
+    assert registry.available("reward") == ["broken", "slow", "fast"]
+    assert not registry.tuned(SHAPE)
+    assert registry.choose("reward", SHAPE) == "broken"
+    with pytest.raises(RuntimeError):
+        registry.choose("segment", SHAPE)
+    with pytest.raises(ValueError):
+        registry.register("reward", "fast")(lambda img: img)
+
+def test_autotune_persists_choice(registry):
+    logs = []
+    timings = registry.autotune({"reward": (np.zeros(SHAPE),)}, SHAPE, repeats=2, log=logs.append)
+    assert set(timings["reward"]) == {"slow", "fast"}
+    assert any("broken failed" in line for line in logs)
+    assert registry.choose("reward", SHAPE) == "fast"
+    assert registry.choose("reward", (480, 640)) == "broken"
+    with open(registry.cache_path) as f:
+        assert json.load(f)["choices"] == {registry.shape_key(SHAPE): {"reward": "fast"}}
+
+    # a new process loads the choice from the cache file
+    registry.choices = None
+    assert registry.tuned(SHAPE)
+    assert registry.get("reward", SHAPE) is registry.implementations["reward"]["fast"][0]
+
+def test_autotune_without_save(registry):
+    registry.autotune({"reward": (np.zeros(SHAPE),)}, SHAPE, repeats=1, save=False)
+    assert registry.choose("reward", SHAPE) == "fast"
+    registry.load()
+    assert not registry.tuned(SHAPE)
+
+def test_save_merges_other_processes(registry):
+    registry.load()
+    other = {"other/480x640": {"reward": "slow"}, registry.shape_key(SHAPE): {"gval": "njit"}}
+    with open(registry.cache_path, "w") as f:
+        json.dump({"choices": other}, f)
+    registry.autotune({"reward": (np.zeros(SHAPE),)}, SHAPE, repeats=1)
+    assert registry.load() == {"other/480x640": {"reward": "slow"},
+                               registry.shape_key(SHAPE): {"gval": "njit", "reward": "fast"}}
+
+def test_stale_choice_falls_back(registry):
+    registry.load()
+    registry.choices[registry.shape_key(SHAPE)] = {"reward": "unavailable"}
+    assert registry.choose("reward", SHAPE) == "broken"
+
+# every implementation of these stages, CUDA ones run in the CUDA simulator where there's no GPU
+IMPLEMENTATIONS = [(stage, name) for stage in ("reward", "gval", "subpx", "patch", "3d") for name in Backends.implementations[stage]]
+MIN_GVAL = 1910.
+
+@pytest.fixture(scope="module")
+def stage_inputs():
+    '''Reference results of every stage on a crop of a synthetic frame, small enough for the CUDA simulator'''
+    img = np.ascontiguousarray(synthetic.render_frame(640, 360)["img"][150:214, 240:368])
+    reward = color_reward.get_reward.__wrapped__(img)
+    gvals = gval.gval_image(reward)
+    subpxs, centerpx = subpx.find_gval_subpixels.__wrapped__(gval.gval_windows(gvals, MIN_GVAL), reward), subpx.center_pixel(gvals)
+    planes = LaserPlanes(synthetic.fan_planes(), ZedMini.LeftRectHD2K.P)
+    rng = np.random.default_rng(0)
+    pointlines = np.sort(rng.integers(0, len(planes), 500))
+    rows, cols = rng.uniform(0, 1242, 500), rng.uniform(0, 2208, 500)
+    return {"img": img, "reward": reward, "gvals": gvals, "subpxs": subpxs, "centerpx": centerpx,
+            "planes": planes, "rows": rows, "cols": cols, "pointlines": pointlines}
+
+@pytest.mark.parametrize("stage,name", IMPLEMENTATIONS)
+def test_implementation_matches_reference(stage, name, stage_inputs):
+    x = stage_inputs
+    func = Backends.implementations[stage][name][0]
+    if stage == "reward":
+        np.testing.assert_allclose(to_host(func(x["img"])), x["reward"], rtol=1e-6)
+    elif stage == "gval":
+        windows = gval.gval_windows(to_host(func(x["reward"])), MIN_GVAL)
+        expected = gval.calculate_gaussian_integral_windows.__wrapped__(x["reward"], MIN_GVAL)
+        assert windows.shape[0] > 0
+        np.testing.assert_allclose(windows, expected)
+    elif stage == "subpx":
+        subpxs, centerpx = func(x["gvals"], x["reward"], MIN_GVAL)
+        assert np.count_nonzero(x["subpxs"]) > 0
+        np.testing.assert_array_equal(to_host(subpxs), x["subpxs"])
+        np.testing.assert_array_equal(to_host(centerpx), x["centerpx"])
+    elif stage == "patch":
+        kept, patches = func(x["subpxs"])
+        labels = bfs_labels(x["subpxs"], 1e-6, 1, False)
+        sizes = np.bincount(labels.ravel())
+        keep = sizes >= 5
+        keep[0] = False
+        np.testing.assert_array_equal(to_host(kept) != 0, keep[labels])
+        assert len(patches) == np.count_nonzero(keep)
+    elif stage == "3d":
+        out = func(x["planes"], x["rows"], x["cols"], x["pointlines"], np.empty((x["rows"].shape[0], 3)))
+        expected = px_2_3d_many(x["rows"], x["cols"], x["planes"].planes[x["pointlines"]], x["planes"].K)
+        np.testing.assert_allclose(out, expected, rtol=1e-9)
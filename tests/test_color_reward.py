@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from constants import LaserDetection
+from laser_detection import color_reward
+from laser_detection.color_reward import REWARD_MODE_FLOAT32, REWARD_MODE_UINT16, RewardEngine
+
+WEIGHTS = [LaserDetection.DEFAULT_COLOR_WEIGHTS, (0., 1., 0.), (0.2, 0.7, 0.1), (0., 0., 0.)]
+
+def rgb_frame(seed, shape=(120, 300)):
+    '''Random RGB frame as a ROI view of a larger one, like the pipeline passes it, with every value
+    of every channel present'''
+    frame = np.random.default_rng(seed).integers(0, 256, (shape[0] + 2, shape[1] + 3, 3), dtype=np.uint8)
+    frame[1, 1:257] = np.arange(256)[:, None]
+    return frame[1:-1, 1:-2]
+
+def reference(img, weights):
+    return (img.astype(np.float64) * np.asarray(weights)).sum(axis=2)
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+def test_uint16_lut_matches_float(weights):
+    img = rgb_frame(0)
+    engine = RewardEngine(weights, REWARD_MODE_UINT16)
+    out = engine.compute(img, engine.alloc(img.shape))
+    assert out.dtype == np.uint16
+    # every lookup table entry is rounded by at most half a unit
+    np.testing.assert_allclose(out / engine.scale, reference(img, weights), rtol=0, atol=1.5 / engine.scale)
+    # the sum of the tables doesn't wrap around, and uses most of the uint16 range
+    assert sum(int(lut[-1]) for lut in engine.luts) <= np.iinfo(np.uint16).max
+    if sum(weights) > 0:
+        assert sum(int(lut[-1]) for lut in engine.luts) > 0.99 * np.iinfo(np.uint16).max
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+def test_float32_matches_float(weights):
+    img = rgb_frame(1)
+    engine = RewardEngine(weights, REWARD_MODE_FLOAT32)
+    out = engine.compute(img, engine.alloc(img.shape))
+    assert out.dtype == np.float32 and engine.scale == 1.
+    np.testing.assert_allclose(out, reference(img, weights), rtol=1e-6, atol=1e-4)
+    np.testing.assert_allclose(color_reward.get_reward_njit(img, weights), out)
+
+def test_modes_agree_on_scaled_thresholds():
+    img = rgb_frame(2)
+    lut, flt = RewardEngine(mode=REWARD_MODE_UINT16), RewardEngine(mode=REWARD_MODE_FLOAT32)
+    lutout, fltout = lut.compute(img, lut.alloc(img.shape)), flt.compute(img, flt.alloc(img.shape))
+    threshold = np.median(fltout)
+    disagree = (lutout > threshold * lut.scale) != (fltout > threshold)
+    # only rewards within the fixed point error of the threshold can land on different sides
+    assert np.all(np.abs(fltout[disagree] - threshold) <= 1.5 / lut.scale + 1e-4)
+
+def test_dominant_channel():
+    assert RewardEngine((0., 1., 0.), REWARD_MODE_UINT16).dominant_channel == 1
+    assert RewardEngine((0., 0., 2.), REWARD_MODE_FLOAT32).dominant_channel == 2
+    assert RewardEngine((0.5, 1., 0.), REWARD_MODE_FLOAT32).dominant_channel == -1
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        RewardEngine(mode=2)
+    with pytest.raises(ValueError):
+        RewardEngine((1., -1., 0.))
+    engine = RewardEngine()
+    img = rgb_frame(0)
+    with pytest.raises(ValueError):
+        engine.compute(img.astype(np.float32), engine.alloc(img.shape))
+    with pytest.raises(ValueError):
+        engine.compute(img, np.empty(img.shape[:2], dtype=np.float32))
+    with pytest.raises(ValueError):
+        engine.compute(img, engine.alloc((img.shape[0] - 1, img.shape[1])))
+
+def test_njit_backend_reuses_engine_and_buffer():
+    first, second, other = rgb_frame(3), rgb_frame(4), rgb_frame(5, shape=(60, 300))
+    out = color_reward.get_reward_njit(first)
+    np.testing.assert_allclose(out, reference(first, LaserDetection.DEFAULT_COLOR_WEIGHTS), rtol=1e-6, atol=1e-4)
+    assert color_reward.get_reward_njit(second) is out
+    np.testing.assert_allclose(out, reference(second, LaserDetection.DEFAULT_COLOR_WEIGHTS), rtol=1e-6, atol=1e-4)
+    assert color_reward.get_reward_njit(other).shape == other.shape[:2]
+    assert color_reward.get_reward_njit(second, (0., 1., 0.)) is not out
+    engine = color_reward._engines[(0., 1., 0.)]
+    color_reward.get_reward_njit(other, [0, 1, 0])
+    assert color_reward._engines[(0., 1., 0.)] is engine
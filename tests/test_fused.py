@@ -0,0 +1,45 @@
+import glob
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import REPO_DIR
+from constants import LaserDetection
+from laser_detection import fused, gval, subpx
+from util import synthetic
+
+def reference_subpixels(img, min_gval):
+    reward = np.sum(img * np.asarray(LaserDetection.DEFAULT_COLOR_WEIGHTS), axis=2)
+    windows = gval.calculate_gaussian_integral_windows_vec.__wrapped__(reward, min_gval)
+    return subpx.find_gval_subpixels.__wrapped__(windows, reward)
+
+def fused_subpixels(img, min_gval):
+    return fused.subpixel_image(fused.find_gval_subpixels_fused.__wrapped__(img, min_gval), img.shape[:2])
+
+# below ~1500 the windows of the real images reach pixels with a zero reward, where the reference fails
+@pytest.mark.parametrize("min_gval", [1500., 1700., 1910.])
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(REPO_DIR, "test_imgs", "*.png")))[::6])
+def test_fused_matches_reference_on_images(path, min_gval):
+    img = np.asarray(Image.open(path).convert("RGB"))
+    np.testing.assert_array_equal(fused_subpixels(img, min_gval), reference_subpixels(img, min_gval))
+
+@pytest.mark.parametrize("min_gval", [1000., 1500., 1910.])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_fused_matches_reference_on_synthetic_frames(seed, min_gval):
+    img = synthetic.render_frame(640, 360, seed=seed)["img"]
+    expected = reference_subpixels(img, min_gval)
+    assert np.count_nonzero(expected) > 0
+    np.testing.assert_array_equal(fused_subpixels(img, min_gval), expected)
+
+def test_fused_zero_reward_neighbor_uses_com5():
+    img = np.zeros((12, 9, 3), dtype=np.uint8)
+    img[:, 2] = 50
+    img[:, 4] = 255 # -G of the column's windows is 7 * 255 * sum(weights)
+    img[:, 5] = 100
+    img[:, 6] = 50
+    candidates = fused.find_gval_subpixels_fused.__wrapped__(img, LaserDetection.DEFAULT_GVAL_MIN_VAL)
+    assert np.all(candidates[:, 0] == 4)
+    reward = img[0, :, 0] * np.sum(LaserDetection.DEFAULT_COLOR_WEIGHTS)
+    # f(x-1) is 0, so the Gaussian denominator is -inf
+    com5 = (2*reward[6] + reward[5] - reward[3] - 2*reward[2]) / np.sum(reward[2:7])
+    np.testing.assert_allclose(candidates[:, 2], com5)
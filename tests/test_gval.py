@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from constants import LaserDetection
+from laser_detection import gval
+
+def direct_windows(reward, min_gval, winlen):
+    '''The loops of calculate_gaussian_integral_windows for any window length'''
+    windows = []
+    for col in range(reward.shape[1]):
+        for winstart in range(reward.shape[0] - winlen):
+            G = sum((1 - 2*abs(winstart - row + (winlen - 1) / 2)) * reward[row, col] for row in range(winstart, winstart + winlen))
+            if -G >= min_gval:
+                windows.append((col, winstart + winlen//2, -G))
+    return np.array(windows).reshape((-1, 3))
+
+@pytest.mark.parametrize("winlen", [LaserDetection.GVAL_WINLEN, 9, gval.DIRECT_MAX_WINLEN + 5])
+def test_vec_windows_match_loops(winlen):
+    reward = np.random.default_rng(winlen).uniform(0, 300, (60, 7))
+    expected = direct_windows(reward, 1000., winlen)
+    windows = gval.calculate_gaussian_integral_windows_vec.__wrapped__(reward, 1000., winlen)
+    assert expected.shape[0] > 0
+    np.testing.assert_array_equal(windows[:, :2], expected[:, :2])
+    np.testing.assert_allclose(windows[:, 2], expected[:, 2], rtol=1e-9)
+
+def test_default_window_matches_objmode():
+    reward = np.random.default_rng(0).uniform(0, 300, (40, 6))
+    expected = gval.calculate_gaussian_integral_windows.__wrapped__(reward, 500.)
+    np.testing.assert_array_equal(gval.calculate_gaussian_integral_windows_vec.__wrapped__(reward, 500.), expected)
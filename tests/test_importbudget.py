@@ -0,0 +1,8 @@
+import pytest
+from constants import ImportBudget
+from debug import importbudget
+
+@pytest.mark.parametrize("module", list(ImportBudget.BUDGETS))
+def test_import_budget(module):
+    result = importbudget.check(module, ImportBudget.BUDGETS[module] * ImportBudget.SCALE)
+    assert not result["problems"], f"{module}: {'; '.join(result['problems'])}"
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from constants import ZedMini
+from laser_detection.laserplanes import LaserPlanes
+from util import synthetic
+from util.mathutil import px_2_3d_many
+
+K = ZedMini.LeftRectHD2K.P
+
+@pytest.fixture
+def planes():
+    return LaserPlanes(synthetic.fan_planes(), K)
+
+def grouped_points(seed, numlines, numpts=2000):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 1242, numpts), rng.uniform(0, 2208, numpts), np.sort(rng.integers(0, numlines, numpts))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_to_3d_matches_px_2_3d_many(planes, seed):
+    rows, cols, pointlines = grouped_points(seed, len(planes))
+    expected = px_2_3d_many(rows, cols, planes.planes[pointlines], K)
+    np.testing.assert_allclose(planes.to_3d(rows, cols, pointlines), expected, rtol=1e-9)
+    out = np.empty((rows.shape[0], 3), dtype=np.float32)
+    assert planes.to_3d(rows, cols, pointlines, out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+    # points land on their planes
+    pts = planes.to_3d(rows, cols, pointlines)
+    np.testing.assert_allclose((pts * planes.planes[pointlines, :3]).sum(axis=1), -planes.planes[pointlines, 3], atol=1e-9)
+
+def test_plane_coords_map_back_to_3d(planes):
+    rows, cols, _ = grouped_points(0, 1, 200)
+    for line in range(len(planes)):
+        pts = planes.to_3d(rows, cols, np.full(rows.shape[0], line))
+        st = planes.to_plane_coords(rows, cols, line)
+        np.testing.assert_allclose(planes.origins[line] + st @ planes.bases[line], pts, rtol=1e-9, atol=1e-9)
+
+def test_load_matches_calibrate_laser_planes(tmp_path):
+    # calibrate_laser saves planes as (centroid, normal) rows
+    rng = np.random.default_rng(0)
+    centroids, normals = rng.normal(size=(3, 3)) + [0, 0, 2], rng.normal(size=(3, 3))
+    np.save(tmp_path / "planes.npy", np.hstack((centroids, normals)))
+    planes = LaserPlanes.load(str(tmp_path / "planes.npy"), K)
+    np.testing.assert_allclose(planes.planes[:, :3], normals)
+    np.testing.assert_allclose((centroids * normals).sum(axis=1) + planes.planes[:, 3], 0, atol=1e-12)
+
+def test_invalid(planes):
+    with pytest.raises(ValueError):
+        LaserPlanes([(0., 0., 1., 0.)], K)
+    rows, cols, pointlines = grouped_points(0, len(planes), 10)
+    with pytest.raises(ValueError):
+        planes.to_3d(rows, cols, pointlines[::-1])
@@ -0,0 +1,61 @@
+import math
+import numpy as np
+import pytest
+from laser_detection.lineassoc import associate_patches, line_groups
+from laser_detection.patchset import PatchSet
+from util.mathutil import polar_line_distances
+
+def polar_lines(numlines=15):
+    '''Near vertical lines, like the laser lines in a frame'''
+    return [(300. + 100 * idx, 0.05 - 0.005 * idx) for idx in range(numlines)]
+
+def random_patches(seed, numpatches=200):
+    rng = np.random.default_rng(seed)
+    lists = []
+    for _ in range(numpatches):
+        row, col = rng.integers(0, 1200), rng.integers(0, 2200)
+        lists.append([(row + i, col + int(rng.integers(-2, 3)), float(rng.uniform(-0.5, 0.5))) for i in range(rng.integers(1, 10))])
+    return PatchSet.from_lists(lists)
+
+def point_line_distance(y, x, line):
+    '''Distance of a point to a line like the per point loop of the old association'''
+    r, th = line
+    r_p, th_p = math.sqrt(x**2 + y**2), math.atan2(y, x)
+    return abs(r - r_p * math.cos(th - th_p))
+
+def reference(patches, polarlines, maxdistfromline, use_all_points):
+    patchlines = np.full(len(patches), -1)
+    for i, patch in enumerate(patches.to_lists()):
+        if use_all_points:
+            dists = [np.mean([point_line_distance(row, col + offset, line) for row, col, offset in patch]) for line in polarlines]
+        else:
+            dists = [point_line_distance(*patches.centroids[i], line) for line in polarlines]
+        if min(dists) < maxdistfromline:
+            patchlines[i] = int(np.argmin(dists))
+    return patchlines
+
+def test_polar_line_distances():
+    rng = np.random.default_rng(0)
+    rows, cols = rng.uniform(0, 1200, 50), rng.uniform(0, 2200, 50)
+    expected = [[point_line_distance(row, col, line) for line in polar_lines()] for row, col in zip(rows, cols)]
+    np.testing.assert_allclose(polar_line_distances(rows, cols, polar_lines()), expected, atol=1e-9)
+
+@pytest.mark.parametrize("use_all_points", [False, True])
+@pytest.mark.parametrize("seed", range(3))
+def test_associate_patches_matches_loops(seed, use_all_points):
+    patches = random_patches(seed)
+    patchlines = associate_patches.__wrapped__(patches, polar_lines(), 30, use_all_points)
+    np.testing.assert_array_equal(patchlines, reference(patches, polar_lines(), 30, use_all_points))
+    # patches further than the gate from every line are thrown out
+    assert np.any(patchlines == -1) and np.any(patchlines != -1)
+
+def test_associate_nothing():
+    assert associate_patches.__wrapped__(PatchSet.empty(), polar_lines()).shape == (0,)
+    np.testing.assert_array_equal(associate_patches.__wrapped__(random_patches(0, 5), []), [-1] * 5)
+
+def test_line_groups():
+    patchlines = np.random.default_rng(0).integers(-1, 15, 500)
+    groups = line_groups(patchlines, 15)
+    assert len(groups) == 15
+    for line, group in enumerate(groups):
+        np.testing.assert_array_equal(group, np.flatnonzero(patchlines == line))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from laser_detection.patchset import PatchSet
+
+def random_patches(seed, numpatches=20):
+    rng = np.random.default_rng(seed)
+    return [[(int(rng.integers(0, 720)), int(rng.integers(0, 1280)), float(rng.uniform(-0.5, 0.5)))
+             for _ in range(rng.integers(1, 8))] for _ in range(numpatches)]
+
+def reference_summaries(patches):
+    return (np.array([len(p) for p in patches]),
+            np.array([min(c for _, c, _ in p) for p in patches]),
+            np.array([max(c for _, c, _ in p) for p in patches]),
+            np.array([[np.mean([r for r, _, _ in p]), np.mean([c + o for _, c, o in p])] for p in patches]))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_lists_round_trip(seed):
+    lists = random_patches(seed)
+    patches = PatchSet.from_lists(lists)
+    assert len(patches) == len(lists)
+    assert patches.numpts == sum(len(p) for p in lists)
+    assert patches.to_lists() == lists
+    sizes, mincols, maxcols, centroids = reference_summaries(lists)
+    np.testing.assert_array_equal(patches.sizes, sizes)
+    np.testing.assert_array_equal(patches.mincols, mincols)
+    np.testing.assert_array_equal(patches.maxcols, maxcols)
+    np.testing.assert_allclose(patches.centroids, centroids)
+    for i, patch in enumerate(lists):
+        rows, cols, offsets = patches.patch(i)
+        assert list(zip(rows.tolist(), cols.tolist(), offsets.tolist())) == patch
+    np.testing.assert_array_equal(patches.first_points()[1], [p[0][1] for p in lists])
+
+def test_from_lists_drops_empty_patches():
+    lists = random_patches(0, 3)
+    assert PatchSet.from_lists([[], lists[0], [], lists[1], lists[2]]).to_lists() == lists
+
+@pytest.mark.parametrize("seed", range(3))
+def test_from_labels_groups_points_by_label(seed):
+    lists = random_patches(seed)
+    patches = PatchSet.from_lists(lists)
+    # labels needn't be contiguous or start at 0, and points can come in any order
+    labels = patches.patch_ids() * 3 + 7
+    order = np.random.default_rng(seed).permutation(patches.numpts)
+    fromlabels = PatchSet.from_labels(patches.rows[order], patches.cols[order], patches.offsets[order], labels[order])
+    assert [sorted(p) for p in fromlabels.to_lists()] == [sorted(p) for p in lists]
+    # in order points stay in order
+    inorder = PatchSet.from_labels(patches.rows, patches.cols, patches.offsets, labels)
+    assert inorder.to_lists() == lists
+
+@pytest.mark.parametrize("seed", range(3))
+def test_select_and_lines(seed):
+    lists = random_patches(seed)
+    patches = PatchSet.from_lists(lists)
+    indices = np.random.default_rng(seed).permutation(len(lists))[:len(lists) // 2]
+    assert patches.select(indices).to_lists() == [lists[i] for i in indices]
+    assert len(patches.select([])) == 0
+    ids = patches.patch_ids()
+    np.testing.assert_array_equal(ids, [i for i, p in enumerate(lists) for _ in p])
+    patchlines = np.arange(len(lists)) % 5 - 1
+    np.testing.assert_array_equal(patches.point_lines(patchlines), patchlines[ids])
+
+def test_empty():
+    for patches in (PatchSet.empty(), PatchSet.from_lists([]), PatchSet.from_labels([], [], [], [])):
+        assert len(patches) == 0 and patches.numpts == 0
+        assert patches.to_lists() == []
+        assert patches.centroids.shape == (0, 2)
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        PatchSet([0, 1], [0, 1], [0.], [0, 2])
+    with pytest.raises(ValueError):
+        PatchSet([0, 1], [0, 1], [0., 0.], [0, 3])
+    with pytest.raises(ValueError):
+        PatchSet([0, 1], [0, 1], [0., 0.], [0, 0, 2])
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from debug import perfstore
+
+def latencies(rng, median, count):
+    '''Lognormal latencies, skewed like measured ones, with the given median'''
+    return median * rng.lognormal(0, 0.2, count)
+
+def test_speedup_ci_covers_true_ratio():
+    rng = np.random.default_rng(0)
+    trials, covered = 200, 0
+    for _ in range(trials):
+        speedup, low, high = perfstore.speedup_ci(latencies(rng, 2e-3, 50), latencies(rng, 1e-3, 50), numsamples=500, rng=rng)
+        assert low <= speedup <= high
+        covered += low <= 2 <= high
+    # percentile bootstrap of medians undercovers a little on small samples
+    assert covered / trials >= 0.85
+
+def test_speedup_ci_narrows_with_samples():
+    rng = np.random.default_rng(1)
+    widths = []
+    for count in (10, 100, 1000):
+        _, low, high = perfstore.speedup_ci(latencies(rng, 1e-3, count), latencies(rng, 1e-3, count), rng=rng)
+        widths.append(high - low)
+    assert widths[0] > widths[1] > widths[2]
+
+def test_speedup_ci_deterministic():
+    rng = np.random.default_rng(2)
+    base, new = latencies(rng, 2e-3, 30), latencies(rng, 1e-3, 30)
+    assert perfstore.speedup_ci(base, new) == perfstore.speedup_ci(base, new)
+    assert perfstore.speedup_ci(base, new, rng=np.random.default_rng(5)) == perfstore.speedup_ci(base, new, rng=np.random.default_rng(5))
+
+def test_speedup_ci_too_few_samples():
+    speedup, low, high = perfstore.speedup_ci([2e-3], [1e-3, 1e-3])
+    assert speedup == pytest.approx(2)
+    assert np.isnan(low) and np.isnan(high)
+
+def test_compare_flags_regressions_and_improvements():
+    rng = np.random.default_rng(3)
+    def run(run_id, medians):
+        return [perfstore.make_record(run_id, "njit", stage, latencies(rng, median, 40), height=720, width=1280)
+                for stage, median in medians.items()]
+    base = run("base", {"reward": 1e-3, "gval": 1e-3, "subpx": 1e-3})
+    new = run("new", {"reward": 2e-3, "gval": 0.5e-3, "subpx": 1e-3})
+    status = perfstore.compare(base, new).set_index("stage")["status"]
+    assert status.to_dict() == {"gval": "improvement", "reward": "regression", "subpx": ""}
@@ -0,0 +1,84 @@
+import tracemalloc
+import numpy as np
+import pytest
+from debug import perftracker
+from debug.perftracker import PerfTracker
+
+@pytest.fixture
+def sampling():
+    mode, mem_sample_every, buffer_size = PerfTracker.mode, PerfTracker.mem_sample_every, PerfTracker.buffer_size
+    PerfTracker.configure(mode=PerfTracker.MODE_SAMPLING, mem_sample_every=1)
+    yield
+    PerfTracker.configure(mode=mode, mem_sample_every=mem_sample_every)
+    if PerfTracker.buffer_size != buffer_size:
+        PerfTracker.configure(buffer_size=buffer_size)
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''perf_counter_ns that only advances by what tracked calls add to it'''
+    now = [0]
+    monkeypatch.setattr(perftracker.time, "perf_counter_ns", lambda: now[0])
+    return now
+
+@pytest.fixture
+def tracked():
+    names = []
+    def track(name, func):
+        names.append(name)
+        return PerfTracker.track(name)(func)
+    yield track
+    for name in names:
+        del PerfTracker.tracking_data[name]
+
+def test_sampled_call_that_raises_stops_tracing(sampling):
+    @PerfTracker.track("test_raises")
+    def raises():
+        raise ValueError("boom")
+    try:
+        with pytest.raises(ValueError):
+            raises()
+        assert not tracemalloc.is_tracing()
+    finally:
+        del PerfTracker.tracking_data["test_raises"]
+
+def test_ring_wraps_at_capacity(sampling, clock, tracked):
+    PerfTracker.configure(buffer_size=4)
+    def sleep(ns):
+        clock[0] += ns
+    sleep = tracked("test_ring", sleep)
+    for ms in range(1, 7):
+        sleep(ms * 1_000_000)
+    # calls 5 and 6 overwrote the slots of calls 1 and 2
+    np.testing.assert_allclose(PerfTracker.sampled_runtimes("test_ring"), [5e-3, 6e-3, 3e-3, 4e-3])
+    assert PerfTracker.tracking_data["test_ring"]["numcalls"] == 6
+
+def test_memory_sampled_every_nth_call(sampling, tracked):
+    PerfTracker.configure(mem_sample_every=3)
+    def allocate(nbytes):
+        return len(bytearray(nbytes))
+    allocate = tracked("test_mem", allocate)
+    for call in range(7):
+        allocate((call + 1) * 100_000)
+    data = PerfTracker.tracking_data["test_mem"]
+    assert data["numcalls"] == 7 and data["nummemsamples"] == 3
+    # calls 0, 3 and 6 were traced, each peak is its allocation plus a little bookkeeping
+    peaks = data["memring"][:3]
+    expected = np.array([100_000, 400_000, 700_000])
+    assert np.all(peaks >= expected) and np.all(peaks < expected + 50_000)
+    assert PerfTracker.percentiles("test_mem")["test_mem"]["maxmem"] == peaks.max()
+
+def test_percentiles_and_report_in_sampling_mode(sampling, clock, tracked):
+    def sleep(ns):
+        clock[0] += ns
+    sleep = tracked("test_pcts", sleep)
+    for ms in range(1, 101):
+        sleep(ms * 1_000_000)
+    stats = PerfTracker.percentiles("test_pcts")
+    assert list(stats) == ["test_pcts"]
+    expected = np.percentile(np.arange(1, 101) * 1e-3, (50, 90, 99))
+    np.testing.assert_allclose([stats["test_pcts"][p] for p in ("p50", "p90", "p99")], expected)
+    assert stats["test_pcts"]["calls"] == 100 and stats["test_pcts"]["max"] == pytest.approx(0.1)
+    assert stats["test_pcts"]["maxmem"] > 0
+    header, row = PerfTracker.report("test_pcts").splitlines()
+    assert header.split() == ["name", "calls", "p50", "p90", "p99", "max", "maxmem"]
+    assert row.split() == ["test_pcts", "100", *(f"{p * 1e3:.3f}" for p in expected), "100.000", str(stats["test_pcts"]["maxmem"])]
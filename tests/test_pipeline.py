@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+from conftest import PACKAGE_DIR, REPO_DIR
+
+# runs the pipeline without warmup or autotuning, so the detect stage thread makes the first
+# parallel kernel calls
+PIPELINE_SCRIPT = '''
+import glob, sys
+import numpy as np
+from constants import LaserDetection, ZedMini
+from laser_detection.backends import Backends
+from laser_detector import LaserPipeline, LaserPlanes
+LaserDetection.WARMUP = False
+Backends.cache_path = None
+laserplanes = np.load("calib_imgs/Camera_Relative_Laser_Planes.npy", allow_pickle=True)
+planes = [(u, v, w, -u*x -v*y -w*z) for x,y,z,u,v,w in laserplanes]
+pipeline = LaserPipeline(LaserPlanes(planes, ZedMini.LeftRectHD2K.P))
+frames = list(pipeline.run(sorted(glob.glob("test_imgs/image*.png"))[:2]))
+errors = [frame["error"] for frame in frames if "error" in frame]
+print(len(frames), errors)
+sys.exit(1 if errors else 0)
+'''
+
+def test_pipeline_exits_without_warmup():
+    # the interpreter used to hang at exit when numba's thread pool was launched off the main thread
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR, os.path.dirname(PACKAGE_DIR)]), PYTHONWARNINGS="ignore")
+    proc = subprocess.run([sys.executable, "-c", PIPELINE_SCRIPT], cwd=REPO_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert proc.stdout.splitlines()[-1] == "2 []"
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from constants import LaserCalibration
+from util.planefit import PlaneAccumulator, fit_plane_svd, msac_plane, msac_planes
+
+NOISE = LaserCalibration.PLANE_FIT_INLIER_THRESH / 4
+
+def noisy_plane(seed, numpts=2000, outlierratio=0.4):
+    '''Points of a random plane with gaussian noise along its normal and a share of uniform outliers
+    away from the plane as (points, normal, point on the plane, outlier mask)'''
+    rng = np.random.default_rng(seed)
+    normal = rng.normal(size=3)
+    normal /= np.linalg.norm(normal)
+    origin = rng.uniform(-0.5, 0.5, 3) + [0, 0, 1]
+    axes = np.linalg.svd(normal[None])[2][1:] # two unit vectors spanning the plane
+    pts = origin + rng.uniform(-0.3, 0.3, (numpts, 2)) @ axes + rng.normal(0, NOISE, (numpts, 1)) * normal
+    outliers = rng.random(numpts) < outlierratio
+    pts[outliers] = origin + rng.uniform(-0.3, 0.3, (np.count_nonzero(outliers), 3))
+    # drop outliers that fell about the threshold from the plane or closer, they could go either way
+    keep = ~outliers | (np.abs((pts - origin) @ normal) > 2 * LaserCalibration.PLANE_FIT_INLIER_THRESH)
+    return pts[keep], normal, origin, outliers[keep]
+
+@pytest.mark.parametrize("outlierratio", [0., 0.4, 0.7])
+@pytest.mark.parametrize("seed", range(3))
+def test_msac_recovers_noisy_plane(seed, outlierratio):
+    pts, normal, origin, outliers = noisy_plane(seed, outlierratio=outlierratio)
+    centroid, fitnormal, inliers = msac_plane(pts, rng=np.random.default_rng(seed))
+    assert abs(fitnormal @ normal) > 1 - 1e-4
+    assert abs((centroid - origin) @ normal) < NOISE
+    assert not np.any(inliers & outliers)
+    # noise beyond the threshold loses a few true inliers
+    assert np.count_nonzero(inliers) >= 0.95 * np.count_nonzero(~outliers)
+
+def test_msac_subsampled_scoring():
+    pts, normal, _, outliers = noisy_plane(0, numpts=20000)
+    _, fitnormal, inliers = msac_plane(pts, score_pts=500, rng=np.random.default_rng(0))
+    assert abs(fitnormal @ normal) > 1 - 1e-4
+    assert not np.any(inliers & outliers)
+    assert np.count_nonzero(inliers) >= 0.95 * np.count_nonzero(~outliers)
+
+def test_msac_degenerate():
+    assert msac_plane(np.zeros((2, 3))) is None
+    # all samples repeat the same point
+    assert msac_plane(np.ones((10, 3)), max_iters=64) is None
+
+def test_msac_planes_deterministic():
+    pointsets = [noisy_plane(seed)[0] for seed in range(3)]
+    first, second = msac_planes(pointsets, seed=1), msac_planes(pointsets, seed=1)
+    for (c1, n1, i1), (c2, n2, i2), pts in zip(first, second, pointsets):
+        np.testing.assert_array_equal(c1, c2)
+        np.testing.assert_array_equal(n1, n2)
+        np.testing.assert_array_equal(i1, i2)
+        assert abs(n1 @ msac_plane(pts, rng=np.random.default_rng(0))[1]) > 1 - 1e-6
+
+def test_accumulator_matches_svd():
+    pts, _, _, outliers = noisy_plane(0, outlierratio=0.)
+    accumulator = PlaneAccumulator()
+    first = accumulator.add(pts[:1000])
+    accumulator.add(pts[1000:])
+    centroid, normal = fit_plane_svd(pts)
+    fitcentroid, fitnormal, rms = accumulator.plane()
+    np.testing.assert_allclose(fitcentroid, centroid, atol=1e-9)
+    assert abs(fitnormal @ normal) > 1 - 1e-9
+    assert rms == pytest.approx(np.sqrt(np.mean(np.square((pts - centroid) @ normal))), rel=1e-3)
+    accumulator.remove(first)
+    np.testing.assert_allclose(accumulator.plane()[0], pts[1000:].mean(axis=0), atol=1e-9)
+    with pytest.raises(ValueError):
+        accumulator.remove((accumulator.count + 1, np.zeros(3), np.zeros((3, 3))))
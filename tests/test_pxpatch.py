@@ -0,0 +1,71 @@
+from collections import deque
+import numpy as np
+import pytest
+from laser_detection import pxpatch
+
+def bfs_labels(img, minval, reach, box):
+    '''Flood fill labeling, patches numbered in the row major order of their first pixel'''
+    rows, cols = img.shape
+    labels = np.zeros((rows, cols), dtype=np.int32)
+    if box:
+        steps = [(i, j) for i in range(-reach, reach+1) for j in range(-reach, reach+1) if (i, j) != (0, 0)]
+    else:
+        steps = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    numpatches = 0
+    for row in range(rows):
+        for col in range(cols):
+            if not img[row, col] > minval or labels[row, col] != 0:
+                continue
+            numpatches += 1
+            labels[row, col] = numpatches
+            toexplore = deque([(row, col)])
+            while toexplore:
+                r, c = toexplore.popleft()
+                for i, j in steps:
+                    if 0 <= r+i < rows and 0 <= c+j < cols and img[r+i, c+j] > minval and labels[r+i, c+j] == 0:
+                        labels[r+i, c+j] = numpatches
+                        toexplore.append((r+i, c+j))
+    return labels
+
+def sparse_image(seed, density=0.3, shape=(40, 50)):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(shape) < density, rng.uniform(0.01, 1, shape), 0.)
+
+@pytest.mark.parametrize("immediate", [True, False])
+@pytest.mark.parametrize("seed", range(4))
+def test_union_find_labels_match_bfs(seed, immediate):
+    img = sparse_image(seed, 0.3 if immediate else 0.05)
+    labels, sizes, bboxes = pxpatch.label_patches(img, 1e-6, immediate)
+    expected = bfs_labels(img, 1e-6, 1 if immediate else 3, not immediate)
+    np.testing.assert_array_equal(labels, expected)
+    np.testing.assert_array_equal(sizes, np.bincount(expected.ravel())[1:])
+    for k in range(1, sizes.shape[0] + 1):
+        rows, cols = np.nonzero(expected == k)
+        assert tuple(bboxes[k-1]) == (rows.min(), cols.min(), rows.max(), cols.max())
+
+@pytest.mark.parametrize("seed", range(4))
+def test_small_patches_thrown_out(seed):
+    img = sparse_image(seed)
+    kept, patches = pxpatch.throw_out_small_patches.__wrapped__(img, min_size=5)
+    expected = bfs_labels(img, 1e-6, 1, False)
+    sizes = np.bincount(expected.ravel())
+    keep = sizes >= 5
+    keep[0] = False
+    np.testing.assert_array_equal(kept != 0, keep[expected])
+    # one patch per kept component, its pixels in row major order
+    assert len(patches) == np.count_nonzero(keep)
+    for (rows, cols, offsets), label in zip((patches.patch(i) for i in range(len(patches))), np.flatnonzero(keep)):
+        exprows, expcols = np.nonzero(expected == label)
+        np.testing.assert_array_equal(rows, exprows)
+        np.testing.assert_array_equal(cols, expcols)
+        np.testing.assert_array_equal(offsets, img[exprows, expcols])
+
+@pytest.mark.parametrize("immediate", [True, False])
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (5, 8)])
+def test_fully_lit_image_is_one_patch(shape, immediate):
+    # the python function raises on out of bounds writes, which nopython mode doesn't check
+    for label_patches in (pxpatch.label_patches, pxpatch.label_patches.py_func):
+        labels, sizes, bboxes = label_patches(np.ones(shape), 1e-6, immediate)
+        assert np.all(labels == 1)
+        np.testing.assert_array_equal(sizes, [shape[0] * shape[1]])
+        np.testing.assert_array_equal(bboxes, [(0, 0, shape[0] - 1, shape[1] - 1)])
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+import pytest
+from constants import ZedMini
+from util import raytable
+from util.mathutil import px_2_3d_many
+from util.raytable import RayTable
+
+K = ZedMini.LeftRectHD2K.P[:3,:3]
+SHAPE = (124, 220)
+PLANE = (0.1, -0.05, 1., -1.5)
+
+def test_rays_match_intrinsics(tmp_path):
+    table = RayTable(K, SHAPE, cache_dir=str(tmp_path))
+    rows, cols = np.meshgrid(np.arange(SHAPE[0]), np.arange(SHAPE[1]), indexing="ij")
+    np.testing.assert_allclose(table.table[..., 0], (cols - K[0,2]) / K[0,0], rtol=1e-6)
+    np.testing.assert_allclose(table.table[..., 1], (rows - K[1,2]) / K[1,1], rtol=1e-6)
+
+def test_px_2_3d_many_matches_mathutil(tmp_path):
+    table = RayTable(K, SHAPE, cache_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    # subpixel columns interpolate, past the last pixel center they extrapolate
+    rows, cols = rng.integers(0, SHAPE[0], 1000), rng.uniform(0, SHAPE[1], 1000)
+    expected = px_2_3d_many(rows, cols, PLANE, K)
+    # rays are stored as float32
+    np.testing.assert_allclose(table.px_2_3d_many(rows, cols, PLANE), expected, rtol=1e-5)
+    planes = rng.normal(size=(1000, 4)) + PLANE
+    np.testing.assert_allclose(table.px_2_3d_many(rows, cols, planes), px_2_3d_many(rows, cols, planes, K), rtol=1e-4)
+
+def test_cache_rebuilt_when_camera_changes(tmp_path):
+    cache_dir = str(tmp_path)
+    table = RayTable(K, SHAPE, cache_dir=cache_dir)
+    mtime = os.stat(table.path).st_mtime_ns
+    # the same camera maps the cached file
+    again = RayTable(K.copy(), SHAPE, cache_dir=cache_dir)
+    assert again.path == table.path and os.stat(again.path).st_mtime_ns == mtime
+    assert not again.table.flags.writeable
+
+    otherK = K.copy()
+    otherK[0,0] *= 1.01
+    changed = {
+        "K": RayTable(otherK, SHAPE, cache_dir=cache_dir),
+        "D": RayTable(K, SHAPE, D=np.array([-0.17, 0.03, 0., 0., 0.]), cache_dir=cache_dir),
+        "shape": RayTable(K, (SHAPE[0] + 2, SHAPE[1]), cache_dir=cache_dir),
+    }
+    assert len({table.path} | {other.path for other in changed.values()}) == 4
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(t.path) for t in [table] + list(changed.values()))
+    np.testing.assert_allclose(changed["K"].table[0, :, 0], (np.arange(SHAPE[1]) - K[0,2]) / otherK[0,0], rtol=1e-6)
+    assert not np.allclose(changed["D"].table, table.table)
+    assert changed["shape"].table.shape == (SHAPE[0] + 2, SHAPE[1], 2)
+    # an empty distortion vector is no distortion
+    assert RayTable(K, SHAPE, D=np.array([]), cache_dir=cache_dir).path == table.path
+
+def test_get_ray_table_maps_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(raytable, "_tables", {})
+    monkeypatch.setattr(RayTable.__init__, "__defaults__", (None, str(tmp_path)))
+    first = raytable.get_ray_table(K, SHAPE)
+    assert raytable.get_ray_table(K.copy(), SHAPE) is first
+    assert raytable.get_ray_table(K, (SHAPE[0], SHAPE[1] + 1)) is not first
+    assert os.path.dirname(first.path) == str(tmp_path)
+
+D = np.array([-0.17, 0.03, 0.001, -0.0005, -0.002])
+
+@pytest.mark.parametrize("D", [D, D[:4], np.array([-0.1, 0.01, 0., 0.])])
+def test_undistort_matches_opencv(D):
+    import cv2 as cv
+    rng = np.random.default_rng(0)
+    pxs = np.stack((rng.uniform(0, 2208, 500), rng.uniform(0, 1242, 500)), axis=1)
+    x, y = raytable.undistort_normalized((pxs[:,0] - K[0,2]) / K[0,0], (pxs[:,1] - K[1,2]) / K[1,1], D)
+    expected = cv.undistortPoints(pxs.reshape((-1, 1, 2)), K, D).reshape((-1, 2))
+    np.testing.assert_allclose(x, expected[:,0], atol=1e-12)
+    np.testing.assert_allclose(y, expected[:,1], atol=1e-12)
+    # missing trailing coefficients are zero
+    shortx, shorty = raytable.undistort_normalized((pxs[:,0] - K[0,2]) / K[0,0], (pxs[:,1] - K[1,2]) / K[1,1], np.trim_zeros(D, "b"))
+    np.testing.assert_array_equal(shortx, x)
+    np.testing.assert_array_equal(shorty, y)
+
+def test_undistorting_table_matches_opencv(tmp_path):
+    import cv2 as cv
+    table = RayTable(K, SHAPE, D=D, cache_dir=str(tmp_path))
+    rows, cols = np.meshgrid(np.arange(SHAPE[0]), np.arange(SHAPE[1]), indexing="ij")
+    pxs = np.stack((cols.ravel(), rows.ravel()), axis=1).astype(np.float64)
+    expected = cv.undistortPoints(pxs.reshape((-1, 1, 2)), K, D).reshape(SHAPE + (2,))
+    # rays are stored as float32
+    np.testing.assert_allclose(table.table, expected, rtol=1e-6, atol=1e-7)
+
+def test_camera_ray_table(tmp_path, monkeypatch):
+    from constants import Camera
+    monkeypatch.setattr(raytable, "_tables", {})
+    monkeypatch.setattr(RayTable.__init__, "__defaults__", (None, str(tmp_path)))
+    rectified = raytable.get_camera_ray_table(ZedMini.LeftRectHD2K, SHAPE)
+    assert rectified.D is None
+    np.testing.assert_array_equal(rectified.K, ZedMini.LeftRectHD2K.P)
+    raw = Camera(D=D, K=K, R=np.eye(3), P=ZedMini.LeftRectHD2K.P)
+    undistorting = raytable.get_camera_ray_table(raw, SHAPE)
+    np.testing.assert_array_equal(undistorting.D, D)
+    assert undistorting.path != rectified.path
@@ -0,0 +1,101 @@
+from collections import deque
+import time
+import numpy as np
+import pytest
+from laser_detection.backends import Backends
+from laser_detection.patchset import PatchSet
+from util import synthetic
+import laser_detector
+from laser_detector import NUM_LASER_LINES, SEGMENT_MAX_SPAN_TREE
+
+@pytest.fixture(scope="module")
+def frame():
+    '''Synthetic frame whose lines are far enough apart for the patch graph to split into several trees'''
+    frame = synthetic.render_resolution("720p", seed=0, planes=synthetic.fan_planes(fan_angle=70.))
+    reward = Backends.get("reward")(frame["img"])
+    gvals = Backends.get("gval")(reward)
+    subpxs, _ = Backends.get("subpx")(gvals, reward, laser_detector.DEFAULT_GVAL_MIN_VAL)
+    subpxsfiltered, patches = Backends.get("patch")(subpxs)
+    frame["binary"] = (subpxsfiltered != 0).astype(np.uint8) * 255
+    frame["patches"] = patches
+    # true line of each patch, that of the true line point nearest to most of its points
+    truecols = np.full((frame["img"].shape[0], NUM_LASER_LINES), np.inf)
+    truecols[frame["rows"].astype(int), frame["lines"]] = frame["cols"]
+    nearest = np.argmin(np.abs(truecols[patches.rows] - patches.cols[:, None]), axis=1)
+    frame["patchtruth"] = np.array([np.bincount(nearest[patches.patch_ids() == i]).argmax() for i in range(len(patches))])
+    centerpatch = np.flatnonzero(frame["patchtruth"] == NUM_LASER_LINES // 2)[0]
+    frame["centerdot"] = (patches.rows[patches.patch_ptr[centerpatch]], patches.cols[patches.patch_ptr[centerpatch]])
+    frame["centerpatch"] = centerpatch
+    return frame
+
+def scan_edges(img, patches, mingap=10, maxgap=100):
+    '''Patch neighbor edges found by scanning the binary image right of every point, like the dense graph did'''
+    owner = np.full(img.shape, -1)
+    owner[patches.rows, patches.cols] = patches.patch_ids()
+    edges = {}
+    for row, col, patch in zip(patches.rows.tolist(), patches.cols.tolist(), patches.patch_ids().tolist()):
+        nextcol = col + 1
+        while nextcol < img.shape[1] and nextcol - col < maxgap and img[row, nextcol] == 0:
+            nextcol += 1
+        if nextcol < img.shape[1] and mingap < nextcol - col < maxgap and patches.mincols[owner[row, nextcol]] > patches.mincols[patch]:
+            edges.setdefault((patch, owner[row, nextcol]), set()).add(row)
+    return {edge: len(rows) for edge, rows in edges.items()}
+
+def bfs_lines(numpatches, left, right, centerpatch):
+    '''Line indexing of the tree holding the center patch, -1 elsewhere'''
+    neighbors = [[] for _ in range(numpatches)]
+    for l, r in zip(left.tolist(), right.tolist()):
+        neighbors[l].append((r, 1))
+        neighbors[r].append((l, -1))
+    patchlines = np.full(numpatches, -1)
+    patchlines[centerpatch] = NUM_LASER_LINES // 2
+    toexplore = deque([centerpatch])
+    while toexplore:
+        patch = toexplore.popleft()
+        for child, step in neighbors[patch]:
+            if patchlines[child] == -1:
+                patchlines[child] = min(max(0, patchlines[patch] + step), NUM_LASER_LINES - 1)
+                toexplore.append(child)
+    return patchlines
+
+def mst_edges(patches):
+    left, right, weights = laser_detector.patch_row_edges(patches)
+    order = np.argsort(-weights, kind="stable")
+    intree = laser_detector.maximum_spanning_forest(len(patches), left[order], right[order])
+    return left[order][intree], right[order][intree]
+
+def test_row_edges_match_image_scan(frame):
+    patches = frame["patches"]
+    left, right, weights = laser_detector.patch_row_edges(patches)
+    assert dict(zip(zip(left.tolist(), right.tolist()), weights.tolist())) == scan_edges(frame["binary"], patches)
+
+def test_mst_center_tree_matches_bfs(frame):
+    patches = frame["patches"]
+    expected = bfs_lines(len(patches), *mst_edges(patches), frame["centerpatch"])
+    patchlines = laser_detector.segment_laser_lines(frame["binary"], SEGMENT_MAX_SPAN_TREE, patches, frame["centerdot"])
+    centertree = expected != -1
+    assert np.any(~centertree), "the frame should have trees without the center patch"
+    assert np.array_equal(patchlines[centertree], expected[centertree])
+
+def test_mst_labels_every_tree(frame):
+    patches = frame["patches"]
+    patchlines = laser_detector.segment_laser_lines(frame["binary"], SEGMENT_MAX_SPAN_TREE, patches, frame["centerdot"])
+    assert np.all((patchlines >= 0) & (patchlines < NUM_LASER_LINES))
+    assert np.mean(patchlines == frame["patchtruth"]) >= 0.9
+
+def test_mst_without_center_dot_labels_every_patch(frame):
+    patchlines = laser_detector.segment_laser_lines(frame["binary"], SEGMENT_MAX_SPAN_TREE, frame["patches"], np.zeros(2, dtype=int))
+    assert np.all(patchlines >= 0)
+
+@pytest.mark.parametrize("stagger", [False, True])
+def test_mst_scales_to_thousands_of_trees(stagger):
+    '''4000 isolated 5 px patches, too far apart to share edges so each is its own tree, placed by
+    their row neighbors or, staggered onto rows of their own, by the nearest line'''
+    numpatches, perrow = 4000, 40
+    patches = PatchSet.from_lists([[((i // perrow) * 5 + (i % perrow if stagger else 0) * 1000 + j, (i % perrow) * 150, 0.) for j in range(5)]
+                                   for i in range(numpatches)])
+    start = time.perf_counter()
+    patchlines = laser_detector.segment_laser_lines(None, SEGMENT_MAX_SPAN_TREE, patches, np.zeros(2, dtype=int))
+    # quadratic placement took about 9 s
+    assert time.perf_counter() - start < 2
+    assert np.all((patchlines >= 0) & (patchlines < NUM_LASER_LINES))
@@ -0,0 +1,82 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+from util import sharedimages
+
+def _sum_and_release(name, spec):
+    img = sharedimages.shared_image(name, spec)
+    total = int(img.sum())
+    del img
+    sharedimages.release(name)
+    return total, len(sharedimages._attached)
+
+def test_workers_release_blocks():
+    imgs = [np.arange(12, dtype=np.uint8).reshape((3, 4)), np.ones((2, 2, 3), dtype=np.float32)]
+    with sharedimages.SharedImages(imgs) as shared, ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(_sum_and_release, [shared.name] * len(imgs), shared.specs))
+    assert results == [(int(img.sum()), 0) for img in imgs]
+
+def test_release_all_skips_blocks_still_viewed():
+    with sharedimages.SharedImages([np.zeros((2, 2))]) as shared:
+        img = sharedimages.shared_image(shared.name, shared.specs[0])
+        sharedimages.release_all()
+        assert shared.name in sharedimages._attached
+        del img
+        sharedimages.release_all()
+        assert shared.name not in sharedimages._attached
+
+def test_pool_results_log_plane_progress(capsys):
+    import calibrate_laser
+    linepts = [np.random.default_rng(line).normal(size=(10, 3)) * (1, 1, 0.001) for line in range(calibrate_laser.NUM_LASER_LINES)]
+    futures = [Future() for _ in range(3)]
+    for future, result in zip(futures, (linepts, None, linepts)):
+        future.set_result(result)
+    assert calibrate_laser.gather_image_points(futures) == [linepts, None, linepts]
+    assert capsys.readouterr().out.count("Running plane rms residuals") == 2
+
+def test_main_unlinks_every_set_when_one_fails(monkeypatch):
+    import calibrate_laser
+    from concurrent.futures import ThreadPoolExecutor
+    from multiprocessing import shared_memory
+    created = []
+    class RecordedImages(sharedimages.SharedImages):
+        def __init__(self, imgs):
+            super().__init__(imgs)
+            created.append(self.name)
+    def failing_gather(futures):
+        [future.result() for future in futures]
+        raise RuntimeError("set failed")
+    monkeypatch.setattr(sharedimages, "SharedImages", RecordedImages)
+    monkeypatch.setattr(calibrate_laser, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(calibrate_laser, "load_calibration_imgs", lambda folder: [("a.png", np.zeros((4, 4, 3), dtype=np.uint8))])
+    monkeypatch.setattr(calibrate_laser, "calibration_image_points", lambda *args, **kwargs: None)
+    monkeypatch.setattr(calibrate_laser, "gather_image_points", failing_gather)
+    info = [("set0", 0.02, (7, 9), 1910.), ("set1", 0.02, (7, 9), 1910.), ("set2", 0.02, (7, 9), 1910.)]
+    try:
+        calibrate_laser.main(info, workers=2)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("main did not propagate the failure")
+    assert len(created) == len(info)
+    for name in created:
+        try:
+            shared_memory.SharedMemory(name=name).close()
+        except FileNotFoundError:
+            continue
+        raise AssertionError(f"{name} was not unlinked")
+
+def test_points_key_changes_with_detection_parameters(monkeypatch):
+    import calibrate_laser
+    img = np.arange(48, dtype=np.uint8).reshape((4, 4, 3))
+    key = lambda: calibrate_laser.calibration_points_key(img, 0.02, (7, 9), 1910.)
+    keys = {key()}
+    for target, name, value in (
+            (calibrate_laser, "MERGE_HLP_LINES_ANG_THRESH", 4),
+            (calibrate_laser, "MERGE_HLP_LINE_DIST_THRESH", 21),
+            (calibrate_laser.LaserDetection, "MIN_PATCH_SIZE", 6)):
+        with monkeypatch.context() as patched:
+            patched.setattr(target, name, value)
+            keys.add(key())
+    assert len(keys) == 4
+    assert key() in keys
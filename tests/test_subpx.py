@@ -0,0 +1,32 @@
+import glob
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from conftest import REPO_DIR
+from laser_detection import color_reward, gval, subpx
+from laser_detection.backends import Backends
+from util import synthetic
+
+def frames():
+    paths = sorted(glob.glob(os.path.join(REPO_DIR, "test_imgs", "image*.png")))[:2]
+    yield from (np.asarray(Image.open(path).convert("RGB")) for path in paths)
+    yield synthetic.render_frame(640, 360)["img"]
+
+@pytest.mark.parametrize("min_gval", [1500., 1910., 2500.])
+def test_njit_subpixels_match_reference(min_gval):
+    for img in frames():
+        reward = color_reward.get_reward.__wrapped__(img)
+        gvalimg = gval.gval_image(reward)
+        expected = subpx.find_gval_subpixels.__wrapped__(gval.gval_windows(gvalimg, min_gval), reward)
+        np.testing.assert_array_equal(subpx.find_gval_subpixels_gpu.__wrapped__(gvalimg, reward, min_gval), expected)
+
+def test_njit_backend_matches_objmode_backend():
+    assert "njit" in Backends.available("subpx")
+    njit, objmode = Backends.implementations["subpx"]["njit"][0], Backends.implementations["subpx"]["objmode"][0]
+    for img in frames():
+        reward = color_reward.get_reward.__wrapped__(img)
+        gvalimg = gval.gval_image(reward)
+        (subpxs, centerpx), (expected, expectedcenter) = njit(gvalimg, reward, 1910.), objmode(gvalimg, reward, 1910.)
+        np.testing.assert_array_equal(subpxs, expected)
+        np.testing.assert_array_equal(centerpx, expectedcenter)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from constants import ZedMini
+import laser_detector
+from laser_detection.patchset import PatchSet
+from util import synthetic
+from util.mathutil import px_2_3d, px_2_3d_many
+
+K = ZedMini.LeftRectHD2K.P
+PLANES = synthetic.fan_planes()
+
+def random_points(seed, numpts=1000):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 1242, numpts), rng.uniform(0, 2208, numpts), rng.integers(0, PLANES.shape[0], numpts)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_px_2_3d_many_matches_px_2_3d(seed):
+    rows, cols, lines = random_points(seed)
+    expected = np.array([px_2_3d(row, col, PLANES[line], K) for row, col, line in zip(rows, cols, lines)])
+    # one plane per point
+    np.testing.assert_allclose(px_2_3d_many(rows, cols, PLANES[lines], K), expected, rtol=1e-12)
+    # one plane for all points, into a float32 buffer
+    out = np.empty((rows.shape[0], 3), dtype=np.float32)
+    assert px_2_3d_many(rows, cols, PLANES[0], K, out=out) is out
+    np.testing.assert_allclose(out, [px_2_3d(row, col, PLANES[0], K) for row, col in zip(rows, cols)], rtol=1e-6)
+
+def test_px_2_3d_many_parallel_ray(capsys):
+    # the ray through the principal point runs along z, parallel to a plane z = -d with c = 0
+    pts = px_2_3d_many(np.array([K[1,2]]), np.array([K[0,2]]), (1., 0., 0., -1.), K)
+    assert not np.all(np.isfinite(pts))
+    assert capsys.readouterr().out == ""
+
+@pytest.mark.parametrize("seed", range(3))
+def test_extract_laser_points_matches_per_point(seed):
+    rng = np.random.default_rng(seed)
+    patches = PatchSet.from_lists([[(int(rng.integers(0, 600)) + i, int(rng.integers(0, 1200)), float(rng.uniform(-0.5, 0.5))) for i in range(5)] for _ in range(100)])
+    patchlines = rng.integers(-1, PLANES.shape[0], len(patches))
+    offset = (300, 500)
+    pts, pointlines = laser_detector.extract_laser_points(PLANES, patches, patchlines, offset)
+    assert pts.dtype == np.float32
+    # grouped by line in increasing line order, points of patches on no line left out
+    expected, expectedlines = [], []
+    for line in range(PLANES.shape[0]):
+        for patch in np.flatnonzero(patchlines == line):
+            for row, col, subpx in zip(*patches.patch(patch)):
+                expected.append(px_2_3d(row + offset[0], col + offset[1] + subpx, PLANES[line], K))
+                expectedlines.append(line)
+    np.testing.assert_array_equal(pointlines, expectedlines)
+    np.testing.assert_allclose(pts, expected, rtol=1e-6)
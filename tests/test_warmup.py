@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+from conftest import PACKAGE_DIR, REPO_DIR
+
+# fills the kernel cache like a warmup in a previous run
+WARMUP_SCRIPT = '''
+from PIL import Image
+from laser_detection.warmup import warmup
+from laser_detector import LaserPipeline
+pipeline = LaserPipeline(None)
+width, height = Image.open("test_imgs/image01.png").size
+rowmin, rowmax, colmin, colmax = pipeline.roi_bounds((height, width))
+warmup([(rowmax - rowmin, colmax - colmin)], workers=1, stamp_path=None)
+'''
+
+# warms up again, which should only load kernels from the cache, then runs a frame through the
+# pipeline and prints the kernels that compiled anything new on it and the cached kernels that
+# missed the cache in this process
+FRAME_SCRIPT = '''
+import json
+import numpy as np
+from numba.core.caching import NullCache
+from numba.core.dispatcher import Dispatcher
+from PIL import Image
+from constants import ZedMini
+from laser_detection import color_reward, fused, gval, pxpatch, subpx
+from laser_detection.backends import Backends
+from laser_detection.warmup import warmup
+import laser_detector
+from laser_detector import LaserPipeline, LaserPlanes
+Backends.cache_path = None
+
+def dispatchers():
+    found = {}
+    for module in (color_reward, fused, gval, pxpatch, subpx, laser_detector):
+        for name, obj in vars(module).items():
+            while hasattr(obj, "__wrapped__") and not isinstance(obj, Dispatcher):
+                obj = obj.__wrapped__
+            if isinstance(obj, Dispatcher):
+                found[f"{module.__name__}.{name}"] = obj
+    return found
+
+laserplanes = np.load("calib_imgs/Camera_Relative_Laser_Planes.npy", allow_pickle=True)
+planes = [(u, v, w, -u*x -v*y -w*z) for x,y,z,u,v,w in laserplanes]
+pipeline = LaserPipeline(LaserPlanes(planes, ZedMini.LeftRectHD2K.P))
+width, height = Image.open("test_imgs/image01.png").size
+rowmin, rowmax, colmin, colmax = pipeline.roi_bounds((height, width))
+warmup([(rowmax - rowmin, colmax - colmin)], workers=1, stamp_path=None)
+before = {name: set(dispatcher.signatures) for name, dispatcher in dispatchers().items()}
+frames = list(pipeline.run(["test_imgs/image01.png"]))
+compiled = sorted(name for name, dispatcher in dispatchers().items() if set(dispatcher.signatures) != before.get(name, set()))
+misses = sorted(name for name, dispatcher in dispatchers().items()
+                if not isinstance(dispatcher._cache, NullCache) and sum(dispatcher.stats.cache_misses.values()))
+print(json.dumps({"errors": [repr(frame["error"]) for frame in frames if "error" in frame], "compiled": compiled, "misses": misses}))
+'''
+
+def test_first_frame_after_warmup_doesnt_compile(tmp_path):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PACKAGE_DIR, os.path.dirname(PACKAGE_DIR)]),
+               PYTHONWARNINGS="ignore", NUMBA_CACHE_DIR=str(tmp_path))
+    for script in (WARMUP_SCRIPT, FRAME_SCRIPT):
+        proc = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, env=env,
+                              capture_output=True, text=True, timeout=600)
+        assert proc.returncode == 0, proc.stdout + proc.stderr
+    result = json.loads(proc.stdout.splitlines()[-1])
+    assert result == {"errors": [], "compiled": [], "misses": []}